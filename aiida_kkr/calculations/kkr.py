@@ -18,8 +18,9 @@ from aiida_kkr.tools.common_workfunctions import (generate_inputcard_from_struct
                                                   check_2Dinput_consistency, update_params_wf,
                                                   vca_check)
 from masci_tools.io.common_functions import get_alat_from_bravais, get_Ang2aBohr
-from aiida_kkr.tools.tools_kkrimp import make_scoef
+from aiida_kkr.tools.tools_kkrimp import make_scoef, get_potential_index, read_potential_blocks
 from masci_tools.io.kkr_params import __kkr_default_params__
+from aiida_kkr.data.kkrqdos import KkrQdosData
 import six
 from six.moves import range
 
@@ -28,6 +29,7 @@ RemoteData = DataFactory('remote')
 Dict = DataFactory('dict')
 StructureData = DataFactory('structure')
 KpointsData = DataFactory('array.kpoints')
+ArrayData = DataFactory('array')
 
 
 __copyright__ = (u"Copyright (c), 2017, Forschungszentrum Jülich GmbH, "
@@ -121,6 +123,7 @@ class KkrCalculation(CalcJob):
         spec.input('metadata.options.parser_name', valid_type=six.string_types, default=cls._default_parser, non_db=True)
         spec.input('metadata.options.input_filename', valid_type=six.string_types, default=cls._DEFAULT_INPUT_FILE, non_db=True)
         spec.input('metadata.options.output_filename', valid_type=six.string_types, default=cls._DEFAULT_OUTPUT_FILE, non_db=True)
+        spec.input('metadata.options.parser_profile', valid_type=six.string_types, default='full', non_db=True, help='Sections of the output that are parsed: `full` (everything), `scf` (everything needed in the kkr_scf workflow) or `minimal` (convergence info and energies). Skipped sections can be parsed later with `aiida_kkr.tools.kkr_parser_profiles.LazyKkrOutput`.')
         # define input nodes (optional ones have required=False)
         spec.input('parameters', valid_type=Dict, required=True, help='Use a node that specifies the input parameters')
         spec.input('parent_folder', valid_type=RemoteData, required=True, help='Use a remote or local repository folder as parent folder (also for restarts and similar). It should contain all the  needed files for a KKR calc, only edited files should be uploaded from the repository.')
@@ -128,6 +131,8 @@ class KkrCalculation(CalcJob):
         spec.input('kpoints', valid_type=KpointsData, required=False, help="Use a KpointsData node that specifies the kpoints for which a bandstructure (i.e. 'qdos') calculation should be performed.")
         # define outputs
         spec.output('output_parameters', valid_type=Dict, required=True, help='results of the KKR calculation')
+        spec.output('convergence_arrays', valid_type=ArrayData, required=False, help='per-iteration histories of the KKR calculation (rms error, charge neutrality, total energy, moments, ...)')
+        spec.output('qdos_data', valid_type=KkrQdosData, required=False, help='spectral function of a bandstructure (qdos) calculation, stored as .npy arrays that are read with memory mapping')
         spec.default_output_node = 'output_parameters'
         # define exit codes, also used in parser
         spec.exit_code(301, 'ERROR_NO_OUTPUT_FILE', message='KKR output file not found')
@@ -427,20 +432,20 @@ class KkrCalculation(CalcJob):
                     local_copy_list.remove(potcopy_info)
                     # create potential here by readin in old potential and overwriting with changed Fermi energy
                     with tempfolder.open(self._POTENTIAL, 'w') as pot_new_ef:
-                        # change potential
-                        txt = potfile.readlines()
-                        potstart = []
-                        for iline in range(len(txt)):
-                            line = txt[iline]
-                            if 'exc:' in line:
-                                potstart.append(iline)
-                        for ipotstart in potstart:
-                            tmpline = txt[ipotstart+3]
-                            tmpline = tmpline.split()
-                            newline = '%10.5f%20.14f%20.14f\n'%(float(tmpline[0]), ef_set, float(tmpline[-1]))
-                            txt[ipotstart+3] = newline
-                        # write new file
-                        pot_new_ef.writelines(txt)
+                        # change potential block by block (each block starts with the 'exc:' line of an atom)
+                        blocks = get_potential_index(potfile, mode='pot')
+                        # lines in front of the first potential are kept as they are
+                        if len(blocks)>0 and blocks[0][0]>0:
+                            blocks = [(0, blocks[0][0])] + blocks
+                        for block in read_potential_blocks(potfile, blocks):
+                            txt = block.splitlines(True)
+                            if 'exc:' in txt[0]:
+                                tmpline = txt[3]
+                                tmpline = tmpline.split()
+                                newline = '%10.5f%20.14f%20.14f\n'%(float(tmpline[0]), ef_set, float(tmpline[-1]))
+                                txt[3] = newline
+                            # write new file
+                            pot_new_ef.writelines(txt)
                     # now this directory contains the updated potential file, thus it is not needed to put it in the local copy list anymore
 
             # TODO different copy lists, depending on the keywors input
@@ -15,10 +15,10 @@ from masci_tools.io.kkr_params import kkrparams
 from .voro import VoronoiCalculation
 from .kkr import KkrCalculation
 from aiida_kkr.tools.tools_kkrimp import modify_potential
-from aiida_kkr.tools.tools_kkrimp import make_scoef
+from aiida_kkr.tools.tools_kkrimp import make_scoef, get_output_archive, copy_archive_member
+from aiida_kkr.tools.scoef_cache import ScoefCache, get_scoef_cache_key, get_shapefun_cache_key
 from masci_tools.io.common_functions import search_string
 import os
-import tarfile
 from numpy import array, sqrt, sum, where
 import six
 from six.moves import range
@@ -26,12 +26,13 @@ from six.moves import range
 Dict = DataFactory('dict')
 RemoteData = DataFactory('remote')
 SinglefileData = DataFactory('singlefile')
+ArrayData = DataFactory('array')
 
 
 __copyright__ = (u"Copyright (c), 2018, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.5.1"
+__version__ = "0.5.2"
 __contributors__ = (u"Philipp Rüßmann", u"Fabian Bertoldo")
 
 #TODO: implement 'ilayer_center' consistency check
@@ -109,6 +110,8 @@ class KkrimpCalculation(CalcJob):
         spec.input('metadata.options.parser_name', valid_type=six.string_types, default=cls._default_parser, non_db=True)
         spec.input('metadata.options.input_filename', valid_type=six.string_types, default=cls._DEFAULT_INPUT_FILE , non_db=True)       
         spec.input('metadata.options.output_filename', valid_type=six.string_types, default=cls._DEFAULT_OUTPUT_FILE, non_db=True)
+        spec.input('metadata.options.archive_compression', valid_type=six.string_types, default='gz', non_db=True, help='Compression of the tarball of the output files that is created by the parser (gz, gz_parallel, bz2, xz, zstd or none).')
+        spec.input('metadata.options.archive_compresslevel', valid_type=six.integer_types, required=False, non_db=True, help='Compression level (1-9) of the output tarball, defaults to the default of the compression codec.')
         # define input nodes (optional ones have required=False)
         spec.input('parameters', valid_type=Dict, required=False, help='Use a node that specifies the input parameters (calculation settings).')
         spec.input('host_Greenfunction_folder', valid_type=RemoteData, required=True, help='Use a node that specifies the host KKR calculation contaning the host Green function and tmatrix (KkrCalculation with impurity_info input).')
@@ -118,6 +121,8 @@ class KkrimpCalculation(CalcJob):
         spec.input('impurity_info', valid_type=Dict, required=False, help='Use a parameter node that specifies properties for a immpurity calculation.')
         # define outputs
         spec.output('output_parameters', valid_type=Dict, required=True, help='results of the KKRimp calculation')
+        spec.output('convergence_arrays', valid_type=ArrayData, required=False, help='per-iteration histories of the KKRimp calculation (rms error, total energy, spin and orbital moments per atom)')
+        spec.output('archive_index', valid_type=Dict, required=False, help='offsets and sizes of the members of an uncompressed tarball of the output files (archive_compression=none)')
         spec.default_output_node = 'output_parameters'
         # define exit codes, also used in parser
         spec.exit_code(301, 'ERROR_NO_RETRIEVED_FOLDER', message='Retrieved folder of KKRimp calculation not found.')
@@ -531,17 +536,39 @@ class KkrimpCalculation(CalcJob):
         hcut = imp_info_dict.get('hcut', -1.)
         cylinder_orient = imp_info_dict.get('cylinder_orient', [0., 0., 1.])
         ilayer_center = imp_info_dict.get('ilayer_center', 0)
+        # scoef and impurity shapefun only depend on the host structure, the cluster settings and the host shapefun
+        # and are reused from the scoef cache for repeated submissions of the same impurity cluster
+        cache = ScoefCache()
+        scoef_key = get_scoef_cache_key(structure, Rcut, hcut, cylinder_orient, ilayer_center)
+
         # first create scoef file
-        with tempfolder.open(KkrCalculation._SCOEF, u'w') as scoef_file:
-            make_scoef(structure, Rcut, scoef_file, hcut, cylinder_orient, ilayer_center)
-        with tempfolder.open(KkrCalculation._SCOEF, u'r') as scoef_file:
-            # now create impurity shapefun
+        scoef_txt = cache.get(scoef_key, 'scoef')
+        if scoef_txt is None:
+            with tempfolder.open(KkrCalculation._SCOEF, u'w') as scoef_file:
+                make_scoef(structure, Rcut, scoef_file, hcut, cylinder_orient, ilayer_center)
+            with tempfolder.open(KkrCalculation._SCOEF, u'r') as scoef_file:
+                cache.put(scoef_key, 'scoef', scoef_file.read())
+        else:
+            with tempfolder.open(KkrCalculation._SCOEF, u'w') as scoef_file:
+                scoef_file.write(scoef_txt)
+
+        # now create impurity shapefun
+        with shapefun.open(KkrimpCalculation._SHAPEFUN, u'r') as shapefun_file:
+            shapefun_host = shapefun_file.read()
+        shapefun_txt = u''
+        if len(shapefun_host.splitlines())>1:
+            shapefun_key = get_shapefun_cache_key(scoef_key, shapefun_host, shapes)
+            shapefun_txt = cache.get(shapefun_key, 'shapefun')
+            if shapefun_txt is None:
+                with tempfolder.open(KkrCalculation._SCOEF, u'r') as scoef_file:
+                    with tempfolder.open(KkrimpCalculation._SHAPEFUN, u'w') as shapefun_new:
+                        with shapefun.open(KkrimpCalculation._SHAPEFUN, u'r') as shapefun_file:
+                            modify_potential().shapefun_from_scoef(scoef_file, shapefun_file, shapes, shapefun_new)
+                with tempfolder.open(KkrimpCalculation._SHAPEFUN, u'r') as shapefun_new:
+                    cache.put(shapefun_key, 'shapefun', shapefun_new.read())
+        if shapefun_txt is not None:
             with tempfolder.open(KkrimpCalculation._SHAPEFUN, u'w') as shapefun_new:
-                with shapefun.open(KkrimpCalculation._SHAPEFUN, u'r') as shapefun_file:
-                    shapelen = len(shapefun_file.readlines())
-                    print(shapelen)
-                    if shapelen>1:
-                        modify_potential().shapefun_from_scoef(scoef_file, shapefun_file, shapes, shapefun_new)
+                shapefun_new.write(shapefun_txt)
 
         # get path of tempfolder
         with tempfolder.open('.dummy','w') as tmpfile:
@@ -555,18 +582,15 @@ class KkrimpCalculation(CalcJob):
             retrieved = parent_calc_folder.get_incoming(node_class=CalcJobNode).first().node.get_outgoing().get_node_by_label('retrieved')
             self.logger.info('potfile {} {}'.format(retrieved, self._OUT_POTENTIAL))
 
-            # extract file from host's tarball (extract to tempfolder and use from there, this way the unnessesary files are deleted once submission is done)
-            tar_filenames = []
-            if self._FILENAME_TAR in retrieved.list_object_names():
-                # get path of tarfile
-                with retrieved.open(self._FILENAME_TAR) as tf:
-                    tfpath = tf.name
-                # extract file from tarfile of retrieved to tempfolder
-                with tarfile.open(tfpath) as tf:
-                    tar_filenames = [ifile.name for ifile in tf.getmembers()]
-                    filename = self._OUT_POTENTIAL
-                    if filename in tar_filenames:
-                        tf.extract(filename, tempfolder_path) # extract to tempfolder
+            # stream file from host's tarball to tempfolder (the member index of uncompressed tarballs is used if present, this way the unnessesary files are deleted once submission is done)
+            tfpath, archive_info = get_output_archive(retrieved)
+            if tfpath is not None:
+                filename = self._OUT_POTENTIAL
+                try:
+                    with tempfolder.open(filename, 'wb') as newfile:
+                        copy_archive_member(tfpath, filename, newfile, archive_info)
+                except KeyError:
+                    os.remove(os.path.join(tempfolder_path, filename))
             else: # otherwise copy from retrieved to tempfolder (rest of calculation needs files to be in tempfolder)
                 filename = self._OUT_POTENTIAL
                 if filename in retrieved.list_object_names():
@@ -0,0 +1,141 @@
+"""
+Here we implement a DOS data type for the output of KKR and KKRimp DOS calculations.
+The energy axis is stored once and the DOS of all atoms, spins and (l-)channels in a single array.
+"""
+from __future__ import absolute_import
+import numpy as np
+from aiida.plugins import DataFactory
+
+ArrayData = DataFactory('array')
+
+class KkrDosData(ArrayData):
+    """
+    DOS data of KKR and KKRimp calculations.
+
+    Stores the energy axis (array 'energies' of shape (energy,), or (atom, spin, energy) if the energy points differ
+    between atoms and spins) and the DOS (array 'dos' of shape (atom, spin, channel, energy)).
+    The names of the channels (e.g. ['tot', 's', 'p', 'd', 'ns']), the Fermi energy and the units are stored as attributes.
+
+    `get_x` and `get_y` return the same data as the `get_x` and `get_y` methods of the XyData nodes that
+    were used for DOS output before, i.e. arrays with shape (atom*spin, energy).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(KkrDosData, self).__init__(*args, **kwargs)
+
+    def set_dos(self, energies, dos, channel_names, fermi_energy=None, energy_units='eV', dos_units='states/eV', dos_name='dos'):
+        """
+        Set energy axis and DOS data
+
+        :param energies: energy axis, array of shape (energy,) or (atom, spin, energy)
+        :param dos: DOS, array of shape (atom, spin, channel, energy)
+        :param channel_names: list of names of the channels (e.g. ['tot', 's', 'p', 'd', 'ns'])
+        :param fermi_energy: Fermi energy (in Ry, optional)
+        :param energy_units: units of the energy axis (default: 'eV', energies relative to EF)
+        :param dos_units: units of the DOS (default: 'states/eV')
+        :param dos_name: name of the DOS (e.g. 'dos' or 'interpolated dos')
+        """
+        energies, dos = np.asarray(energies), np.ascontiguousarray(dos)
+        if dos.ndim != 4:
+            raise ValueError('dos array needs to have the shape (atom, spin, channel, energy), got shape {}'.format(dos.shape))
+        if len(channel_names) != dos.shape[2]:
+            raise ValueError('number of channel names ({}) does not match the dos array (shape {})'.format(len(channel_names), dos.shape))
+        if energies.shape not in [dos.shape[3:], dos.shape[:2]+dos.shape[3:]]:
+            raise ValueError('shape of the energy axis {} does not match the dos array (shape {})'.format(energies.shape, dos.shape))
+        # store the energy axis only once if it is the same for all atoms and spins
+        if energies.ndim == 3 and (energies == energies[0, 0]).all():
+            energies = energies[0, 0]
+
+        self.set_array('energies', np.ascontiguousarray(energies))
+        self.set_array('dos', dos)
+        self.set_attribute('channel_names', list(channel_names))
+        self.set_attribute('fermi_energy', fermi_energy)
+        self.set_attribute('energy_units', energy_units)
+        self.set_attribute('dos_units', dos_units)
+        self.set_attribute('dos_name', dos_name)
+
+    def set_from_rows(self, dos, nspin, channel_names, **kwargs):
+        """
+        Set data from an array of shape (atom*spin, energy, 1+channel) where the first column is the energy
+        (this is how the DOS files of KKR and KKRimp are read, see `masci_tools.io.common_functions.interpolate_dos`).
+        The other arguments are passed on to `set_dos`.
+
+        :param dos: array of shape (atom*spin, energy, 1+channel)
+        :param nspin: number of spin channels
+        :param channel_names: list of names of the channels
+        """
+        dos = np.asarray(dos)
+        natom = dos.shape[0]//nspin
+        energies = dos[:, :, 0].reshape(natom, nspin, -1)
+        dos = dos[:, :, 1:].reshape(natom, nspin, dos.shape[1], -1).transpose(0, 1, 3, 2)
+        self.set_dos(energies, dos, channel_names, **kwargs)
+
+    @property
+    def natom(self):
+        """number of atoms"""
+        return self.get_shape('dos')[0]
+
+    @property
+    def nspin(self):
+        """number of spin channels"""
+        return self.get_shape('dos')[1]
+
+    @property
+    def channel_names(self):
+        """names of the channels of the DOS"""
+        return self.get_attribute('channel_names')
+
+    @property
+    def fermi_energy(self):
+        """Fermi energy (in Ry)"""
+        return self.get_attribute('fermi_energy')
+
+    def get_energies(self, broadcast=False):
+        """
+        Get energy axis
+
+        :param broadcast: return the energies for all atoms and spins (shape (atom, spin, energy)), otherwise
+                          the energies are only returned with this shape if they differ between atoms and spins
+        """
+        energies = self.get_array('energies')
+        if broadcast and energies.ndim == 1:
+            energies = np.broadcast_to(energies, (self.natom, self.nspin, len(energies)))
+        return energies
+
+    def get_dos(self, channel=None):
+        """
+        Get DOS array with shape (atom, spin, channel, energy) or (atom, spin, energy) if `channel` is given
+
+        :param channel: name (e.g. 'tot') or index of a channel
+        """
+        dos = self.get_array('dos')
+        if channel is not None:
+            if not isinstance(channel, (int, np.integer)):
+                channel = self.channel_names.index(channel)
+            dos = dos[:, :, channel, :]
+        return dos
+
+    def get_x(self):
+        """
+        Get energy axis in the format of `XyData.get_x`
+
+        :returns: name, array of shape (atom*spin, energy), units
+        """
+        energies = self.get_energies(broadcast=True)
+        return 'E-EF', energies.reshape(-1, energies.shape[-1]), self.get_attribute('energy_units')
+
+    def get_y(self, channels=None):
+        """
+        Get DOS in the format of `XyData.get_y`
+
+        :param channels: list of names or indices of the channels that are returned (default: all channels)
+        :returns: list of (name, array of shape (atom*spin, energy), units) for all channels
+        """
+        if channels is None:
+            channels = self.channel_names
+        dos_name, dos_units = self.get_attribute('dos_name'), self.get_attribute('dos_units')
+        ylist = []
+        for channel in channels:
+            name = channel if not isinstance(channel, (int, np.integer)) else self.channel_names[channel]
+            ylist.append((dos_name+' '+name, self.get_dos(channel).reshape(self.natom*self.nspin, -1), dos_units))
+        return ylist
@@ -0,0 +1,135 @@
+"""
+Here we implement a data type for the spectral function (qdos) of KKR bandstructure calculations.
+The arrays are stored as .npy files in the repository and are read with memory mapping,
+i.e. only the slices of the data that are accessed are loaded from disk.
+"""
+from __future__ import absolute_import
+import os
+import numpy as np
+from aiida.plugins import DataFactory
+
+ArrayData = DataFactory('array')
+
+class KkrQdosData(ArrayData):
+    """
+    Spectral function (qdos) of KKR bandstructure calculations.
+
+    Stores the energy points (arrays 'energies' and 'energies_imag', in Ry), the k-points (array 'kpoints' of shape (kpoint, 3))
+    and the qdos (array 'qdos' of shape (atom, spin, channel, energy, kpoint)).
+    The names of the channels (e.g. ['tot', 's', 'p', 'd', 'ns']), the atom indices and the Fermi energy are stored as attributes.
+
+    The qdos array is opened with `numpy.load(..., mmap_mode='r')` (see `get_qdos` and `get_slice`) so that
+    slices of large spectral functions can be extracted without loading the whole array.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(KkrQdosData, self).__init__(*args, **kwargs)
+
+    def set_qdos(self, energies, kpoints, qdos, channel_names, energies_imag=None, atoms=None, fermi_energy=None):
+        """
+        Set energy points, k-points and qdos data
+
+        :param energies: real part of the energy points in Ry, array of shape (energy,)
+        :param kpoints: k-points, array of shape (kpoint, 3)
+        :param qdos: spectral function, array of shape (atom, spin, channel, energy, kpoint)
+        :param channel_names: list of names of the channels (e.g. ['tot', 's', 'p', 'd', 'ns'])
+        :param energies_imag: imaginary part of the energy points in Ry (optional)
+        :param atoms: list of indices of the atoms (default: 1, 2, ...)
+        :param fermi_energy: Fermi energy in Ry (optional)
+        """
+        energies, kpoints, qdos = np.asarray(energies), np.asarray(kpoints), np.ascontiguousarray(qdos)
+        if qdos.ndim != 5:
+            raise ValueError('qdos array needs to have the shape (atom, spin, channel, energy, kpoint), got shape {}'.format(qdos.shape))
+        if len(channel_names) != qdos.shape[2]:
+            raise ValueError('number of channel names ({}) does not match the qdos array (shape {})'.format(len(channel_names), qdos.shape))
+        if energies.shape != qdos.shape[3:4] or kpoints.shape != (qdos.shape[4], 3):
+            raise ValueError('shapes of energies {} and kpoints {} do not match the qdos array (shape {})'.format(energies.shape, kpoints.shape, qdos.shape))
+        if atoms is None:
+            atoms = list(range(1, qdos.shape[0]+1))
+
+        self.set_array('energies', energies)
+        if energies_imag is not None:
+            self.set_array('energies_imag', np.asarray(energies_imag))
+        self.set_array('kpoints', kpoints)
+        self.set_array('qdos', qdos)
+        self.set_attribute('channel_names', list(channel_names))
+        self.set_attribute('atoms', [int(iatom) for iatom in atoms])
+        self.set_attribute('fermi_energy', fermi_energy)
+        self.set_attribute('energy_units', 'Ry')
+
+    @property
+    def channel_names(self):
+        """names of the channels of the qdos"""
+        return self.get_attribute('channel_names')
+
+    @property
+    def atoms(self):
+        """indices of the atoms"""
+        return self.get_attribute('atoms')
+
+    @property
+    def fermi_energy(self):
+        """Fermi energy (in Ry)"""
+        return self.get_attribute('fermi_energy')
+
+    def get_energies(self):
+        """Get energy points (real part, in Ry)"""
+        return self.get_array('energies')
+
+    def get_kpoints(self):
+        """Get k-points (array of shape (kpoint, 3))"""
+        return self.get_array('kpoints')
+
+    def _get_array_mmap(self, name):
+        """
+        Open array of the repository with memory mapping (read-only). Falls back to `get_array`
+        if the array is not found as a file on disk.
+        """
+        with self.open('{}.npy'.format(name), mode='rb') as handle:
+            path = getattr(handle, 'name', None)
+        if path is not None and os.path.isfile(path):
+            return np.load(path, mmap_mode='r')
+        return self.get_array(name)
+
+    def get_qdos(self, channel=None, mmap=True):
+        """
+        Get qdos array with shape (atom, spin, channel, energy, kpoint) or (atom, spin, energy, kpoint) if `channel` is given
+
+        :param channel: name (e.g. 'tot') or index of a channel
+        :param mmap: open the array with memory mapping (default), otherwise the whole array is loaded
+        """
+        qdos = self._get_array_mmap('qdos') if mmap else self.get_array('qdos')
+        if channel is not None:
+            if not isinstance(channel, (int, np.integer)):
+                channel = self.channel_names.index(channel)
+            qdos = qdos[:, :, channel]
+        return qdos
+
+    def get_slice(self, atom=None, spin=None, channel=None, emin=None, emax=None, kpoints=None):
+        """
+        Load a slice of the qdos. Only the data of the slice is read from the (memory mapped) array.
+
+        :param atom: index (position in `atoms`) or slice of the atoms (default: all atoms)
+        :param spin: index or slice of the spins (default: all spins)
+        :param channel: name or index of the channel (default: all channels)
+        :param emin: lower bound of the energy window in Ry (optional)
+        :param emax: upper bound of the energy window in Ry (optional)
+        :param kpoints: index or slice of the k-points, e.g. `slice(0, 100)` for a part of the k-path (default: all k-points)
+
+        :returns: energies of the window, qdos array of the slice
+        """
+        energies = self.get_energies()
+        window = np.ones(len(energies), dtype=bool)
+        if emin is not None:
+            window &= energies>=emin
+        if emax is not None:
+            window &= energies<=emax
+        ie = np.where(window)[0]
+        ewindow = slice(ie[0], ie[-1]+1) if len(ie)>0 else slice(0, 0)
+
+        if channel is not None and not isinstance(channel, (int, np.integer, slice)):
+            channel = self.channel_names.index(channel)
+        index = tuple([slice(None) if i is None else i for i in [atom, spin, channel]]) + (ewindow,)
+        index += (slice(None) if kpoints is None else kpoints,)
+
+        return energies[ewindow], np.array(self.get_qdos()[index])
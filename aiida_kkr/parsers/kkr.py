@@ -12,11 +12,16 @@ from aiida_kkr.calculations.kkr import KkrCalculation
 from aiida.common.exceptions import InputValidationError
 from masci_tools.io.parsers.kkrparser_functions import parse_kkr_outputfile, check_error_category
 from masci_tools.io.common_functions import search_string
+from aiida_kkr.tools.retrieved_folder import RetrievedFolderView
+from aiida_kkr.tools.convergence_arrays import split_convergence_arrays, create_convergence_arrays
+from aiida_kkr.tools.kkr_parser_profiles import get_parser_sections, parse_kkr_output_sections
+from aiida_kkr.tools.dos_files import get_qdos_filenames, read_qdos_files
+from aiida_kkr.data.kkrqdos import KkrQdosData
 
 __copyright__ = (u"Copyright (c), 2017, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.6.3"
+__version__ = "0.8.0"
 __contributors__ = ("Jens Broeder", u"Philipp Rüßmann")
 
 
@@ -62,8 +67,21 @@ class KkrParser(Parser):
         except exceptions.NotExistent:
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
+        # the content of the retrieved folder is listed only once and all file handles are closed after parsing
+        # in the importer mode (icrit!=0) the output is parsed with three combinations of files (see below),
+        # then every file is read only once from the repository and all parser runs work on in-memory copies
+        with RetrievedFolderView(out_folder, in_memory=(self.icrit != 0)) as folder:
+            return self._parse_folder(folder)
+
+
+    def _parse_folder(self, folder):
+        """
+        Parse the output files of the retrieved folder (see `parse`)
+
+        :param folder: view on the retrieved folder (`RetrievedFolderView`)
+        """
         # check what is inside the folder
-        list_of_files = out_folder._repository.list_object_names()
+        list_of_files = folder.list_object_names()
 
         # we need at least the output file name as defined in calcs.py
         if KkrCalculation._DEFAULT_OUTPUT_FILE not in list_of_files:
@@ -75,7 +93,7 @@ class KkrParser(Parser):
         # determine whether or not everything should be parsed or not (e.g. qdos option)
         skip_mode = False
         only_000_present = False
-        with out_folder.open(KkrCalculation._INPUT_FILE_NAME) as file:
+        with folder.open(KkrCalculation._INPUT_FILE_NAME) as file:
             txt = file.readlines()
             itmp = search_string('RUNOPT', txt)
             if itmp>=0:
@@ -89,8 +107,8 @@ class KkrParser(Parser):
         file_errors = []
 
         # Parse output files of KKR calculation
-        if KkrCalculation._DEFAULT_OUTPUT_FILE in out_folder.list_object_names():
-            outfile = out_folder.open(KkrCalculation._DEFAULT_OUTPUT_FILE)
+        if KkrCalculation._DEFAULT_OUTPUT_FILE in list_of_files:
+            outfile = folder.open(KkrCalculation._DEFAULT_OUTPUT_FILE)
         else:
             file_errors.append((1+self.icrit, msg))
             outfile = None
@@ -101,20 +119,20 @@ class KkrParser(Parser):
         # 2: warning, is inspected and checked for consistency with read-in
         #    out_dict values (e.g. nspin, newsosol, ...)
         fname = KkrCalculation._OUTPUT_0_INIT
-        if fname in out_folder.list_object_names():
-            outfile_0init = out_folder.open(fname)
+        if fname in list_of_files:
+            outfile_0init = folder.open(fname)
         else:
             file_errors.append((1+self.icrit, "Critical error! OUTPUT_0_INIT not found {}".format(fname)))
             outfile_0init = None
         fname = KkrCalculation._OUTPUT_000
-        if fname in out_folder.list_object_names():
-            outfile_000 = out_folder.open(fname)
+        if fname in list_of_files:
+            outfile_000 = folder.open(fname)
         else:
             file_errors.append((1+self.icrit, "Critical error! OUTPUT_000 not found {}".format(fname)))
             outfile_000 = None
         fname = KkrCalculation._OUTPUT_2
-        if fname in out_folder.list_object_names():
-            outfile_2 = out_folder.open(fname)
+        if fname in list_of_files:
+            outfile_2 = folder.open(fname)
         else:
             if not only_000_present:
                 file_errors.append((1+self.icrit, "Critical error! OUTPUT_2 not found {}".format(fname)))
@@ -122,20 +140,20 @@ class KkrParser(Parser):
             else:
                 outfile_2 = outfile_000
         fname = KkrCalculation._OUT_POTENTIAL
-        if fname in out_folder.list_object_names():
-            potfile_out = out_folder.open(fname)
+        if fname in list_of_files:
+            potfile_out = folder.open(fname)
         else:
             file_errors.append((1+self.icrit, "Critical error! OUT_POTENTIAL not found {}".format(fname)))
             potfile_out = None
         fname = KkrCalculation._OUT_TIMING_000
-        if fname in out_folder.list_object_names():
-            timing_file = out_folder.open(fname)
+        if fname in list_of_files:
+            timing_file = folder.open(fname)
         else:
             file_errors.append((1+self.icrit, "Critical error! OUT_TIMING_000  not found {}".format(fname)))
             timing_file = None
         fname = KkrCalculation._NONCO_ANGLES_OUT
-        if fname in out_folder.list_object_names():
-            nonco_out_file = out_folder.open(fname)
+        if fname in list_of_files:
+            nonco_out_file = folder.open(fname)
         else:
             file_errors.append((2, "Error! NONCO_ANGLES_OUT not found {}".format(fname)))
             nonco_out_file = None
@@ -145,16 +163,30 @@ class KkrParser(Parser):
 
         #TODO job title, compound description
 
-        success, msg_list, out_dict = parse_kkr_outputfile(out_dict, outfile,
-                                                           outfile_0init, outfile_000,
-                                                           timing_file, potfile_out,
-                                                           nonco_out_file, outfile_2,
-                                                           skip_readin=skip_mode)
+        # the parser profile limits the sections of the output that are parsed (the rest can be parsed lazily later on)
+        profile = self._get_parser_profile()
+        if profile == 'full':
+            success, msg_list, out_dict = parse_kkr_outputfile(out_dict, outfile,
+                                                               outfile_0init, outfile_000,
+                                                               timing_file, potfile_out,
+                                                               nonco_out_file, outfile_2,
+                                                               skip_readin=skip_mode)
+        else:
+            files = {'outfile': outfile, 'outfile_0init': outfile_0init, 'outfile_000': outfile_000,
+                     'timing_file': timing_file, 'potfile_out': potfile_out, 'nonco_out_file': nonco_out_file,
+                     'outfile_2': outfile_2}
+            success, msg_list, out_dict = parse_kkr_output_sections(out_dict, files, get_parser_sections(profile),
+                                                                    skip_readin=skip_mode)
+        out_dict['parser_profile'] = profile
 
         # try to parse with other combinations of files to minimize parser errors
         if self.icrit != 0:
+            in_memory_files = [f for f in set([outfile, outfile_0init, outfile_000, outfile_2, timing_file,
+                                               potfile_out, nonco_out_file]) if f is not None]
             self.logger.info('msg_list0: {}'.format(msg_list))
             # try second combination of files
+            for f in in_memory_files:
+                f.seek(0)
             out_dict2 = out_dict.copy()
             success2, msg_list2, out_dict2 = parse_kkr_outputfile(out_dict2, outfile_2,
                 outfile_0init, outfile_000, timing_file, potfile_out, nonco_out_file,
@@ -164,6 +196,8 @@ class KkrParser(Parser):
                 self.logger.info('take output of parser run 1')
                 success, msg_list, out_dict = success2, msg_list2, out_dict2
             # try third combination of files
+            for f in in_memory_files:
+                f.seek(0)
             out_dict2 = out_dict.copy()
             success2, msg_list2, out_dict2 = parse_kkr_outputfile(out_dict2, outfile_000,
                 outfile_0init, outfile_000, timing_file, potfile_out, nonco_out_file,
@@ -186,8 +220,17 @@ class KkrParser(Parser):
                 out_dict['parser_warnings'].append(f_err.replace('Error', 'Warning'))
         out_dict['parser_errors'] = msg_list
 
+        # per-iteration histories (rms, charge neutrality, ...) are stored as ArrayData instead of lists in the Dict
+        out_arrays = split_convergence_arrays(out_dict)
+
         #create output node and link
         self.out('output_parameters', Dict(dict=out_dict))
+        if len(out_arrays)>0:
+            self.out('convergence_arrays', create_convergence_arrays(out_arrays))
+
+        # spectral function of a bandstructure (qdos) run
+        if skip_mode:
+            self._parse_qdos(folder, list_of_files, out_dict)
 
         if self.icrit != 0 and not success: # overwrite behavior with KKRimporter
             success = True # set automatically to True even if only partial output was parsed
@@ -198,19 +241,68 @@ class KkrParser(Parser):
             return self.exit_codes.ERROR_KKR_PARSING_FAILED
         else: # cleanup after parsing (only if parsing was successful)
             # delete completely parsed output files
-            self.remove_unnecessary_files()
+            self.remove_unnecessary_files(folder)
             # then (maybe) tar the output to save space
             #TODO needs implementing (see kkrimp parser)
 
 
-    def remove_unnecessary_files(self):
+    def _parse_qdos(self, folder, list_of_files, out_dict):
+        """
+        Read the `qdos.XX.Y.dat` files of a bandstructure calculation and create the `qdos_data` output
+        (the arrays are saved as .npy files which are opened with memory mapping later on).
+        The qdos files are kept in the retrieved folder since `plot_kkr` and the dispersion plot of masci-tools
+        read the text files directly.
+        """
+        try:
+            atoms, spins, qdos_files = get_qdos_filenames(list_of_files)
+            if len(qdos_files)==0:
+                return
+            qdos = read_qdos_files(folder.open, list(qdos_files.values()))
+        except ValueError as err:
+            self.logger.warning('qdos files could not be parsed: {}'.format(err))
+            return
+        name = ['tot', 's', 'p', 'd', 'f', 'g']
+        name = name[:qdos['qdos'].shape[2]-1]+['ns']
+        qdos_data = KkrQdosData()
+        qdos_data.set_qdos(qdos['energies'], qdos['kpoints'], qdos['qdos'], name, energies_imag=qdos['energies_imag'],
+                           atoms=qdos['atoms'], fermi_energy=out_dict.get('fermi_energy'))
+        self.out('qdos_data', qdos_data)
+
+
+    def _get_parser_profile(self):
+        """
+        Read the parser profile from the calculation options (see `aiida_kkr.tools.kkr_parser_profiles`),
+        the KKRimporter always parses the full output.
+
+        :returns: profile (str), one of `minimal`, `scf` or `full`
+        """
+        profile = 'full'
+        if self.icrit != 0:
+            return profile
+        try:
+            profile = self.node.get_option('parser_profile') or profile
+        except (AttributeError, KeyError, ValueError):
+            pass
+        try:
+            get_parser_sections(profile)
+        except ValueError as err:
+            self.logger.warning('{}, use full parser profile instead'.format(err))
+            profile = 'full'
+        return profile
+
+
+    def remove_unnecessary_files(self, folder=None):
         """
         Remove files that are not needed anymore after parsing
         The information is completely parsed (i.e. in outdict of calculation) 
         and keeping the file would just be a duplication.
+
+        :param folder: view on the retrieved folder (`RetrievedFolderView`), created if not given
         """
+        if folder is None:
+            folder = RetrievedFolderView(self.retrieved)
         files_to_delete = [KkrCalculation._POTENTIAL,
                            KkrCalculation._SHAPEFUN]
         for fileid in files_to_delete:
-            if fileid in self.retrieved.list_object_names():
-                self.retrieved.delete_object(fileid, force=True)
+            if fileid in folder:
+                folder.delete_object(fileid, force=True)
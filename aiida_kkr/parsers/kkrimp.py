@@ -6,21 +6,22 @@ all errors and warnings and show them to the user.
 """
 
 from __future__ import absolute_import
-import tarfile
 import os
+import tarfile
 from aiida.parsers.parser import Parser
 from aiida.orm import Dict
 from aiida_kkr.calculations.kkrimp import KkrimpCalculation
 from aiida.common.exceptions import InputValidationError
 from masci_tools.io.parsers.kkrparser_functions import check_error_category
-from masci_tools.io.common_functions import open_general
-from aiida_kkr.tools.tools_kkrimp import kkrimp_parser_functions
+from aiida_kkr.tools.tools_kkrimp import kkrimp_parser_functions, trim_output_file, write_output_archive
+from aiida_kkr.tools.retrieved_folder import RetrievedFolderView
+from aiida_kkr.tools.convergence_arrays import split_convergence_arrays, create_convergence_arrays
 
 
 __copyright__ = (u"Copyright (c), 2018, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.3.1"
+__version__ = "0.4.2"
 __contributors__ = ("Philipp Rüßmann")
 
 
@@ -57,8 +58,19 @@ class KkrimpParser(Parser):
         except exceptions.NotExistent:
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
+        # the content of the retrieved folder is listed only once and all file handles are closed after parsing
+        with RetrievedFolderView(out_folder) as folder:
+            return self._parse_folder(folder)
+
+
+    def _parse_folder(self, folder):
+        """
+        Parse the output files of the retrieved folder (see `parse`)
+
+        :param folder: view on the retrieved folder (`RetrievedFolderView`)
+        """
         # check what is inside the folder
-        list_of_files = out_folder._repository.list_object_names()
+        list_of_files = folder.list_object_names()
 
         file_errors = []
         files = {}
@@ -75,72 +87,72 @@ class KkrimpParser(Parser):
             msg = "Output file '{}' not found in list of files: {}".format(KkrimpCalculation._DEFAULT_OUTPUT_FILE, list_of_files)
         
     
-        if KkrimpCalculation._DEFAULT_OUTPUT_FILE in out_folder.list_object_names():
-            outfile = out_folder.open(KkrimpCalculation._DEFAULT_OUTPUT_FILE)
+        if KkrimpCalculation._DEFAULT_OUTPUT_FILE in list_of_files:
+            outfile = folder.open(KkrimpCalculation._DEFAULT_OUTPUT_FILE)
             files['outfile'] = outfile
         else:
             file_errors.append((1,msg))
             outfile = None
             
         fname = KkrimpCalculation._OUTPUT_000
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_log'] = filepath
         else:
             file_errors.append((1, "Critical error! file '{}' not found ".format(fname)))
             files['out_log'] = None
         fname = KkrimpCalculation._OUT_POTENTIAL
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_pot'] = filepath
         else:
             file_errors.append((1, "Critical error! file '{}' not found ".format(fname)))
             files['out_pot'] = None
         fname = KkrimpCalculation._OUT_TIMING_000
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_timing'] = filepath
         else:
             file_errors.append((1, "Critical error! file '{}' not found ".format(fname)))
             files['out_timing'] = None 
         fname = KkrimpCalculation._OUT_ENERGYSP_PER_ATOM
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_enersp_at'] = filepath
         else:
             file_errors.append((1, "Critical error! file '{}' not found ".format(fname)))
             files['out_enersp_at'] = None
         fname = KkrimpCalculation._OUT_ENERGYTOT_PER_ATOM
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_enertot_at'] = filepath
         else:
             file_errors.append((1, "Critical error! file '{}' not found ".format(fname)))
             files['out_enertot_at'] = None
         fname = KkrimpCalculation._KKRFLEX_LLYFAC
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['kkrflex_llyfac'] = filepath
         else:
             file_errors.append((2, "Warning! file '{}' not found ".format(fname)))
             files['kkrflex_llyfac'] = None
         fname = KkrimpCalculation._KKRFLEX_ANGLE
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['kkrflex_angles'] = filepath
         else:
             file_errors.append((2, "Warning! file '{}' not found ".format(fname)))
             files['kkrflex_angles'] = None
         fname = KkrimpCalculation._OUT_MAGNETICMOMENTS
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_spinmoms'] = filepath
         else:
             file_errors.append((2, "Warning! file '{}' not found ".format(fname)))
             files['out_spinmoms'] = None
         fname = KkrimpCalculation._OUT_ORBITALMOMENTS
-        if fname in out_folder.list_object_names():
-            filepath = out_folder.open(fname)
+        if fname in list_of_files:
+            filepath = folder.open(fname)
             files['out_orbmoms'] = filepath
         else:
             file_errors.append((2, "Warning! file '{}' not found ".format(fname)))
@@ -151,7 +163,9 @@ class KkrimpParser(Parser):
         out_dict = {'parser_version': self._ParserVersion,
                     'calculation_plugin_version': KkrimpCalculation._CALCULATION_PLUGIN_VERSION}
 
-        success, msg_list, out_dict = kkrimp_parser_functions().parse_kkrimp_outputfile(out_dict, files)
+        # per-iteration histories of the moments per atom are collected in out_arrays
+        out_arrays = {}
+        success, msg_list, out_dict = kkrimp_parser_functions().parse_kkrimp_outputfile(out_dict, files, out_arrays)
 
         out_dict['parser_errors'] = msg_list
          # add file open errors to parser output of error messages
@@ -166,82 +180,135 @@ class KkrimpParser(Parser):
                 out_dict['parser_warnings'].append(f_err.replace('Error', 'Warning'))
         out_dict['parser_errors'] = msg_list
 
+        # cleanup after parsing (only if parsing was successful)
+        member_index = None
+        if success:
+            try:
+                # reduce size of timing file
+                self.cleanup_outfiles(files['out_timing'], ['Iteration number', 'time until scf starts'])
+                # reduce size of out_log file
+                self.cleanup_outfiles(files['out_log'], ['Iteration Number'])
+                # delete completely parsed output files and create a tar ball to reduce size
+                self.remove_unnecessary_files(folder)
+                archive_info = self.final_cleanup(folder)
+                if archive_info is not None:
+                    # the index of the members is kept out of the output parameters
+                    member_index = archive_info.pop('member_index', None)
+                    out_dict['archive_info'] = archive_info
+            except (IOError, OSError, tarfile.TarError) as err:
+                # the parsed output is kept, the retrieved files are only left uncompressed
+                if 'parser_warnings' not in list(out_dict.keys()):
+                    out_dict['parser_warnings'] = []
+                out_dict['parser_warnings'].append('Warning! cleanup of the retrieved files failed: {}'.format(err))
+
+        # per-iteration histories (rms, total energy, ...) are stored as ArrayData instead of lists in the Dict
+        split_convergence_arrays(out_dict, out_arrays)
+
         #create output node and link
         self.out('output_parameters', Dict(dict=out_dict))
+        if len(out_arrays)>0:
+            self.out('convergence_arrays', create_convergence_arrays(out_arrays))
+        if member_index:
+            self.out('archive_index', Dict(dict={'member_index': member_index}))
 
-        # cleanup after parsing (only if parsing was successful)
-        if success:
-            # reduce size of timing file
-            self.cleanup_outfiles(files['out_timing'], ['Iteration number', 'time until scf starts'])
-            # reduce size of out_log file
-            self.cleanup_outfiles(files['out_log'], ['Iteration Number'])
-            # delete completely parsed output files and create a tar ball to reduce size
-            self.remove_unnecessary_files()
-            self.final_cleanup()
-        else:
+        if not success:
             return self.exit_codes.ERROR_PARSING_KKRIMPCALC
 
 
     def cleanup_outfiles(self, fileidentifier, keyslist):
-        """open file and remove unneeded output"""
-        lineids = []
-        with open_general(fileidentifier) as tfile:
-            txt = tfile.readlines()
-            for iline in range(len(txt)):
-                for key in keyslist: # go through all keys
-                    if key in txt[iline]: # add line id to list if key has been found
-                        lineids.append(iline)
-        # rewrite file deleting the middle part
-        if len(lineids)>1: # cut only if more than one iteration was found
-            txt = txt[:lineids[0]] + ['# ... [removed output except for last iteration] ...\n'] + txt[lineids[-1]:]
-            with open_general(fileidentifier, 'w') as tfilenew:
-                tfilenew.writelines(txt)
-
-
-    def remove_unnecessary_files(self):
+        """
+        open file and remove unneeded output (see `aiida_kkr.tools.tools_kkrimp.trim_output_file`)
+
+        :param fileidentifier: path or file handle of the output file
+        :param keyslist: list of keys that mark the start of an iteration
+        """
+        trim_output_file(fileidentifier, keyslist)
+
+
+    def remove_unnecessary_files(self, folder=None):
         """
         Remove files that are not needed anymore after parsing
         The information is completely parsed (i.e. in outdict of calculation) 
         and keeping the file would just be a duplication.
+
+        :param folder: view on the retrieved folder (`RetrievedFolderView`), created if not given
         """
+        if folder is None:
+            folder = RetrievedFolderView(self.retrieved)
         # first delete unused files (completely in parsed output)
         files_to_delete = [KkrimpCalculation._OUT_ENERGYSP_PER_ATOM,
                            KkrimpCalculation._OUT_ENERGYTOT_PER_ATOM,
                            KkrimpCalculation._SHAPEFUN]
         for fileid in files_to_delete:
-            if fileid in self.retrieved.list_object_names():
-                self.retrieved.delete_object(fileid, force=True)
+            if fileid in folder:
+                folder.delete_object(fileid, force=True)
 
 
-    def final_cleanup(self):
-        """Create a tarball of the rest."""
+    def final_cleanup(self, folder=None):
+        """
+        Create a tarball of the rest.
+        The compression of the tarball is set with the calculation options `archive_compression` and
+        `archive_compresslevel` (see `aiida_kkr.tools.tools_kkrimp.write_output_archive`).
+
+        :param folder: view on the retrieved folder (`RetrievedFolderView`), created if not given
+        :returns: archive_info (dict) with codec, file sizes and compression ratio, None if no tarball was created
+        """
 
         # short name for retrieved folder
-        ret = self.retrieved
+        if folder is None:
+            folder = RetrievedFolderView(self.retrieved)
+        ret = folder.folder
 
         # Now create tarball of output
         #
         # check if output has been packed to tarfile already
         # only if tarfile is not there we create the output tar file
-        if KkrimpCalculation._FILENAME_TAR not in ret.list_object_names():
-            # first create dummy file which is used to extract the full path that is given to tarfile.open
-            with ret.open(KkrimpCalculation._FILENAME_TAR, 'w') as f:
-                filepath_tar = f.name
-           
-            # now create tarfile and loop over content of retrieved directory
-            to_delete = []
-            with tarfile.open(filepath_tar, 'w:gz') as tf:
-                for f in ret.list_object_names():
-                    with ret.open(f) as ftest:
-                        filesize = os.stat(ftest.name).st_size
-                        ffull = ftest.name
-                    if (f != KkrimpCalculation._FILENAME_TAR  # ignore tar file
-                        and filesize>0                        # ignore empty files
-                        and f[0]!='.'):                       # ignore files starting with '.' like '.nfs...'
-                        tf.add(ffull, arcname=os.path.basename(ffull))
-                        to_delete.append(f)
-
-            # finally delete files that have been added to tarfile
-            for f in to_delete:
-                ret.delete_object(f, force=True)
- 
+        if KkrimpCalculation._FILENAME_TAR in folder:
+            return None
+
+        # first create dummy file which is used to extract the full path that is given to tarfile.open
+        with ret.open(KkrimpCalculation._FILENAME_TAR, 'w') as f:
+            filepath_tar = f.name
+
+        # close all handles of files that are packed into the tarball
+        folder.close()
+
+        # collect files of the retrieved directory (the files are not opened, they are in the folder of the tarfile)
+        dirname = os.path.dirname(filepath_tar)
+        to_delete = []
+        for f in folder.list_object_names():
+            if (f != KkrimpCalculation._FILENAME_TAR               # ignore tar file
+                and os.path.getsize(os.path.join(dirname, f))>0   # ignore empty files
+                and f[0]!='.'):                                   # ignore files starting with '.' like '.nfs...'
+                to_delete.append(f)
+
+        # now create tarfile (a partially written tarfile is removed again)
+        compression, compresslevel = self._get_archive_options()
+        try:
+            archive_info = write_output_archive(filepath_tar, [os.path.join(dirname, f) for f in to_delete],
+                                                compression=compression, compresslevel=compresslevel)
+        except (IOError, OSError, tarfile.TarError):
+            folder.delete_object(KkrimpCalculation._FILENAME_TAR, force=True)
+            raise
+
+        # finally delete files that have been added to tarfile
+        for f in to_delete:
+            folder.delete_object(f, force=True)
+
+        return archive_info
+
+
+    def _get_archive_options(self):
+        """
+        Read compression settings of the output tarball from the calculation options
+        (defaults are used for calculations that do not have these options)
+
+        :returns: compression (str), compresslevel (int or None)
+        """
+        compression, compresslevel = 'gz', None
+        try:
+            compression = self.node.get_option('archive_compression') or compression
+            compresslevel = self.node.get_option('archive_compresslevel')
+        except (AttributeError, KeyError, ValueError):
+            pass
+        return compression, compresslevel
@@ -3,7 +3,9 @@ Here we define the fixtures for the tests
 """
 
 from __future__ import absolute_import
+import os
 import pytest
+from builtins import object
 from aiida.manage.fixtures import fixture_manager
 
 @pytest.fixture(scope='session')
@@ -30,3 +32,76 @@ def import_data(aiida_env):
     for db_export_file in ['db_dump_kkrcalc.tar.gz', 'db_dump_kkrflex_create.tar.gz', 'db_dump_vorocalc.tar.gz']:
         import_data('files/'+db_export_file)
 
+
+
+# minimal stand-ins for AiiDA nodes, used in the tests of tools that only need the interface of the nodes
+class _DummyFolder(object):
+    """FolderData interface on top of a directory, counts the repository listings"""
+    def __init__(self, path):
+        self.path = path
+        self.nlist = 0
+    def list_object_names(self):
+        self.nlist += 1
+        return sorted(os.listdir(self.path))
+    def open(self, name, mode='r'):
+        return open(os.path.join(self.path, name), mode)
+    def delete_object(self, name, force=False):
+        os.remove(os.path.join(self.path, name))
+
+class _DummyDict(object):
+    """Dict interface"""
+    def __init__(self, d):
+        self.d = d
+    def get_dict(self):
+        return self.d
+
+class _DummyArrays(object):
+    """ArrayData interface"""
+    def __init__(self, arrays):
+        self.arrays = arrays
+    def get_arraynames(self):
+        return list(self.arrays.keys())
+    def get_array(self, name):
+        return self.arrays[name]
+
+class _DummyXyData(object):
+    """XyData interface of the DOS output"""
+    def __init__(self, ener, totdos):
+        self.ener, self.totdos = ener, totdos
+    def get_x(self):
+        return 'E-EF', self.ener, 'eV'
+    def get_y(self):
+        return [('dos tot', self.totdos, 'states/eV')]
+
+class _DummyStructure(object):
+    """StructureData interface of get_hash"""
+    def __init__(self, hash):
+        self.hash = hash
+    def get_hash(self):
+        return self.hash
+
+class _DummyOutputs(object):
+    pass
+
+class _DummyCalc(object):
+    """calculation node with output_parameters and (optionally) convergence_arrays and retrieved outputs"""
+    def __init__(self, out_dict, out_arrays=None, retrieved_path=None):
+        self.outputs = _DummyOutputs()
+        self.outputs.output_parameters = _DummyDict(out_dict)
+        if out_arrays is not None:
+            self.outputs.convergence_arrays = _DummyArrays(out_arrays)
+        if retrieved_path is not None:
+            self.outputs.retrieved = _DummyFolder(retrieved_path)
+
+class _DummyNodes(object):
+    Folder = _DummyFolder
+    Dict = _DummyDict
+    Arrays = _DummyArrays
+    XyData = _DummyXyData
+    Structure = _DummyStructure
+    Calc = _DummyCalc
+
+@pytest.fixture()
+def dummy_nodes():
+    """stand-ins for AiiDA nodes (Folder, Dict, Arrays, XyData, Structure and Calc) that do not need a database"""
+    return _DummyNodes
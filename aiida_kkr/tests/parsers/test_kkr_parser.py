@@ -24,3 +24,22 @@ class Test_kkr_parser(object):
         kkr_calc = load_node('3058bd6c-de0b-400e-aff5-2331a5f5d566')
         parser = KkrParser(kkr_calc)
         parser.parse()
+
+    def test_parse_in_memory_files(self):
+        """
+        check that in-memory copies of the output files (used in the importer mode) can be parsed several times
+        and give the same result as parsing the files directly
+        """
+        from aiida_kkr.tools.retrieved_folder import read_to_memory
+        from masci_tools.io.parsers.kkrparser_functions import parse_kkr_outputfile
+        path = 'files/kkr/kkr_run_slab_soc_mag/'
+        fnames = ['out_kkr', 'output.0.txt', 'output.000.txt', 'out_timing.000.txt', 'out_potential',
+                  'nonco_angle_out.dat', 'output.2.txt']
+        ref = parse_kkr_outputfile({}, *[path+fname for fname in fnames])
+        files = [read_to_memory(open(path+fname)) for fname in fnames]
+        for irun in range(3):
+            for f in files:
+                f.seek(0)
+            out = parse_kkr_outputfile({}, *files)
+            assert out[0]
+            assert repr(out) == repr(ref)
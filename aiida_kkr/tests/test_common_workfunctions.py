@@ -150,6 +150,70 @@ class Test_common_workfunctions(object):
         from aiida_kkr.tools.common_workfunctions import kick_out_corestates_wf
         pass
 
+
+    def test_kick_out_corestates(self, tmpdir):
+        from aiida_kkr.tools.common_workfunctions import kick_out_corestates, kick_out_corestates_batch
+        from masci_tools.io.common_functions import get_corestates_from_potential
+        potfile = 'files/kkr/kkr_run_slab_soc_mag/potential'
+        # 4 potentials with 5 core states each
+        assert get_corestates_from_potential(potfile)[0] == [0, 0, 0, 0, 5, 5, 5, 5, 0, 0, 0, 0]
+        potfile_out = [str(tmpdir.join('potential_nocore{}'.format(i))) for i in range(4)]
+        # one core state per potential above -5 Ry
+        assert kick_out_corestates(potfile, potfile_out[0], -5) == 4
+        nstates, energies, lmoments = get_corestates_from_potential(potfile_out[0])
+        assert nstates == [0, 0, 0, 0, 4, 4, 4, 4, 0, 0, 0, 0]
+        assert max([e.max() for e in energies if len(e)>0]) <= -5
+        # batch mode with one emin for each potential
+        num_deleted = kick_out_corestates_batch([potfile, potfile], [potfile_out[1], potfile_out[2]], [-100, -10**9])
+        assert num_deleted == [16, 20]
+        assert get_corestates_from_potential(potfile_out[1])[0] == [0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0]
+        assert get_corestates_from_potential(potfile_out[2])[0] == 12*[0]
+        # nothing to remove: output is not written
+        assert kick_out_corestates(potfile, potfile_out[3], 0) == 0
+        assert not tmpdir.join('potential_nocore3').check()
+
+
+    def test_get_structure_arrays(self):
+        from aiida_kkr.tools.common_workfunctions import get_structure_arrays
+        from aiida.plugins import DataFactory
+        StructureData = DataFactory('structure')
+        s = StructureData(cell=[[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        s.append_atom(position=[0, 0, 0], symbols='Fe')
+        s.append_atom(position=[0.5, 0.5, 0.5], symbols=['Cu', 'Pt'], weights=[0.2, 0.8])
+        s.append_atom(position=[0.5, 0, 0], symbols='Fe')
+        struc_arrays = get_structure_arrays(s)
+        assert struc_arrays['positions'].tolist() == [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0, 0]]
+        assert struc_arrays['ncomponents'].tolist() == [1, 2, 1]
+        assert struc_arrays['site_index'].tolist() == [1, 2, 2, 3]
+        assert struc_arrays['component_index'].tolist() == [0, 0, 1, 0]
+        assert struc_arrays['zatom'].tolist() == [26, 29, 78, 26]
+        assert struc_arrays['weights'].tolist() == [1., 0.2, 0.8, 1.]
+        assert not struc_arrays['has_vacancies'].any()
+        assert [struc_arrays['kind_names'][i] for i in struc_arrays['kind_index']] == [site.kind_name for site in s.sites]
+        # stored structures are taken from the cache
+        s.store()
+        assert get_structure_arrays(s) is get_structure_arrays(s)
+
+
+    def test_find_cluster_radius_exact(self):
+        from aiida_kkr.tools.common_workfunctions import find_cluster_radius, get_kth_neighbor_radius
+        from aiida.plugins import DataFactory
+        from numpy import array, sqrt
+        StructureData = DataFactory('structure')
+        alat = 3.61
+        s = StructureData(cell=[[0, alat/2, alat/2], [alat/2, 0, alat/2], [alat/2, alat/2, 0]])
+        s.append_atom(position=[0,0,0], symbols='Cu')
+        # fcc: 12 nearest neighbors at alat/sqrt(2), 6 next nearest neighbors at alat
+        rcls_ang = find_cluster_radius(s, 12, exact=True)[0]
+        assert abs(rcls_ang - (alat/sqrt(2)+alat)/2) < 10**-8
+        # 13 neighbors need the second shell, the third shell is at sqrt(3/2)*alat
+        rcls_ang = find_cluster_radius(s, 13, exact=True)[0]
+        assert abs(rcls_ang - (alat+sqrt(1.5)*alat)/2) < 10**-8
+        # same result if the cell is given with a basis
+        cell = array([[alat, 0, 0], [0, alat, 0], [0, 0, alat]])
+        pos = array([[0, 0, 0], [0, alat/2, alat/2], [alat/2, 0, alat/2], [alat/2, alat/2, 0]])
+        assert abs(get_kth_neighbor_radius(cell, pos, 12) - (alat/sqrt(2)+alat)/2) < 10**-8
+
     """
     def test_prepare_VCA_structure_wf(self):
         #TODO: implement check
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import pytest
+
+
+class Test_convergence_arrays(object):
+    """
+    Tests for the helpers of the convergence_arrays output
+    """
+
+    def get_kkr_output(self):
+        from masci_tools.io.parsers.kkrparser_functions import parse_kkr_outputfile
+        path = 'files/kkr/kkr_run_slab_soc_mag/'
+        fnames = ['out_kkr', 'output.0.txt', 'output.000.txt', 'out_timing.000.txt', 'out_potential',
+                  'nonco_angle_out.dat', 'output.2.txt']
+        success, msg_list, out_dict = parse_kkr_outputfile({}, *[path+fname for fname in fnames])
+        return out_dict
+
+    def test_split_convergence_arrays(self):
+        import numpy as np
+        from aiida_kkr.tools.convergence_arrays import split_convergence_arrays
+        out_dict = self.get_kkr_output()
+        ref = dict(out_dict['convergence_group'])
+        out_dict['convergence_group']['ragged_all_iterations'] = [[1., 2.], [3.]]
+        out_arrays = split_convergence_arrays(out_dict)
+        convergence_group = out_dict['convergence_group']
+        assert sorted(out_arrays.keys()) == sorted([key for key in ref if key.endswith('_all_iterations')])
+        for key, array in out_arrays.items():
+            assert array.dtype == np.float64
+            assert np.allclose(array, ref[key])
+            assert key not in convergence_group
+        # summary values and entries that cannot be converted stay in the Dict
+        assert convergence_group['rms'] == ref['rms']
+        assert convergence_group['fermi_energy_all_iterations_units'] == 'Ry'
+        assert convergence_group['ragged_all_iterations'] == [[1., 2.], [3.]]
+        assert out_arrays['spin_moment_per_atom_all_iterations'].shape == (10, 6)
+
+    def test_get_convergence_arrays(self, dummy_nodes):
+        import numpy as np
+        from aiida_kkr.tools.convergence_arrays import split_convergence_arrays, get_convergence_arrays
+        old_dict = self.get_kkr_output()
+        new_dict = self.get_kkr_output()
+        out_arrays = split_convergence_arrays(new_dict)
+        keys = ['rms_all_iterations', 'charge_neutrality_all_iterations']
+        # same result for new (ArrayData) and old (Dict) calculations
+        new = get_convergence_arrays(dummy_nodes.Calc(new_dict, out_arrays), keys)
+        old = get_convergence_arrays(dummy_nodes.Calc(old_dict), keys)
+        assert sorted(new.keys()) == sorted(keys)
+        for key in keys:
+            assert np.allclose(new[key], old[key])
+        assert sorted(get_convergence_arrays(dummy_nodes.Calc(old_dict)).keys()) == sorted(out_arrays.keys())
+        with pytest.raises(KeyError):
+            get_convergence_arrays(dummy_nodes.Calc(new_dict, out_arrays), ['qdos_all_iterations'])
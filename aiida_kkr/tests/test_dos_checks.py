@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import numpy as np
+import pytest
+
+
+def get_dos(natom, nspin, nept=50):
+    """smooth DOS with zero DOS at the bottom of the energy contour (negative for the first spin of nspin=2)"""
+    ener = np.array([np.linspace(-10., 2., nept) for i in range(natom*nspin)])
+    totdos = np.exp(-(ener+3.)**2)
+    if nspin == 2:
+        totdos[::2] = -totdos[::2]
+    return ener, totdos
+
+
+class Test_dos_checks(object):
+    """
+    Tests for the DOS consistency checks
+    """
+
+    def test_find_negative_dos(self):
+        from aiida_kkr.tools.dos_checks import find_negative_dos
+        for nspin in [1, 2]:
+            ener, totdos = get_dos(3, nspin)
+            assert find_negative_dos(totdos, nspin) == []
+            # negative DOS in atom 2, last spin
+            totdos[2*nspin+nspin-1, 10] = -0.5
+            assert find_negative_dos(totdos, nspin) == [(2, nspin-1, -0.5)]
+        # first spin channel of nspin=2 is negative, positive values are wrong here
+        ener, totdos = get_dos(3, 2)
+        totdos[2, 20] = 0.25
+        assert find_negative_dos(totdos, 2) == [(1, 0, -0.25)]
+
+    def test_find_dos_at_emin(self):
+        from aiida_kkr.tools.dos_checks import find_dos_at_emin
+        ener, totdos = get_dos(2, 2)
+        assert find_dos_at_emin(ener, totdos, 2, -10., 1e-3) == []
+        # emin close to peak of DOS
+        report = find_dos_at_emin(ener, totdos, 2, -3., 1e-3)
+        assert [(iatom, ispin) for iatom, ispin, val in report] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+        assert all([val > 0.9 for iatom, ispin, val in report])
+
+    def test_check_dos(self, dummy_nodes):
+        from aiida_kkr.tools.dos_checks import check_dos
+        ener, totdos = get_dos(4, 2)
+        dosdata = dummy_nodes.XyData(ener, totdos)
+        report = check_dos(dosdata, dosdata, 4, 2, -10., 1e-3)
+        assert report['dos_ok']
+        assert report['negative_dos'] == [] and report['dos_at_emin'] == []
+        # wrong number of atoms
+        report = check_dos(dosdata, dosdata, 3, 2, -10., 1e-3)
+        assert not report['shape_ok']
+        assert not report['dos_ok']
+        # EMIN too high
+        report = check_dos(dosdata, dosdata, 4, 2, -3., 1e-3)
+        assert not report['dos_ok']
+        assert report['negative_dos'] == []
+        assert len(report['dos_at_emin']) == 8
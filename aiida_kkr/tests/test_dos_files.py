@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import os
+import io
+import numpy as np
+import pytest
+
+
+def write_dosfile(filename, data):
+    """write DOS file in the format of the `out_ldos*` files of KKRimp"""
+    with open(filename, 'w') as f:
+        f.write('#  lm-decomposed DOS\n#  energy   tot   s   p   d   f   ns\n')
+        for row in data:
+            f.write(' '.join(['%22.14E'%val for val in row])+'\n')
+
+
+class Test_dos_files(object):
+    """
+    Tests for the readers of DOS files
+    """
+
+    @pytest.fixture(autouse=True)
+    def dosfiles(self, tmpdir):
+        self.path = str(tmpdir)
+        rng = np.random.RandomState(42)
+        self.filenames = ['out_ldos.atom=%0.2i_spin%i.dat'%(iatom, ispin) for iatom in range(1, 4) for ispin in range(1, 3)]
+        for fname in self.filenames:
+            data = rng.normal(size=(50, 7))*10.**rng.randint(-12, 3, size=(50, 7))
+            write_dosfile(os.path.join(self.path, fname), data)
+
+    def test_read_text_table(self):
+        from aiida_kkr.tools.dos_files import read_text_table
+        fname = os.path.join(self.path, self.filenames[0])
+        ref = np.loadtxt(fname)
+        # same result (bit by bit) as loadtxt for paths, text and binary file handles
+        assert read_text_table(fname).tobytes() == ref.tobytes()
+        with open(fname) as f:
+            assert read_text_table(f).tobytes() == ref.tobytes()
+        with open(fname, 'rb') as f:
+            data = read_text_table(io.BytesIO(f.read()))
+        assert data.dtype == ref.dtype
+        assert data.shape == ref.shape
+        assert data.tobytes() == ref.tobytes()
+        # broken files
+        with pytest.raises(ValueError):
+            read_text_table(io.StringIO(u'1.0 2.0\n3.0 ***\n'))
+
+    def test_read_text_table_fallback(self):
+        from aiida_kkr.tools.dos_files import read_text_table, _parse_table
+        fname = os.path.join(self.path, self.filenames[0])
+        with open(fname) as f:
+            txt = f.read()
+        fast = _parse_table(txt)
+        assert fast is not None
+        # a comment after the header and an empty line are parsed with loadtxt instead
+        lines = txt.splitlines(True)
+        txt_irregular = ''.join(lines[:5]+['# comment\n']+lines[5:10]+['\n']+lines[10:])
+        assert _parse_table(txt_irregular) is None
+        fallback = read_text_table(io.StringIO(txt_irregular))
+        assert fallback.dtype == fast.dtype
+        assert fallback.tobytes() == fast.tobytes()
+        # same for byte strings (files in text mode on python 2)
+        fallback = read_text_table(io.BytesIO(txt_irregular.encode('latin1')))
+        assert fallback.tobytes() == fast.tobytes()
+
+    def test_read_dos_files(self):
+        from aiida_kkr.tools.dos_files import read_dos_files
+        open_dosfile = lambda fname: open(os.path.join(self.path, fname))
+        ref = np.array([np.loadtxt(os.path.join(self.path, fname)) for fname in self.filenames])
+        for nthreads in [None, 4]:
+            dos = read_dos_files(open_dosfile, self.filenames, nthreads=nthreads)
+            assert dos.shape == (6, 50, 7)
+            assert dos.tobytes() == ref.tobytes()
+        # files with different number of energy points
+        write_dosfile(os.path.join(self.path, self.filenames[-1]), np.ones((10, 7)))
+        with pytest.raises(ValueError):
+            read_dos_files(open_dosfile, self.filenames)
+
+    def test_get_lmdos_arrays(self):
+        from aiida_kkr.tools.dos_files import read_dos_files, get_lmdos_arrays
+        from masci_tools.io.common_functions import get_Ry2eV
+        # lm-DOS files with energy column and 16 lm-components
+        filenames = ['out_lmdos.atom=%0.2i_spin%i.dat'%(iatom, ispin) for iatom in range(1, 4) for ispin in range(1, 3)]
+        rng = np.random.RandomState(0)
+        for fname in filenames:
+            data = np.zeros((40, 17))
+            data[:, 0] = np.linspace(-0.5, 1.0, 40)
+            data[:, 1:] = rng.rand(40, 16)
+            write_dosfile(os.path.join(self.path, fname), data)
+        open_dosfile = lambda fname: open(os.path.join(self.path, fname))
+        data = read_dos_files(open_dosfile, filenames).reshape(3, 2, 40, 17)
+        ef, eVscale = 0.5, get_Ry2eV()
+        energies, lmdos = get_lmdos_arrays(data, ef)
+        assert lmdos.shape == (3, 2, 40, 16)
+        assert lmdos.dtype == np.float64
+        assert np.allclose(energies, (data[0, 0, :, 0]-ef)*eVscale)
+        assert np.allclose(lmdos[1, 0], data[1, 0, :, 1:]/eVscale)
+        # energy window and downcasting
+        energies, lmdos = get_lmdos_arrays(data, ef, emin=-5., emax=5., dtype=np.float32)
+        window = np.abs((data[0, 0, :, 0]-ef)*eVscale)<=5.
+        assert lmdos.shape == (3, 2, window.sum(), 16)
+        assert lmdos.dtype == np.float32
+        assert energies.min() >= -5. and energies.max() <= 5.
+        assert np.allclose(lmdos[2, 1], data[2, 1, window, 1:]/eVscale)
+
+    def test_read_qdos_files(self, dummy_nodes):
+        from aiida_kkr.tools.dos_files import read_qdos_files, get_qdos_filenames
+        # qdos files with 4 energy points, 3 k-points and 5 channels for 2 atoms and 2 spins
+        energies, kpoints = np.linspace(-0.5, 0.5, 4), np.array([[0., 0., 0.], [0.1, 0., 0.], [0.2, 0., 0.]])
+        qdos_ref = np.random.RandomState(1).rand(2, 2, 5, 4, 3)
+        filenames = []
+        for iatom in range(2):
+            for ispin in range(2):
+                data = [[e, 0.001]+list(k)+list(qdos_ref[iatom, ispin, :, ie, ik])
+                        for ie, e in enumerate(energies) for ik, k in enumerate(kpoints)]
+                fname = 'qdos.%0.2i.%i.dat'%(iatom+1, ispin+1)
+                write_dosfile(os.path.join(self.path, fname), data)
+                filenames.append(fname)
+        open_dosfile = lambda fname: open(os.path.join(self.path, fname))
+        qdos = read_qdos_files(open_dosfile, filenames+['qvec.dat', 'dos.atom1'])
+        assert qdos['atoms'] == [1, 2]
+        assert qdos['spins'] == [1, 2]
+        assert np.allclose(qdos['energies'], energies)
+        assert np.allclose(qdos['energies_imag'], 0.001)
+        assert np.allclose(qdos['kpoints'], kpoints)
+        assert qdos['qdos'].shape == (2, 2, 5, 4, 3)
+        assert np.allclose(qdos['qdos'], qdos_ref)
+        # read through the view on the retrieved folder that is used in the parser
+        from aiida_kkr.tools.retrieved_folder import RetrievedFolderView
+        for in_memory in [False, True]:
+            with RetrievedFolderView(dummy_nodes.Folder(self.path), in_memory=in_memory) as folder:
+                qdos = read_qdos_files(folder.open, filenames)
+            assert np.allclose(qdos['qdos'], qdos_ref)
+        # missing spin channel of the second atom
+        with pytest.raises(ValueError):
+            get_qdos_filenames(filenames[:-1])
@@ -58,6 +58,24 @@ class TestAiida_kkr_entrypoints(object):
         assert isinstance(kkrstruc(), Data)
         assert isinstance(kkrstruc(), StructureData)
 
+    def test_kkrdosdata_entry_point(self):
+        from aiida.plugins import DataFactory
+        from aiida_kkr.data.kkrdos import KkrDosData
+
+        ArrayData = DataFactory('array')
+        kkrdos = DataFactory('kkr.kkrdos')
+        assert kkrdos == KkrDosData
+        assert isinstance(kkrdos(), ArrayData)
+
+    def test_kkrqdosdata_entry_point(self):
+        from aiida.plugins import DataFactory
+        from aiida_kkr.data.kkrqdos import KkrQdosData
+
+        ArrayData = DataFactory('array')
+        kkrqdos = DataFactory('kkr.kkrqdos')
+        assert kkrqdos == KkrQdosData
+        assert isinstance(kkrqdos(), ArrayData)
+
 
     # Parsers
 
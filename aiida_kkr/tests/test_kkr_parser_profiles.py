@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import pytest
+
+
+path = 'files/kkr/kkr_run_slab_soc_mag/'
+filenames = {'outfile': 'out_kkr', 'outfile_0init': 'output.0.txt', 'outfile_000': 'output.000.txt',
+             'timing_file': 'out_timing.000.txt', 'potfile_out': 'out_potential',
+             'nonco_out_file': 'nonco_angle_out.dat', 'outfile_2': 'output.2.txt'}
+
+
+class Test_kkr_parser_profiles(object):
+    """
+    Tests for the parser profiles of the KKR parser
+    """
+
+    def test_full_profile(self):
+        from masci_tools.io.parsers.kkrparser_functions import parse_kkr_outputfile
+        from aiida_kkr.tools.kkr_parser_profiles import get_parser_sections, parse_kkr_output_sections, _FILE_KEYS
+        # also compare the output of a DOS calculation and of a calculation without SOC
+        for runpath in [path, 'files/kkr/kkr_run_dos_output/', 'files/kkr/kkr_run_slab_nosoc/']:
+            files = dict((key, runpath+fname) for key, fname in filenames.items())
+            for skip_readin in [False, True]:
+                ref = parse_kkr_outputfile({}, *[files[key] for key in _FILE_KEYS], skip_readin=skip_readin)
+                out = parse_kkr_output_sections({}, files, get_parser_sections('full'), skip_readin=skip_readin)
+                assert out == ref
+
+    def test_reduced_profiles(self):
+        from aiida_kkr.tools.kkr_parser_profiles import get_parser_sections, parse_kkr_output_sections
+        files = dict((key, path+fname) for key, fname in filenames.items())
+        success, msg_list, full = parse_kkr_output_sections({}, files, get_parser_sections('full'))
+        for profile in ['scf', 'minimal']:
+            success, msg_list, out = parse_kkr_output_sections({}, files, get_parser_sections(profile))
+            assert success
+            assert msg_list == []
+            # everything that is parsed is the same as in the full output
+            for key, val in out.items():
+                if key == 'convergence_group':
+                    for key2, val2 in val.items():
+                        assert val2 == full[key][key2]
+                else:
+                    assert val == full[key]
+            for key in ['convergence_group', 'total_energy_Ry', 'fermi_energy', 'nspin']:
+                assert key in out
+            assert 'symmetries_group' not in out
+            assert 'timings_group' not in out
+        with pytest.raises(ValueError):
+            get_parser_sections('everything')
+
+    def test_lazy_output(self, dummy_nodes):
+        from aiida_kkr.tools.kkr_parser_profiles import get_parser_sections, parse_kkr_output_sections, LazyKkrOutput
+        files = dict((key, path+fname) for key, fname in filenames.items())
+        success, msg_list, full = parse_kkr_output_sections({}, files, get_parser_sections('full'))
+        success, msg_list, out_dict = parse_kkr_output_sections({}, files, get_parser_sections('minimal'))
+        out_dict['parser_profile'] = 'minimal'
+        output = LazyKkrOutput(dummy_nodes.Calc(out_dict, retrieved_path=path))
+        assert output['total_energy_Ry'] == full['total_energy_Ry']
+        # skipped sections are parsed from the retrieved files on first access
+        assert output['symmetries_group'] == full['symmetries_group']
+        assert 'symmetries' in output._parsed
+        assert 'timings' not in output._parsed
+        assert output.get('not_in_output') is None
+        assert output['timings_group'] == full['timings_group']
+        # all sections are there after parsing the rest
+        assert sorted(output.get_dict().keys()) == sorted(list(full.keys())+['parser_profile'])
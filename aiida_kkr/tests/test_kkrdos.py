@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import numpy as np
+import pytest
+
+
+@pytest.mark.usefixtures("aiida_env")
+class Test_kkrdos(object):
+    """
+    Tests for the KkrDosData data type
+    """
+
+    def test_parse_dosfiles(self):
+        """compare KkrDosData output of parse_dosfiles with the data that was stored in XyData nodes before"""
+        from masci_tools.io.common_functions import interpolate_dos, get_Ry2eV
+        from aiida_kkr.workflows.dos import parse_dosfiles
+        from aiida_kkr.data.kkrdos import KkrDosData
+        dosfile = 'files/kkr/kkr_run_dos_output/complex.dos'
+        ef, dos, dos_int = interpolate_dos(dosfile, return_original=True)
+        eVscale = get_Ry2eV()
+        for nspin in [1, 2]:
+            dosnode, dosnode2 = parse_dosfiles(dosfile, nspin=nspin)
+            for node, ref, dos_name in [(dosnode, dos, 'dos'), (dosnode2, dos_int, 'interpolated dos')]:
+                assert isinstance(node, KkrDosData)
+                assert node.natom == 4//nspin
+                assert node.nspin == nspin
+                assert node.channel_names == ['tot', 's', 'p', 'd', 'ns']
+                assert node.get_dos().shape == (4//nspin, nspin, 5, ref.shape[1])
+                # energy axis is stored only once
+                assert node.get_energies().shape == (ref.shape[1],)
+                # XyData compatible output
+                x = node.get_x()
+                assert x[0] == 'E-EF' and x[2] == 'eV'
+                assert np.allclose(x[1], (ref[:,:,0]-ef)*eVscale)
+                y = node.get_y()
+                assert [iy[0] for iy in y] == [dos_name+' '+name for name in ['tot', 's', 'p', 'd', 'ns']]
+                for il in range(5):
+                    assert np.allclose(y[il][1], ref[:,:,1+il]/eVscale)
+                assert np.allclose(node.get_dos('tot')[-1, -1], ref[-1,:,1]/eVscale)
+                assert len(node.get_y(channels=['tot'])) == 1
+
+    def test_set_dos_errors(self):
+        from aiida_kkr.data.kkrdos import KkrDosData
+        node = KkrDosData()
+        with pytest.raises(ValueError):
+            node.set_dos(np.zeros(10), np.zeros((2, 1, 10)), ['tot'])
+        with pytest.raises(ValueError):
+            node.set_dos(np.zeros(10), np.zeros((2, 1, 2, 10)), ['tot'])
+        with pytest.raises(ValueError):
+            node.set_dos(np.zeros(11), np.zeros((2, 1, 1, 10)), ['tot'])
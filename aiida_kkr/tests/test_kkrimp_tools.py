@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-#import pytest
 from __future__ import print_function
 from __future__ import absolute_import
+import pytest
 from builtins import object
 from aiida_kkr.tools.tools_kkrimp import modify_potential, kkrimp_parser_functions
 from masci_tools.io.common_functions import open_general
@@ -42,6 +42,45 @@ class Test_modify_potential(object):
         assert po1==po3
         assert po1==po4
 
+    def test_potential_index(self):
+        from aiida_kkr.tools.tools_kkrimp import get_potential_index, read_potential_blocks
+        # potential: blocks start with the 'exc:' line of each atom and cover the whole file
+        pot = 'files/mod_pot/test1/pot'
+        blocks = get_potential_index(pot)
+        txt = open(pot).read()
+        assert len(blocks) == 13
+        assert blocks[0][0] == 0
+        assert blocks[-1][1] == len(txt)
+        alltxt = ''.join(read_potential_blocks(pot, blocks))
+        assert alltxt == txt
+        for block in read_potential_blocks(pot, blocks[::-1]):
+            assert 'exc:' in block.split('\n')[0]
+        # shapefun: header lines in front of the first shape are not part of the blocks
+        shapefun = 'files/mod_pot/test2/shapefun'
+        blocks = get_potential_index(shapefun)
+        txt = open(shapefun).readlines()
+        assert len(blocks) == 1
+        assert list(read_potential_blocks(shapefun, blocks))[0] == ''.join(txt[2:])
+
+    def test_potential_index_filehandles(self):
+        import io
+        from aiida_kkr.tools.tools_kkrimp import get_potential_index, read_potential_blocks
+        from aiida_kkr.tools.retrieved_folder import read_to_memory
+        pot = 'files/mod_pot/test1/pot'
+        blocks = get_potential_index(pot)
+        ref = list(read_potential_blocks(pot, blocks))
+        with open(pot, 'rb') as f:
+            content = f.read()
+        # handles without a path on disk (in-memory copies of the retrieved folder, BytesIO, StringIO)
+        for handle in [open(pot), open(pot, 'rb'), read_to_memory(open(pot)), io.BytesIO(content),
+                       io.StringIO(content.decode('utf-8'))]:
+            handle.read(10)
+            assert get_potential_index(handle, mode='pot') == blocks
+            assert list(read_potential_blocks(handle, blocks)) == ref
+            # the given handle is used and kept open
+            assert not handle.closed
+            handle.close()
+
     def test_shapefun_from_scoef(self):
         shapefun_path = '../tests/files/mod_pot/test2/shapefun'
         scoefpath = '../tests/files/mod_pot/test2/scoef'
@@ -125,3 +164,249 @@ class Test_kkrimp_parser_functions(object):
         assert (not s)
         assert m==['Error parsing output of KKRimp: Version Info', 'Error parsing output of KKRimp: rms-error', 'Error parsing output of KKRimp: nspin/natom', 'Error parsing output of KKRimp: spin moment per atom', 'Error parsing output of KKRimp: orbital moment', 'Error parsing output of KKRimp: EF', 'Error parsing output of KKRimp: total energy', 'Error parsing output of KKRimp: search for warnings', 'Error parsing output of KKRimp: timings', 'Error parsing output of KKRimp: single particle energies', 'Error parsing output of KKRimp: charges', 'Error parsing output of KKRimp: energy contour', 'Error parsing output of KKRimp: core_states', 'Error parsing output of KKRimp: scfinfo']
         assert o=={'convergence_group': {}}
+
+    def test_parse_long_out_log(self, tmpdir):
+        """Parse a synthetic out_log with many iterations"""
+        path = 'files/kkrimp_parser/test1/'
+        with open(path+'out_log.000.txt') as f:
+            lines = f.readlines()
+        # the first iteration starts after the header of the file
+        header, iteration = lines[:8484], lines[8484:]
+        files = {}
+        files['outfile'] = path+'out_kkrimp'
+        files['out_pot'] = path+'out_potential'
+        files['out_enersp_at'] = path+'out_energysp_per_atom_eV'
+        files['out_enertot_at'] = path+'out_energytotal_per_atom_eV'
+        files['out_timing'] = path+'out_timing.000.txt'
+        files['kkrflex_llyfac'] = path+'out_timing.000.txt'
+        files['kkrflex_angles'] = path+'out_timing.000.txt'
+        files['out_spinmoms'] = path+'out_magneticmoments.txt'
+        files['out_orbmoms'] = path+'out_magneticmoments.txt'
+        niter = 20
+        files['out_log'] = str(tmpdir.join('out_log.000.txt'))
+        with open(files['out_log'], 'w') as f:
+            f.writelines(header)
+            for it in range(1, niter+1):
+                f.writelines([line.replace('ITERATION   1', 'ITERATION {:3d}'.format(it)) for line in iteration])
+        s, m, o = kkrimp_parser_functions().parse_kkrimp_outputfile({}, files)
+        assert s
+        assert o['convergence_group']['number_of_iterations'] == niter
+        assert len(o['convergence_group']['total_energy_Ry_all_iterations']) == niter
+        assert len(o['total_charge_per_atom']) == 13
+
+    def test_parse_moments_per_atom(self, tmpdir):
+        import numpy as np
+        natom, niter = 4, 3
+        moments = np.arange(niter*natom*3, dtype=float).reshape(niter*natom, 3)/10.
+        fname = str(tmpdir.join('out_magneticmoments_test.txt'))
+        with open(fname, 'w') as f:
+            f.write('# mx my mz\n')
+            for mom in moments:
+                f.write('{:12.6f} {:12.6f} {:12.6f}\n'.format(*mom))
+        spinmom_at, spinmom_at_all, spinmom_at_tot = kkrimp_parser_functions()._get_spinmom_per_atom(fname, natom)
+        assert spinmom_at_all.shape == (niter, natom, 3)
+        assert np.allclose(spinmom_at_all.reshape(-1, 3), moments)
+        assert np.allclose(spinmom_at, moments[-natom:])
+        assert abs(spinmom_at_tot - np.sqrt((moments[-natom:]**2).sum(axis=1)).sum()) < 1e-10
+
+    def test_trim_output_file(self, tmpdir):
+        from aiida_kkr.tools.tools_kkrimp import trim_output_file
+        header = ['header line\n', 'time until scf starts 0.1\n']
+        iterations = [['Iteration number {}\n'.format(i)]+['output of iteration {}\n'.format(i)]*50 for i in range(1, 4)]
+        fname = str(tmpdir.join('out_timing.000.txt'))
+        with open(fname, 'w') as f:
+            f.writelines(header+iterations[0]+iterations[1]+iterations[2])
+        # small buffer to test moving the tail of the file in many chunks
+        nremoved = trim_output_file(fname, ['Iteration number', 'time until scf starts'], bufsize=7)
+        with open(fname) as f:
+            txt = f.readlines()
+        assert txt == header[:1]+['# ... [removed output except for last iteration] ...\n']+iterations[2]
+        assert nremoved > 0
+        # nothing is removed if only one iteration is found
+        assert trim_output_file(fname, ['Iteration number']) == 0
+
+    def test_write_output_archive(self, tmpdir):
+        from aiida_kkr.tools.tools_kkrimp import write_output_archive
+        import tarfile
+        path = 'files/kkrimp_parser/test1/'
+        filelist = [path+'out_log.000.txt', path+'out_timing.000.txt']
+        filepath_tar = str(tmpdir.join('output_all.tar.gz'))
+        for compression in ['gz', 'gz_parallel', 'bz2', 'xz', 'zstd', 'none']:
+            info = write_output_archive(filepath_tar, filelist, compression=compression, compresslevel=1)
+            assert info['size_uncompressed'] == sum(info['file_sizes'].values())
+            with tarfile.open(filepath_tar) as tf:
+                assert sorted(tf.getnames()) == ['out_log.000.txt', 'out_timing.000.txt']
+                with open(filelist[1], 'rb') as f:
+                    assert tf.extractfile('out_timing.000.txt').read() == f.read()
+            if compression == 'none':
+                assert info['compression_ratio'] < 1
+            else:
+                assert info['compression_ratio'] > 1
+
+    def test_archive_member_access(self, tmpdir, monkeypatch):
+        from aiida_kkr.tools import tools_kkrimp
+        from aiida_kkr.tools.tools_kkrimp import (write_output_archive, read_archive_member, read_archive_members,
+                                                  list_archive_members, remove_archive_members)
+        path = 'files/kkrimp_parser/test1/'
+        names = ['out_log.000.txt', 'out_potential', 'out_timing.000.txt']
+        filepath_tar = str(tmpdir.join('output_all.tar.gz'))
+        for compression in ['gz', 'xz', 'none']:
+            info = write_output_archive(filepath_tar, [path+name for name in names], compression=compression)
+            # member index only for uncompressed archives
+            if compression=='none':
+                assert sorted(info['member_index'].keys()) == names
+            else:
+                assert 'member_index' not in info
+            assert sorted(info['file_sizes'].keys()) == names
+            assert list_archive_members(filepath_tar) == names
+            # read single members with and without member index
+            for name in names:
+                with open(path+name, 'rb') as f:
+                    ref = f.read()
+                assert read_archive_member(filepath_tar, name, info).read() == ref
+                member = read_archive_member(filepath_tar, name)
+                assert member.name == name
+                assert member.read() == ref
+            if compression=='none':
+                # members are read from their offset without scanning the archive
+                with monkeypatch.context() as m:
+                    m.setattr(tools_kkrimp, '_iter_archive_members', None)
+                    with open(path+'out_potential', 'rb') as f:
+                        assert read_archive_member(filepath_tar, 'out_potential', info).read() == f.read()
+            members = read_archive_members(filepath_tar, lambda name: name.startswith('out_log'))
+            assert list(members.keys()) == ['out_log.000.txt']
+            # remove member, the (now outdated) index still works
+            assert remove_archive_members(filepath_tar, ['out_potential'], compression) > 0
+            assert remove_archive_members(filepath_tar, ['out_potential'], compression) == 0
+            assert list_archive_members(filepath_tar) == ['out_log.000.txt', 'out_timing.000.txt']
+            with open(path+'out_timing.000.txt', 'rb') as f:
+                assert read_archive_member(filepath_tar, 'out_timing.000.txt', info).read() == f.read()
+            with pytest.raises(KeyError):
+                read_archive_member(filepath_tar, 'out_potential', info)
+
+    def test_remove_archive_members_failure(self, tmpdir, monkeypatch):
+        import os
+        import tarfile
+        from aiida_kkr.tools.tools_kkrimp import write_output_archive, remove_archive_members, list_archive_members
+        path = 'files/kkrimp_parser/test1/'
+        filepath_tar = str(tmpdir.join('output_all.tar.gz'))
+        write_output_archive(filepath_tar, [path+'out_log.000.txt', path+'out_potential'])
+        def addfile_failing(self, tinfo, fileobj=None):
+            raise IOError('disk full')
+        monkeypatch.setattr(tarfile.TarFile, 'addfile', addfile_failing)
+        with pytest.raises(IOError):
+            remove_archive_members(filepath_tar, ['out_potential'])
+        monkeypatch.undo()
+        # the old archive is kept and no temporary file is left behind
+        assert not os.path.exists(filepath_tar+'.tmp')
+        assert list_archive_members(filepath_tar) == ['out_log.000.txt', 'out_potential']
+
+    def test_remove_archive_members_batch(self, tmpdir):
+        from aiida_kkr.tools.tools_kkrimp import write_output_archive, remove_archive_members_batch, list_archive_members
+        path = 'files/kkrimp_parser/test1/'
+        archives = []
+        for i in range(8):
+            filepath_tar = str(tmpdir.join('output_all{}.tar.gz'.format(i)))
+            write_output_archive(filepath_tar, [path+'out_log.000.txt', path+'out_potential'])
+            archives.append((filepath_tar, 'gz', None))
+        reclaimed = remove_archive_members_batch(archives, ['out_potential'], nprocs=4)
+        assert len(reclaimed) == 8
+        assert min(reclaimed) > 0
+        for filepath_tar, compression, compresslevel in archives:
+            assert list_archive_members(filepath_tar) == ['out_log.000.txt']
+        # nothing left to remove
+        assert remove_archive_members_batch(archives, ['out_potential']) == [0]*8
+
+
+
+@pytest.mark.usefixtures("aiida_env")
+class Test_scoef_functions(object):
+    """ Tests for the functions that create the impurity cluster (scoef file). """
+
+    def get_fcc_structure(self, alat=3.61, nsites=1):
+        """Create a fcc Cu structure with `nsites` atoms stacked along the third Bravais vector"""
+        from aiida.plugins import DataFactory
+        StructureData = DataFactory('structure')
+        cell = [[0, alat/2., alat/2.], [alat/2., 0, alat/2.], [alat/2.*nsites, alat/2.*nsites, 0]]
+        s = StructureData(cell=cell)
+        for isite in range(nsites):
+            s.append_atom(position=[alat/2.*isite, alat/2.*isite, 0], symbols='Cu')
+        return s
+
+    def test_find_neighbors_spherical(self):
+        from aiida_kkr.tools.tools_kkrimp import get_structure_data, find_neighbors
+        s = self.get_fcc_structure()
+        structure_array = get_structure_data(s)
+        # first shell (12 atoms) and second shell (6 atoms) plus center atom
+        cls = find_neighbors(s, structure_array, 0, 3.61*1.01)
+        assert len(cls) == 19
+        assert cls[0][-1] == 0.
+        assert cls[1:,-1].max() <= 3.61*1.01
+
+    def test_find_neighbors_cylindrical(self):
+        from aiida_kkr.tools.tools_kkrimp import get_structure_data, find_neighbors
+        from numpy import sqrt, abs
+        s = self.get_fcc_structure()
+        structure_array = get_structure_data(s)
+        cls = find_neighbors(s, structure_array, 0, 3.61, clust_shape='cylindrical', h=1.0, vector=[0., 0., 1.])
+        # only atoms in the same (001) plane are found
+        assert (abs(cls[:,2]) <= 0.5).all()
+        assert (sqrt(cls[:,0]**2+cls[:,1]**2) <= 3.61).all()
+        assert len(cls) == 9
+
+    def test_translation_bounds_anisotropic_cell(self):
+        from aiida_kkr.tools.tools_kkrimp import get_translation_bounds
+        # elongated cell: only few translations are needed along the long axis
+        cell = [[1., 0, 0], [0, 1., 0], [0, 0, 10.]]
+        bounds = get_translation_bounds(cell, [[0, 0, 0]], [2.5, 2.5, 2.5])
+        assert bounds[0] == bounds[1]
+        assert bounds[0][1]-bounds[0][0] > 4
+        assert bounds[2][1]-bounds[2][0] <= 2
+        # limit to maximal box
+        bounds = get_translation_bounds(cell, [[0, 0, 0]], [2.5, 2.5, 2.5], nbox_max=1)
+        assert bounds == [(-1, 1), (-1, 1), (-1, 1)]
+
+    def test_find_neighbors_cluster_size(self, tmpdir):
+        """Cluster grows with the cluster radius, also for unit cells with several atoms"""
+        from aiida_kkr.tools.tools_kkrimp import make_scoef
+        for nsites in [1, 4]:
+            s = self.get_fcc_structure(nsites=nsites)
+            ncls_last = 0
+            for rcut in [3., 6., 9.]:
+                cls = make_scoef(s, rcut, str(tmpdir.join('scoef')))
+                # bigger clusters for larger cutoff radius
+                assert len(cls) > ncls_last
+                ncls_last = len(cls)
+
+    def test_write_scoef_layout(self, tmpdir):
+        """The buffered scoef writer gives the same file as writing the cluster line by line"""
+        from aiida_kkr.tools.tools_kkrimp import write_scoef
+        from numpy import arange, abs, round
+        from numpy.random import RandomState
+
+        def write_scoef_linewise(x_res, path):
+            """reference implementation with one write call per entry"""
+            x_res = x_res[x_res[:,-1].argsort()]
+            with open(path, 'w') as file:
+                file.write("{0:4d}".format(len(x_res)))
+                file.write("\n")
+                for i in range(len(x_res)):
+                    for j in range(3):
+                        file.write("{0:26.19e}".format(x_res[i][j]))
+                        file.write(" ")
+                    file.write("{0:4d}".format(int(x_res[i][3])))
+                    file.write(" ")
+                    file.write("{0:4.1f}".format(x_res[i][4]))
+                    file.write(" ")
+                    file.write("{0:26.19e}".format(x_res[i][5]))
+                    file.write("\n")
+
+        ncls = 100
+        x_res = RandomState(42).randn(ncls, 6)
+        x_res[:,3] = arange(ncls)
+        x_res[:,4] = round(10*x_res[:,4])
+        x_res[:,5] = abs(x_res[:,5])
+        write_scoef_linewise(x_res, str(tmpdir.join('scoef_linewise')))
+        write_scoef(x_res, str(tmpdir.join('scoef_buffered')))
+        # layout needs to be identical
+        assert tmpdir.join('scoef_linewise').read() == tmpdir.join('scoef_buffered').read()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import numpy as np
+import pytest
+
+
+@pytest.mark.usefixtures("aiida_env")
+class Test_kkrqdos(object):
+    """
+    Tests for the KkrQdosData data type
+    """
+
+    def get_qdos_node(self):
+        from aiida_kkr.data.kkrqdos import KkrQdosData
+        energies, kpoints = np.linspace(-0.5, 0.5, 20), np.zeros((30, 3))
+        kpoints[:,0] = np.linspace(0, 1, 30)
+        qdos = np.random.RandomState(0).rand(2, 1, 5, 20, 30)
+        node = KkrQdosData()
+        node.set_qdos(energies, kpoints, qdos, ['tot', 's', 'p', 'd', 'ns'], energies_imag=0.001*np.ones(20),
+                      atoms=[1, 3], fermi_energy=0.2)
+        return node, energies, qdos
+
+    def test_set_qdos(self):
+        from aiida_kkr.data.kkrqdos import KkrQdosData
+        node, energies, qdos = self.get_qdos_node()
+        assert node.atoms == [1, 3]
+        assert node.fermi_energy == 0.2
+        assert np.array_equal(node.get_qdos(mmap=False), qdos)
+        assert np.array_equal(node.get_qdos('d', mmap=False), qdos[:,:,3])
+        with pytest.raises(ValueError):
+            KkrQdosData().set_qdos(energies, np.zeros((30, 3)), qdos[0], ['tot', 's', 'p', 'd', 'ns'])
+        with pytest.raises(ValueError):
+            KkrQdosData().set_qdos(energies, np.zeros((31, 3)), qdos, ['tot', 's', 'p', 'd', 'ns'])
+
+    def test_mmap_slices(self):
+        node, energies, qdos = self.get_qdos_node()
+        node.store()
+        # the qdos array is memory mapped
+        assert isinstance(node.get_qdos(), np.memmap)
+        assert np.array_equal(node.get_qdos(), qdos)
+        # energy window and part of the k-path
+        ener, qdos_slice = node.get_slice(atom=1, channel='tot', emin=-0.2, emax=0.2, kpoints=slice(5, 10))
+        window = (energies>=-0.2) & (energies<=0.2)
+        assert np.array_equal(ener, energies[window])
+        assert np.array_equal(qdos_slice, qdos[1, :, 0][:, window, 5:10])
+        assert not isinstance(qdos_slice, np.memmap)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import os
+import pytest
+
+
+class Test_retrieved_folder_view(object):
+    """
+    Tests for the view on the retrieved folder that is used in the parsers
+    """
+
+    @pytest.fixture(autouse=True)
+    def retrieved_files(self, tmpdir):
+        self.path = str(tmpdir)
+        for name in ['out_kkr', 'output.000.txt', 'potential']:
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write('content of {}\n'.format(name))
+
+    def test_listing_and_handles(self, dummy_nodes):
+        from aiida_kkr.tools.retrieved_folder import RetrievedFolderView
+        dummy = dummy_nodes.Folder(self.path)
+        with RetrievedFolderView(dummy) as folder:
+            for name in ['out_kkr', 'output.000.txt', 'output.2.txt', 'potential']:
+                if name in folder:
+                    f = folder.open(name)
+                    assert f is folder.open(name)
+            handles = list(folder._handles.values())
+            assert len(handles) == 3
+            folder.delete_object('potential', force=True)
+            assert 'potential' not in folder
+            assert not os.path.exists(os.path.join(self.path, 'potential'))
+        # folder is listed only once and all handles are closed in the end
+        assert dummy.nlist == 1
+        assert all([f.closed for f in handles])
+
+    def test_in_memory(self, dummy_nodes):
+        from aiida_kkr.tools.retrieved_folder import RetrievedFolderView
+        from masci_tools.io.common_functions import open_general
+        with RetrievedFolderView(dummy_nodes.Folder(self.path), in_memory=True) as folder:
+            f = folder.open('out_kkr')
+            # in-memory copy can be read many times, also after being closed by the masci-tools functions
+            for i in range(3):
+                with open_general(f) as fopen:
+                    assert fopen.readlines() == ['content of out_kkr\n']
+        assert f.buffer.closed
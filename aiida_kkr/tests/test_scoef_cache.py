@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from builtins import object
+import os
+import pytest
+
+
+class Test_scoef_cache(object):
+    """
+    Tests for the on-disk cache of scoef and shapefun files
+    """
+
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, tmpdir):
+        self.cache_dir = str(tmpdir)
+
+    def test_cache_keys(self, dummy_nodes):
+        from aiida_kkr.tools.scoef_cache import get_scoef_cache_key, get_shapefun_cache_key
+        key = get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5, -1., [0., 0., 1.], 0)
+        assert key == get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5, -1., [0, 0, 1], 0)
+        assert key != get_scoef_cache_key(dummy_nodes.Structure('abd'), 1.5, -1., [0., 0., 1.], 0)
+        assert key != get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.6, -1., [0., 0., 1.], 0)
+        assert key != get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5, 2., [0., 0., 1.], 0)
+        assert key != get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5, -1., [1., 0., 0.], 0)
+        assert key != get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5, -1., [0., 0., 1.], 1)
+        shape_key = get_shapefun_cache_key(key, 'shapefun content', [1, 1, 2])
+        assert shape_key != get_shapefun_cache_key(key, 'shapefun content', [1, 2, 2])
+        assert shape_key != get_shapefun_cache_key(key, 'other content', [1, 1, 2])
+
+    def test_cache_keys_version(self, monkeypatch, dummy_nodes):
+        from aiida_kkr.tools import scoef_cache
+        key = scoef_cache.get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5)
+        # entries of an older cache format or scoef writer are not reused
+        monkeypatch.setattr(scoef_cache, '_CACHE_FORMAT_VERSION', scoef_cache._CACHE_FORMAT_VERSION+1)
+        assert key != scoef_cache.get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5)
+        monkeypatch.undo()
+        monkeypatch.setattr(scoef_cache, '_get_writer_version', lambda: '0.0.0')
+        assert key != scoef_cache.get_scoef_cache_key(dummy_nodes.Structure('abc'), 1.5)
+
+    def test_get_put(self):
+        from aiida_kkr.tools.scoef_cache import ScoefCache
+        cache = ScoefCache(cache_dir=self.cache_dir, max_size=1000)
+        assert cache.get('key', 'scoef') is None
+        cache.put('key', 'scoef', 'content\n')
+        assert cache.get('key', 'scoef') == 'content\n'
+        assert cache.get('key', 'shapefun') is None
+        cache.clear()
+        assert cache.get('key', 'scoef') is None
+
+    def test_other_files_untouched(self):
+        from aiida_kkr.tools.scoef_cache import ScoefCache
+        # cache directory that is shared with other files
+        with open(os.path.join(self.cache_dir, 'other_file.txt'), 'w') as f:
+            f.write(1000*'x')
+        cache = ScoefCache(cache_dir=self.cache_dir, max_size=250)
+        cache.put('key0', 'scoef', 100*'x')
+        cache.put('key1', 'scoef', 100*'x')
+        assert cache.get('key0', 'scoef') is not None
+        assert cache.get('key1', 'scoef') is not None
+        cache.clear()
+        assert os.listdir(self.cache_dir) == ['other_file.txt']
+
+    def test_disabled(self):
+        from aiida_kkr.tools.scoef_cache import ScoefCache
+        cache = ScoefCache(cache_dir=self.cache_dir, max_size=0)
+        cache.put('key', 'scoef', 'content\n')
+        assert cache.get('key', 'scoef') is None
+        assert os.listdir(self.cache_dir) == []
+
+    def test_lru_eviction(self):
+        from aiida_kkr.tools.scoef_cache import ScoefCache
+        cache = ScoefCache(cache_dir=self.cache_dir, max_size=250)
+        for i in range(2):
+            cache.put('key{}'.format(i), 'scoef', 100*'x')
+            # make sure modification times differ
+            os.utime(cache._get_path('key{}'.format(i), 'scoef'), (i, i))
+        # access first entry which makes key1 the least recently used entry
+        assert cache.get('key0', 'scoef') is not None
+        cache.put('key2', 'scoef', 100*'x')
+        assert cache.get('key0', 'scoef') is not None
+        assert cache.get('key1', 'scoef') is None
+        assert cache.get('key2', 'scoef') is not None
+        # entries larger than the cache are not stored
+        cache.put('key3', 'scoef', 300*'x')
+        assert cache.get('key3', 'scoef') is None
@@ -8,6 +8,7 @@ from .common_workfunctions import (update_params_wf, prepare_VCA_structure_wf, p
                                    get_inputs_voronoi, get_inputs_kkrimp, get_parent_paranode, 
                                    generate_inputcard_from_structure, check_2Dinput_consistency, 
                                    structure_from_params, neworder_potential_wf, vca_check, 
-                                   kick_out_corestates_wf, find_cluster_radius)
+                                   kick_out_corestates_wf, kick_out_corestates_batch_wf, find_cluster_radius,
+                                   get_structure_arrays)
 from .plot_kkr import plot_kkr
 from .tools_kkrimp import modify_potential, kkrimp_parser_functions, rotate_onto_z, find_neighbors, make_scoef
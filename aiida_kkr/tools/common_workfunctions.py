@@ -8,6 +8,7 @@ from __future__ import division
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from aiida.common.exceptions import InputValidationError
+from aiida.common.constants import elements as PeriodicTableElements
 from aiida.engine import calcfunction
 from aiida.plugins import DataFactory
 from masci_tools.io.kkr_params import kkrparams
@@ -21,6 +22,13 @@ Dict = DataFactory('dict')
 # keys that are used by aiida-kkr some something else than KKR parameters
 _ignored_keys = ['ef_set', 'use_input_alat']
 
+# connection between element symbol and atomic number
+_atomic_numbers = {data['symbol']: num for num, data in PeriodicTableElements.items()}
+
+# cache of the arrays extracted from stored structures (see get_structure_arrays), keys are the uuids
+_structure_arrays_cache = {}
+_structure_arrays_cache_maxlen = 100
+
 @calcfunction
 def update_params_wf(parameternode, updatenode):
     """
@@ -400,6 +408,76 @@ def get_parent_paranode(remote_data):
     return inp_para
 
 
+def get_structure_arrays(structure):
+    """
+    Convert the sites and kinds of a structure into compact numpy arrays in a single pass over the sites.
+    Per-kind information (atomic numbers and CPA weights) is computed only once for each kind.
+    The result of stored (i.e. immutable) structures is cached with the uuid of the structure as key.
+
+    :param structure: input structure of the type StructureData
+
+    :return: dictionary with the arrays (read-only)
+        * 'positions': positions of the sites in Angstroem, shape (nsites, 3)
+        * 'kind_names': names of the kinds in order of their first appearance
+        * 'kind_index': index in 'kind_names' of each site, shape (nsites,)
+        * 'ncomponents': number of symbols (CPA components) per site, shape (nsites,)
+        * 'site_index': index of the site (starting from 1) of each component, shape (ncomponents,)
+        * 'component_index': index of the component within its site, shape (ncomponents,)
+        * 'zatom': atomic number of each component, shape (ncomponents,)
+        * 'weights': CPA weight of each component (1 if the kind is not an alloy), shape (ncomponents,)
+        * 'has_vacancies': True for the components of kinds with vacancies, shape (ncomponents,)
+    """
+    import numpy as np
+
+    cache_key = structure.uuid if getattr(structure, 'is_stored', False) else None
+    if cache_key is not None and cache_key in _structure_arrays_cache:
+        return _structure_arrays_cache[cache_key]
+
+    # single pass over the sites to collect positions and the mapping to the kinds
+    positions, kind_index, kind_names, kind_lookup = [], [], [], {}
+    for site in structure.sites:
+        positions.append(site.position)
+        if site.kind_name not in kind_lookup:
+            kind_lookup[site.kind_name] = len(kind_names)
+            kind_names.append(site.kind_name)
+        kind_index.append(kind_lookup[site.kind_name])
+
+    # per-kind data
+    kind_zatom, kind_weights, kind_vacancies = [], [], []
+    for kind_name in kind_names:
+        sitekind = structure.get_kind(kind_name)
+        kind_zatom.append([_atomic_numbers[site_symbol] for site_symbol in sitekind.symbols])
+        if sitekind.is_alloy:
+            kind_weights.append(list(sitekind.weights))
+        else:
+            kind_weights.append([1.]*len(sitekind.symbols))
+        kind_vacancies.append(sitekind.has_vacancies)
+
+    # expand to arrays over the sites and components
+    kind_index = np.array(kind_index, dtype=int)
+    ncomponents = np.array([len(zatoms) for zatoms in kind_zatom], dtype=int)[kind_index]
+    istart = np.cumsum(ncomponents) - ncomponents
+    struc_arrays = {'positions': np.array(positions, dtype=float).reshape(-1, 3),
+                    'kind_names': kind_names,
+                    'kind_index': kind_index,
+                    'ncomponents': ncomponents,
+                    'site_index': np.repeat(np.arange(1, len(kind_index)+1), ncomponents),
+                    'component_index': np.arange(ncomponents.sum()) - np.repeat(istart, ncomponents),
+                    'zatom': np.array([z for ikind in kind_index for z in kind_zatom[ikind]], dtype=int),
+                    'weights': np.array([w for ikind in kind_index for w in kind_weights[ikind]], dtype=float),
+                    'has_vacancies': np.repeat(np.array(kind_vacancies, dtype=bool)[kind_index], ncomponents)}
+    for key, val in struc_arrays.items():
+        if key!='kind_names':
+            val.flags.writeable = False
+
+    if cache_key is not None:
+        if len(_structure_arrays_cache)>=_structure_arrays_cache_maxlen:
+            _structure_arrays_cache.pop(next(iter(_structure_arrays_cache)))
+        _structure_arrays_cache[cache_key] = struc_arrays
+
+    return struc_arrays
+
+
 def generate_inputcard_from_structure(parameters, structure, input_filename, parent_calc=None, shapes=None, isvoronoi=False, use_input_alat=False, vca_structure=False):
     """
     Takes information from parameter and structure data and writes input file 'input_filename'
@@ -423,7 +501,6 @@ def generate_inputcard_from_structure(parameters, structure, input_filename, par
            'check_2D_input' called in aiida_kkr.calculations.Kkrcaluation
     """
 
-    from aiida.common.constants import elements as PeriodicTableElements
     from numpy import array
     from masci_tools.io.kkr_params import kkrparams
     from masci_tools.io.common_functions import get_Ang2aBohr, get_alat_from_bravais
@@ -435,13 +512,6 @@ def generate_inputcard_from_structure(parameters, structure, input_filename, par
     #list of globally used constants
     a_to_bohr = get_Ang2aBohr()
 
-
-    # Get the connection between coordination number and element symbol
-    # maybe do in a differnt way
-
-    _atomic_numbers = {data['symbol']: num for num,
-                    data in PeriodicTableElements.items()}
-
     # KKR wants units in bohr
     bravais = array(structure.cell)*a_to_bohr
     alat_input = parameters.get_dict().get('ALATBASIS')
@@ -454,55 +524,44 @@ def generate_inputcard_from_structure(parameters, structure, input_filename, par
         alat = get_alat_from_bravais(bravais, is3D=structure.pbc[2])
     bravais = bravais/alat
 
-    sites = structure.sites
-    naez = len(sites)
-    positions = []
+    struc_arrays = get_structure_arrays(structure)
+    naez = len(struc_arrays['positions'])
+    positions = struc_arrays['positions']*a_to_bohr/alat # also in units of alat
+    ncomponents = struc_arrays['ncomponents']
     charges = []
     weights = [] # for CPA
     isitelist = [] # counter sites array for CPA
-    isite = 0
-    for site in sites:
-        pos = site.position
-        #TODO maybe convert to rel pos and make sure that type is right for script (array or tuple)
-        abspos = array(pos)*a_to_bohr/alat # also in units of alat
-        positions.append(abspos)
-        isite += 1
-        sitekind = structure.get_kind(site.kind_name)
-        for ikind in range(len(sitekind.symbols)):
-            site_symbol = sitekind.symbols[ikind]
-            if sitekind.is_alloy:
-                wght = sitekind.weights[ikind]
-            else:
-                wght = 1.
-            if not sitekind.has_vacancies:
-                zatom_tmp = _atomic_numbers[site_symbol]
-            else:
-                zatom_tmp = 0.0
-            if vca_structure and ikind>0 and not isvoronoi:
-                # for VCA case take weighted average (only for KKR code, voronoi code uses zatom of first site for dummy calculation)
-                zatom  = zatom*wght_last + zatom_tmp*wght
-                # also reset weight to 1
+    for isite, ikind, zatom_tmp, wght, has_vacancies in zip(struc_arrays['site_index'].tolist(),
+                                                            struc_arrays['component_index'].tolist(),
+                                                            struc_arrays['zatom'].tolist(),
+                                                            struc_arrays['weights'].tolist(),
+                                                            struc_arrays['has_vacancies'].tolist()):
+        if has_vacancies:
+            zatom_tmp = 0.0
+        if vca_structure and ikind>0 and not isvoronoi:
+            # for VCA case take weighted average (only for KKR code, voronoi code uses zatom of first site for dummy calculation)
+            zatom  = zatom*wght_last + zatom_tmp*wght
+            # also reset weight to 1
+            wght = 1.
+        else:
+            zatom = zatom_tmp
+            if vca_structure and isvoronoi:
                 wght = 1.
-            else:
-                zatom = zatom_tmp
-                if vca_structure and isvoronoi:
-                    wght = 1.
 
-            wght_last = wght # for VCA mode
+        wght_last = wght # for VCA mode
 
-            # make sure that for VCA only averaged position is written (or first for voronoi code)
-            if ( (vca_structure and ((len(sitekind.symbols)==1) or
-                                     (not isvoronoi and ikind==1) or
-                                     (isvoronoi and ikind==0)))
-                 or (not vca_structure) ):
-                charges.append(zatom)
-                weights.append(wght)
-                isitelist.append(isite)
+        # make sure that for VCA only averaged position is written (or first for voronoi code)
+        if ( (vca_structure and ((ncomponents[isite-1]==1) or
+                                 (not isvoronoi and ikind==1) or
+                                 (isvoronoi and ikind==0)))
+             or (not vca_structure) ):
+            charges.append(zatom)
+            weights.append(wght)
+            isitelist.append(isite)
 
     weights = array(weights)
     isitelist = array(isitelist)
     charges = array(charges)
-    positions = array(positions)
 
     # workaround for voronoi calculation with Zatom=83 (Bi potential not there!)
     if isvoronoi:
@@ -872,6 +931,10 @@ def neworder_potential_wf(settings_node, parent_calc_folder, **kwargs) : #, pare
         # run neworder_potential function
         modify_potential().neworder_potential(pot1_fhandle, out_pot_fhandle, neworder, potfile_2=pot2_fhandle,
                                               replace_from_pot2=replace_newpos)
+        # input potentials are read directly from disk in neworder_potential, the handles are not needed anymore
+        pot1_fhandle.close()
+        if pot2_fhandle is not None:
+            pot2_fhandle.close()
 
         # store output potential to SingleFileData
         output_potential_sfd_node = SingleFileData(file=tempfolder.open(out_pot, u'rb'))
@@ -910,10 +973,8 @@ def vca_check(structure, parameters):
     """
 
     """
-    nsites = 0
-    for site in structure.sites:
-        sitekind = structure.get_kind(site.kind_name)
-        nsites += len(sitekind.symbols)
+    # number of sites including all CPA components
+    nsites = len(get_structure_arrays(structure)['zatom'])
     # VCA mode if CPAINFO = [-1,-1] first
     try:
         if parameters.get_dict().get('CPAINFO')[0]<0:
@@ -931,6 +992,40 @@ def vca_check(structure, parameters):
     return vca_structure
 
 
+def _find_corestates_above_emin(potfile, emin):
+    """
+    Find the lines of all core states that lie higher than emin in a single pass over the potential file.
+    The core states of each potential follow after the line containing the number of core states, which is the
+    6th line after the 'POTENTIAL' header line of each atom.
+
+    :param potfile: input potential
+    :param emin: minimal energy above which all core states are kicked out from potential
+
+    :returns: set of line numbers that are removed, dictionary of replaced lines ({line number: new line})
+    """
+    drop_lines, replace_lines = set(), {}
+    istart, ncore, drop_pot = None, 0, []
+    with open_general(potfile) as f:
+        for iline, line in enumerate(f):
+            if 'POTENTIAL' in line:
+                istart = iline
+            elif istart is None:
+                continue
+            elif iline==istart+6:
+                # number of core states of this potential
+                ncore, drop_pot = int(line.split()[0]), []
+            elif istart+6<iline<=istart+6+ncore:
+                # core state line: l-quantum number and energy
+                if float(line.split()[1].replace('D', 'E'))>emin:
+                    drop_pot.append(iline)
+                if iline==istart+6+ncore and len(drop_pot)>0:
+                    # change number of core states in potential
+                    drop_lines.update(drop_pot)
+                    replace_lines[istart+6] = '%i 1\n'%(ncore-len(drop_pot))
+
+    return drop_lines, replace_lines
+
+
 def kick_out_corestates(potfile, potfile_out, emin):
     """
     Read potential file and kick out all core states that lie higher than emin.
@@ -940,47 +1035,44 @@ def kick_out_corestates(potfile, potfile_out, emin):
     :param emin: minimal energy above which all core states are kicked out from potential
     :returns: number of lines that have been deleted
     """
-    from masci_tools.io.common_functions import get_corestates_from_potential
-    from numpy import where, array
+    # find lines that are deleted or changed
+    drop_lines, replace_lines = _find_corestates_above_emin(potfile, emin)
 
-    # read core states
-    nstates, energies, lmoments = get_corestates_from_potential(potfile)
+    # find number of deleted lines
+    num_deleted = len(drop_lines)
 
-    with open_general(potfile) as f:
-        # read potential file
-        txt = f.readlines()
-
-        #get start of each potential part
-        istarts = [iline for iline in range(len(txt)) if 'POTENTIAL' in txt[iline]]
-        all_lines = list(range(len(txt))) # index array
-
-        # change list of core states
-        for ipot in range(len(nstates)):
-            if nstates[ipot]>0:
-                m = where(energies[ipot]>emin)
-                if len(m[0])>0:
-                    istart = istarts[ipot]
-                    # change number of core states in potential
-                    #print(txt[istart+6])
-                    txt[istart+6] = '%i 1\n'%(nstates[ipot]-len(m[0]))
-                    # now remove energy line accordingly
-                    for ie_out in m[0][::-1]:
-                        m_out = where(array(all_lines)==istart+6+ie_out+1)[0][0]
-                        e_out = all_lines.pop(m_out)
+    if num_deleted>0:
+        # write output potential (filtered copy of the input potential)
+        with open_general(potfile) as f:
+            with open_general(potfile_out, u'w') as f2:
+                for iline, line in enumerate(f):
+                    if iline not in drop_lines:
+                        f2.write(replace_lines.get(iline, line))
 
-        # find number of deleted lines
-        num_deleted = len(txt)-len(all_lines)
+    # return number of lines that were deleted
+    return num_deleted
 
-        if num_deleted>0:
-            # write output potential
-            with open_general(potfile_out, u'w') as f2:
-                txt_new = []
-                for iline in all_lines:
-                    txt_new.append(str(txt[iline]))
-                f2.writelines(txt_new)
 
-        # return number of lines that were deleted
-        return num_deleted
+def kick_out_corestates_batch(potfiles, potfiles_out, emin):
+    """
+    Kick out all core states that lie higher than emin from many potentials at once (see `kick_out_corestates`).
+    :param potfiles: list of input potentials
+    :param potfiles_out: list of output potentials (same length as potfiles)
+    :param emin: minimal energy above which all core states are kicked out, either one value for all potentials
+                 or a list of values (one per potential)
+    :returns: list of the number of lines that have been deleted in each potential
+    """
+    if len(potfiles)!=len(potfiles_out):
+        raise ValueError('potfiles and potfiles_out need to have the same length')
+    try:
+        emins = list(emin)
+    except TypeError:
+        emins = [emin for potfile in potfiles]
+    if len(emins)!=len(potfiles):
+        raise ValueError('emin needs to be a single value or a list with the same length as potfiles')
+
+    return [kick_out_corestates(potfile, potfile_out, emin_pot)
+            for potfile, potfile_out, emin_pot in zip(potfiles, potfiles_out, emins)]
 
 
 @calcfunction
@@ -1011,7 +1103,45 @@ def kick_out_corestates_wf(potential_sfd, emin):
     else:
         return potential_sfd.clone()
 
-def find_cluster_radius(structure, nclsmin, n_max_box=50, nbins=100):
+
+@calcfunction
+def kick_out_corestates_batch_wf(emin, **potentials):
+    """
+    Workfunction that kicks out all core states that are higher than emin from many single file data potentials at
+    once (see `kick_out_corestates_wf`).
+    :param emin: Energy threshold above which all core states are removed from the potentials (Float)
+    :param potentials: SingleFileData potentials given as keyword arguments
+    :returns: dictionary of potentials without core states higher than emin (SingleFileData), the keys are the
+              same as in the input
+    """
+    from aiida.common.folders import SandboxFolder
+    from aiida.plugins import DataFactory
+
+    SingleFileData = DataFactory('singlefile')
+
+    labels = sorted(potentials.keys())
+    potentials_out = {}
+    with SandboxFolder() as tmpdir:
+        potfiles, potfiles_out = [], []
+        try:
+            for label in labels:
+                potfiles.append(potentials[label].open(potentials[label].filename))
+                potfiles_out.append(tmpdir.open('potential_deleted_core_states_'+label, 'w'))
+            num_deleted = kick_out_corestates_batch(potfiles, potfiles_out, emin.value)
+        finally:
+            for potfile in potfiles+potfiles_out:
+                potfile.close()
+        # store new potentials as single file data objects
+        for label, ndel in zip(labels, num_deleted):
+            if ndel>0:
+                with tmpdir.open('potential_deleted_core_states_'+label) as potfile_out:
+                    potentials_out[label] = SingleFileData(file=potfile_out)
+            else:
+                potentials_out[label] = potentials[label].clone()
+
+    return potentials_out
+
+def find_cluster_radius(structure, nclsmin, n_max_box=50, nbins=100, exact=False):
     """
     Takes structure information (cell and site positions) and computes the minimal cluster radius needed
     such that all clusters around all atoms contain more than `nclsmin` atoms.
@@ -1022,30 +1152,34 @@ def find_cluster_radius(structure, nclsmin, n_max_box=50, nbins=100):
     :param nclsmin: minimal number of atoms in the screening cluster
     :param n_max_box: maximal number of supercells in 3D volume
     :param nbins: number of bins in which the cluster number is analyzed
+    :param exact: if True the radius is determined exactly from the distances of the `nclsmin`-th nearest
+                  neighbors (see `get_kth_neighbor_radius`) instead of the histogram over `nbins` radii in a
+                  fixed supercell box (`n_max_box` and `nbins` are then ignored)
 
     :returns: minimal cluster radius needed in Angstroem
     :returns: minimal cluster radius needed in units of the lattice constant
     """
     import numpy as np
     from masci_tools.io.common_functions import get_alat_from_bravais
+    from aiida_kkr.tools.tools_kkrimp import get_translation_grid
 
     # extract values needed from structure
     cell = np.array(structure.cell)
-    pos = np.array([site.position for site in structure.sites])
+    pos = get_structure_arrays(structure)['positions']
+
+    if exact:
+        rclsmax_ang = get_kth_neighbor_radius(cell, pos, nclsmin, pbc=structure.pbc)
+        rclsmax_alat = rclsmax_ang/get_alat_from_bravais(cell, structure.pbc[2])
+        return rclsmax_ang, rclsmax_alat
 
     # settings for supercell box
     box = int((n_max_box/len(pos))**(1/3.)+0.5)
     # print('maximal number of atoms in box (time number of atoms in unit cell):', (box*2+1)**3)
 
-    # find all positions in the supercell
-    all_pos_box = np.zeros_like(pos)
-    for i in range(-box, box+1):
-        for j in range(-box, box+1):
-            for k in range(-box, box+1):
-                for site in pos:
-                    tmppos = site+i*cell[0]+j*cell[1]+k*cell[2]
-                    all_pos_box = np.append(all_pos_box, [tmppos], axis=0)
-    all_pos_box = all_pos_box[len(pos):]
+    # find all positions in the supercell (all translations at once)
+    nml = get_translation_grid([(-box, box), (-box, box), (-box, box)])
+    all_pos_box = (((pos[np.newaxis,:,:] + nml[:,np.newaxis,0:1]*cell[0])
+                    + nml[:,np.newaxis,1:2]*cell[1]) + nml[:,np.newaxis,2:3]*cell[2]).reshape(-1, 3)
 
     # computer number of atoms in the clusters
     # Attention: assumes spherical clusters!
@@ -1063,3 +1197,103 @@ def find_cluster_radius(structure, nclsmin, n_max_box=50, nbins=100):
     # now the minimal cluster radius needed to get the spherical screening clusters around the atoms larger than
     # nclsmin atoms is found and can be returned
     return rclsmax_ang, rclsmax_alat
+
+
+def _get_neighbor_distances(images, pos, rsearch):
+    """
+    Helper function for `get_kth_neighbor_radius` that returns the sorted distances of all points in `images` that
+    lie within `rsearch` around each of the centers `pos`. If scipy is installed a KD-tree (`scipy.spatial.cKDTree`)
+    is used to find the neighbors, otherwise all distances are computed at once with numpy.
+
+    :param images: positions of all periodic images (array of shape (N, 3))
+    :param pos: positions of the cluster centers (array of shape (M, 3))
+    :param rsearch: search radius
+
+    :returns: list of M sorted arrays of distances (including the center itself with distance 0)
+    """
+    import numpy as np
+
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        cKDTree = None
+
+    dists = []
+    if cKDTree is not None:
+        tree = cKDTree(images)
+        for site, ineigh in zip(pos, tree.query_ball_point(pos, rsearch)):
+            diff = images[ineigh] - site
+            dists.append(np.sort(np.sqrt(np.sum(diff*diff, axis=1))))
+    else:
+        for site in pos:
+            diff = images - site
+            tmpdist = np.sqrt(np.sum(diff*diff, axis=1))
+            dists.append(np.sort(tmpdist[tmpdist<=rsearch]))
+
+    return dists
+
+
+def get_kth_neighbor_radius(cell, pos, nclsmin, pbc=(True, True, True), tol=10**-6):
+    """
+    Compute the minimal radius of spherical clusters such that the clusters around all atoms contain at least
+    `nclsmin` atoms (in addition to the center atom). For every atom the distance to its k-th nearest neighbor
+    (k = ceil(nclsmin)) is found exactly and the radius is placed in the middle between this neighbor shell and
+    the next one, which makes the result robust against rounding of the radius (e.g. when converted to alat units).
+    The periodic images are generated in a lattice-aware box whose size is grown until all k-th neighbor shells
+    are found. Neighbors are searched with a KD-tree if scipy is available (see `_get_neighbor_distances`).
+
+    :param cell: array of the three Bravais vectors
+    :param pos: positions of the atoms in the unit cell
+    :param nclsmin: minimal number of neighbors in the clusters
+    :param pbc: periodic boundary conditions, no images are constructed along non-periodic directions
+    :param tol: relative tolerance used to identify neighbor shells
+
+    :returns: cluster radius in the units of `cell` and `pos` (i.e. Angstroem for aiida structures)
+    """
+    import numpy as np
+    from aiida_kkr.tools.tools_kkrimp import get_translation_bounds, get_translation_grid
+
+    cell = np.array(cell, dtype=float)
+    pos = np.array(pos, dtype=float).reshape(-1, 3)
+    natom = len(pos)
+    k = int(np.ceil(nclsmin))
+    if k<1:
+        raise ValueError('nclsmin needs to be positive (got {})'.format(nclsmin))
+
+    # distances between all atoms of the unit cell (used to find the supercell box)
+    pos_diff = (pos[:,np.newaxis,:] - pos[np.newaxis,:,:]).reshape(-1, 3)
+
+    # initial guess for the search radius from the atom density (sphere containing k+1 atoms)
+    vol = abs(np.linalg.det(cell))
+    rsearch = max((3.*(k+2)*vol/(4.*np.pi*natom))**(1/3.), np.sqrt(np.sum(pos_diff**2, axis=1)).max())
+
+    while True:
+        bounds = get_translation_bounds(cell, pos_diff, [rsearch]*3)
+        bounds = [bounds[i] if pbc[i] else (0, 0) for i in range(3)]
+        nml = get_translation_grid(bounds)
+        images = (pos[np.newaxis,:,:] + np.dot(nml, cell)[:,np.newaxis,:]).reshape(-1, 3)
+
+        dists = _get_neighbor_distances(images, pos, rsearch)
+
+        # without periodic directions all atoms are found once rsearch is larger than the size of the structure
+        all_found = (not any(pbc)) and rsearch>=np.sqrt(np.sum(pos_diff**2, axis=1)).max()
+        if all_found and natom<=k:
+            raise ValueError('Not enough atoms in the structure to find clusters with {} atoms'.format(nclsmin))
+
+        # for every atom the k-th neighbor (index 0 is the atom itself) and the next shell need to be inside rsearch
+        rcls = -1
+        for tmpdist in dists:
+            if len(tmpdist)<=k:
+                break
+            if tmpdist[-1]>tmpdist[k]*(1+tol):
+                rnext = tmpdist[tmpdist>tmpdist[k]*(1+tol)][0]
+            elif all_found:
+                rnext = tmpdist[k]*(1+tol)
+            else:
+                break
+            rcls = max(rcls, (tmpdist[k]+rnext)/2.)
+        else:
+            return rcls
+
+        # increase search radius and try again
+        rsearch = 1.5*rsearch
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for the `convergence_arrays` output of the KKR and KKRimp calculations.
+
+The parsers move the per-iteration histories of the convergence group (rms error, charge neutrality,
+total energy, moments per atom, ...) from the `output_parameters` Dict into an ArrayData node with compact
+float arrays. The Dict then only holds the summary values (e.g. the rms of the last iteration).
+Use `get_convergence_arrays` to read the histories, it also works for older calculations where they are
+still stored in the Dict.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import numpy as np
+
+__copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
+                 "IAS-1/PGI-1, Germany. All rights reserved.")
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.1"
+__contributors__ = u"Philipp Rüßmann"
+
+
+# suffix of the keys in the convergence group that are stored as arrays
+_HISTORY_SUFFIX = '_all_iterations'
+
+
+def split_convergence_arrays(out_dict, out_arrays=None):
+    """
+    Move the per-iteration histories (keys ending with '_all_iterations') from the convergence group
+    of the parser output to a dictionary of float arrays. Entries that cannot be converted to a
+    regular float array (e.g. ragged lists) are kept in `out_dict`.
+
+    :param out_dict: output dictionary of the parser (changed in place)
+    :param out_arrays: dictionary that is filled with the arrays (new dictionary if not given)
+    :returns: out_arrays (dict of float64 arrays)
+    """
+    if out_arrays is None:
+        out_arrays = {}
+    convergence_group = out_dict.get('convergence_group', {})
+    for key in sorted(convergence_group.keys()):
+        value = convergence_group[key]
+        if key.endswith(_HISTORY_SUFFIX) and isinstance(value, (list, tuple, np.ndarray)):
+            try:
+                array = np.array(value, dtype=np.float64)
+            except (TypeError, ValueError):
+                continue
+            out_arrays[key] = array
+            convergence_group.pop(key)
+    return out_arrays
+
+
+def create_convergence_arrays(out_arrays):
+    """
+    Create the `convergence_arrays` output node
+
+    :param out_arrays: dictionary of arrays (see `split_convergence_arrays`)
+    :returns: ArrayData node (not stored)
+    """
+    from aiida.orm import ArrayData
+    convergence_arrays = ArrayData()
+    for key, array in out_arrays.items():
+        convergence_arrays.set_array(key, np.asarray(array, dtype=np.float64))
+    return convergence_arrays
+
+
+def get_convergence_arrays(calc, keys=None):
+    """
+    Read per-iteration histories of a KKR or KKRimp calculation. The arrays are taken from the
+    `convergence_arrays` output and from the convergence group of `output_parameters` for
+    calculations that do not have this output.
+
+    :param calc: KKR or KKRimp calculation node
+    :param keys: list of names of the histories (e.g. `['rms_all_iterations']`), all histories are returned if not given
+    :returns: dictionary of float arrays
+    :raises KeyError: if one of the requested histories is not found
+    """
+    try:
+        convergence_arrays = calc.outputs.convergence_arrays
+    except AttributeError:
+        convergence_arrays = None
+
+    histories = {}
+    if convergence_arrays is not None:
+        for key in convergence_arrays.get_arraynames():
+            if keys is None or key in keys:
+                histories[key] = convergence_arrays.get_array(key)
+
+    # older calculations store the histories in the output Dict
+    if (keys is None and convergence_arrays is None) or (keys is not None and any([key not in histories for key in keys])):
+        convergence_group = calc.outputs.output_parameters.get_dict().get('convergence_group', {})
+        in_dict = dict((key, val) for key, val in convergence_group.items()
+                       if key not in histories and (keys is None or key in keys))
+        split_convergence_arrays({'convergence_group': in_dict}, histories)
+
+    if keys is not None:
+        missing = [key for key in keys if key not in histories]
+        if len(missing)>0:
+            raise KeyError('histories {} not found in the output of calculation {}'.format(missing, calc))
+
+    return histories
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Consistency checks of the DOS that is computed in the kkr_startpot and kkr_scf workflows.
+
+The checks work on the total DOS of all atoms and spins at once (arrays of shape (atom*spin, energy))
+and return a report of the atoms and spins for which a check failed.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import numpy as np
+
+__copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
+                 "IAS-1/PGI-1, Germany. All rights reserved.")
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.1"
+__contributors__ = u"Philipp Rüßmann"
+
+
+def get_total_dos(dosdata):
+    """
+    Get energies and total DOS of the output of a DOS calculation (KkrDosData or XyData for older calculations)
+
+    :param dosdata: `dos_data` or `dos_data_interpol` output of the DOS workflow
+    :returns: energies, total DOS (arrays with shape (natom*nspin, nept))
+    """
+    from aiida_kkr.data.kkrdos import KkrDosData
+    if isinstance(dosdata, KkrDosData):
+        # slice the total DOS from the (atom, spin, channel, energy) array
+        ener = dosdata.get_x()[1]
+        totdos = dosdata.get_dos('tot').reshape(ener.shape)
+    else:
+        ener = dosdata.get_x()[1]
+        totdos = dosdata.get_y()[0][1]
+    return ener, totdos
+
+
+def find_negative_dos(totdos, nspin):
+    """
+    Find atoms and spins with negative DOS. For nspin==2 the DOS of the first spin channel is negative
+    (KKR convention), this is taken into account.
+
+    :param totdos: total DOS, array of shape (natom*nspin, nept)
+    :param nspin: number of spin channels
+    :returns: list of (iatom, ispin, minimal DOS value) for all atoms and spins with negative DOS
+    """
+    totdos = np.asarray(totdos).reshape(-1, nspin, np.shape(totdos)[-1])
+    dosmin = totdos.min(axis=2)
+    if nspin == 2:
+        # minimum of -y for the first spin channel
+        dosmin[:,0] = -totdos[:,0].max(axis=1)
+    return [(int(iatom), int(ispin), float(dosmin[iatom, ispin])) for iatom, ispin in zip(*np.where(dosmin<0))]
+
+
+def find_dos_at_emin(ener, totdos, nspin, emin, threshold_dos_zero):
+    """
+    Find atoms and spins where the DOS at the bottom of the energy contour is not zero.
+    The DOS is taken at the energy point closest to `emin`.
+
+    :param ener: energies, array of shape (natom*nspin, nept)
+    :param totdos: total DOS, array of shape (natom*nspin, nept)
+    :param nspin: number of spin channels
+    :param emin: bottom of the energy contour (same units as `ener`, i.e. in eV relative to EF)
+    :param threshold_dos_zero: threshold below which the DOS is considered to be zero
+    :returns: list of (iatom, ispin, abs(DOS at emin)) for all atoms and spins where abs(DOS at emin) > threshold_dos_zero
+    """
+    ener, totdos = np.asarray(ener), np.asarray(totdos)
+    iemin = abs(ener-emin).argmin(axis=1)
+    dos_emin = abs(totdos[np.arange(len(totdos)), iemin]).reshape(-1, nspin)
+    return [(int(iatom), int(ispin), float(dos_emin[iatom, ispin])) for iatom, ispin in zip(*np.where(dos_emin>threshold_dos_zero))]
+
+
+def check_dos(dosdata, dosdata_interpol, natom, nspin, emin, threshold_dos_zero):
+    """
+    Check the DOS for negative values (on the DOS contour) and for non-zero values at the bottom of the
+    energy contour (interpolated DOS on the real axis).
+
+    :param dosdata: `dos_data` output of the DOS workflow (KkrDosData or XyData)
+    :param dosdata_interpol: `dos_data_interpol` output of the DOS workflow (KkrDosData or XyData)
+    :param natom: number of atoms
+    :param nspin: number of spin channels
+    :param emin: bottom of the energy contour in eV relative to EF
+    :param threshold_dos_zero: threshold below which the DOS is considered to be zero
+
+    :returns: report dictionary with the keys
+
+        * 'dos_ok': True if all checks passed
+        * 'shape_ok': False if the shape of the DOS does not fit natom and nspin (the other checks are skipped then)
+        * 'negative_dos': list of (iatom, ispin, minimal DOS value) where the DOS is negative
+        * 'dos_at_emin': list of (iatom, ispin, DOS value) where the DOS at EMIN is above the threshold
+    """
+    report = {'dos_ok': True, 'shape_ok': True, 'negative_dos': [], 'dos_at_emin': []}
+
+    ener, totdos = get_total_dos(dosdata)
+    if len(ener) != nspin*natom:
+        report['shape_ok'] = False
+        report['dos_ok'] = False
+        report['shape'] = list(np.shape(ener))
+        return report
+    report['negative_dos'] = find_negative_dos(totdos, nspin)
+
+    ener, totdos = get_total_dos(dosdata_interpol)
+    report['dos_at_emin'] = find_dos_at_emin(ener, totdos, nspin, emin, threshold_dos_zero)
+
+    report['dos_ok'] = len(report['negative_dos'])==0 and len(report['dos_at_emin'])==0
+
+    return report
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Fast readers for the text files with density of states data written by KKR and KKRimp
+(e.g. the `out_ldos*` files of KKRimp).
+
+Regular files are parsed with numpy's C parser into arrays that are identical to the result of `numpy.loadtxt`.
+Many files of the same shape (e.g. one file per atom and spin) are read into a single preallocated array.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import numpy as np
+import six
+
+__copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
+                 "IAS-1/PGI-1, Germany. All rights reserved.")
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.3"
+__contributors__ = u"Philipp Rüßmann"
+
+
+def _parse_table(txt, comments='#'):
+    """
+    Parse the text of a table of floats in a single call to numpy's C parser. Only the block of comment lines at the
+    beginning of the file (the header of the DOS files) is removed, the text is not split into lines.
+
+    :returns: 2D array of floats, None if the text has other comments or irregular formatting (e.g. rows of
+              different length, empty lines or entries that are no floats)
+    """
+    import warnings
+
+    data = txt.lstrip()
+    while data.startswith(comments):
+        newline = data.find('\n')
+        data = data[newline+1:].lstrip() if newline>=0 else ''
+    data = data.rstrip()
+    if data=='' or comments in data:
+        return None
+
+    nrows = data.count('\n')+1
+    ncol = len(data[:data.find('\n')].split()) if nrows>1 else len(data.split())
+    try:
+        with warnings.catch_warnings():
+            # incomplete parsing is only reported as a warning
+            warnings.simplefilter('error')
+            values = np.fromstring(data, dtype=np.float64, sep=' ')
+    except (ValueError, DeprecationWarning):
+        return None
+    if values.size!=nrows*ncol:
+        return None
+    return values.reshape(nrows, ncol)
+
+
+def read_text_table(fileobj, comments='#'):
+    """
+    Read a text file with a table of floats (e.g. a DOS file). The result is identical to `numpy.loadtxt(fileobj)`
+    but regular files are parsed in a single call to numpy's C parser. Files with comments after the header or
+    irregular formatting are passed on to `numpy.loadtxt`.
+
+    :param fileobj: file handle (text or binary mode, e.g. an `io.BytesIO` from `read_archive_members`) or path
+    :param comments: character that starts a comment
+
+    :returns: 2D array of floats with shape (rows, columns)
+    """
+    import io
+
+    if isinstance(fileobj, six.string_types):
+        with open(fileobj, 'rb') as f:
+            raw = f.read()
+    else:
+        raw = fileobj.read()
+    # byte strings are decoded like in loadtxt (also the text mode files of python 2)
+    txt = raw.decode('latin1') if isinstance(raw, bytes) else raw
+
+    values = _parse_table(txt, comments)
+    if values is None:
+        # fallback which also gives the usual error messages of loadtxt for broken files
+        fallback = io.BytesIO(raw) if isinstance(raw, bytes) else io.StringIO(raw)
+        values = np.loadtxt(fallback, comments=comments, ndmin=2)
+    return values
+
+
+def read_dos_files(open_file, filenames, nthreads=None, comments='#'):
+    """
+    Read many DOS files with the same shape (e.g. one file per atom and spin) into one array.
+    The array is allocated once and filled in place.
+
+    :param open_file: function that takes a filename and returns a file handle (used in a `with` statement)
+    :param filenames: list of filenames
+    :param nthreads: number of threads that read the files (default: read the files one after the other)
+    :param comments: character that starts a comment
+
+    :returns: 3D array of floats with shape (len(filenames), rows, columns)
+    :raises ValueError: if the files do not all have the same shape
+    """
+    def read_file(fname):
+        with open_file(fname) as dosfile:
+            return read_text_table(dosfile, comments=comments)
+
+    if len(filenames)==0:
+        return np.zeros((0, 0, 0))
+
+    first = read_file(filenames[0])
+    data = np.empty((len(filenames),)+first.shape, dtype=np.float64)
+    data[0] = first
+
+    def fill(ifile):
+        table = read_file(filenames[ifile])
+        if table.shape!=first.shape:
+            raise ValueError('shape {} of file {} does not match shape {} of file {}'.format(table.shape, filenames[ifile],
+                                                                                             first.shape, filenames[0]))
+        data[ifile] = table
+
+    if nthreads is not None and nthreads>1 and len(filenames)>2:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(nthreads, len(filenames)-1))
+        try:
+            pool.map(fill, range(1, len(filenames)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for ifile in range(1, len(filenames)):
+            fill(ifile)
+
+    return data
+
+
+def get_lmdos_arrays(data, ef, emin=None, emax=None, dtype=np.float64):
+    """
+    Convert the content of the lm-resolved DOS files of KKRimp (`out_lmdos*`) to an energy axis and an lm-DOS array.
+    The energies are converted to eV relative to the Fermi level and the DOS to states/eV.
+
+    :param data: array of shape (atom, spin, energy, column) with the content of the `out_lmdos*` files
+                 (see `read_dos_files`), the first column is the energy (in Ry) and the others are the lm-components of the DOS
+    :param ef: Fermi energy in Ry
+    :param emin: lower bound of the energy window in eV relative to EF (optional)
+    :param emax: upper bound of the energy window in eV relative to EF (optional)
+    :param dtype: data type of the lm-DOS array (e.g. `numpy.float32` to halve the size of the array)
+
+    :returns: energies (1D float64 array), lmdos (array of shape (atom, spin, energy, lm))
+    """
+    from masci_tools.io.common_functions import get_Ry2eV
+
+    eVscale = get_Ry2eV()
+    # the energy points are the same for all atoms and spins
+    energies = (data[0, 0, :, 0]-ef)*eVscale
+    window = np.ones(len(energies), dtype=bool)
+    if emin is not None:
+        window &= energies>=emin
+    if emax is not None:
+        window &= energies<=emax
+
+    lmdos = np.asarray(data[:, :, window, 1:]/eVscale, dtype=dtype)
+
+    return energies[window], lmdos
+
+
+def get_qdos_filenames(filenames):
+    """
+    Find the qdos files (`qdos.XX.Y.dat` for atom XX and spin Y) of a bandstructure calculation.
+
+    :param filenames: list of filenames (e.g. content of the retrieved folder)
+    :returns: list of atom indices, list of spin indices, dict of filenames with (atom, spin) keys
+    :raises ValueError: if the files of some atoms or spins are missing
+    """
+    import re
+    pattern = re.compile(r'^qdos\.\s*(\d+)\.(\d+)\.dat$')
+    qdos_files = {}
+    for fname in filenames:
+        match = pattern.match(fname)
+        if match is not None:
+            qdos_files[(int(match.group(1)), int(match.group(2)))] = fname
+    atoms = sorted(set([iatom for iatom, ispin in qdos_files]))
+    spins = sorted(set([ispin for iatom, ispin in qdos_files]))
+    if len(qdos_files) != len(atoms)*len(spins):
+        raise ValueError('qdos files missing for some atoms or spins: {}'.format(sorted(qdos_files.values())))
+    return atoms, spins, qdos_files
+
+
+def read_qdos_files(open_file, filenames, nthreads=None):
+    """
+    Read the qdos files of a bandstructure calculation. The files have the columns
+    Re(E), Im(E), k_x, k_y, k_z, DEN_tot, DEN_s, DEN_p, ..., DEN_ns
+    and the k-points run fastest.
+
+    :param open_file: function that takes a filename and returns a file handle (used in a `with` statement)
+    :param filenames: list of filenames (the qdos files are found with `get_qdos_filenames`)
+    :param nthreads: number of threads that read the files (see `read_dos_files`)
+
+    :returns: dictionary with the entries
+        * 'atoms', 'spins': atom and spin indices of the qdos files
+        * 'energies', 'energies_imag': real and imaginary part of the energy points (in Ry)
+        * 'kpoints': k-points (array of shape (kpoint, 3))
+        * 'qdos': array of shape (atom, spin, channel, energy, kpoint), the first channel is the total qdos
+    """
+    atoms, spins, qdos_files = get_qdos_filenames(filenames)
+    data = read_dos_files(open_file, [qdos_files[(iatom, ispin)] for iatom in atoms for ispin in spins], nthreads=nthreads)
+
+    # number of k-points from the number of rows with the first energy point
+    first = data[0]
+    new_energy = (first[:,0]!=first[0,0]) | (first[:,1]!=first[0,1])
+    nkpt = int(new_energy.argmax()) if new_energy.any() else len(first)
+    if len(first)%nkpt != 0:
+        raise ValueError('number of rows ({}) in the qdos files is not a multiple of the number of k-points ({})'.format(len(first), nkpt))
+    nepts = len(first)//nkpt
+
+    qdos = data[:,:,5:].reshape(len(atoms), len(spins), nepts, nkpt, -1).transpose(0, 1, 4, 2, 3)
+
+    return {'atoms': atoms, 'spins': spins,
+            'energies': first[::nkpt,0].copy(), 'energies_imag': first[::nkpt,1].copy(),
+            'kpoints': first[:nkpt,2:5].copy(), 'qdos': np.ascontiguousarray(qdos)}
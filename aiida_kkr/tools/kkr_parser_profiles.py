@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Parser profiles of the KKR calculation.
+
+The output of a KKR calculation is split into sections (convergence info, energy contour, symmetries,
+timings, ...). The parser profile (option `parser_profile` of the KkrCalculation) selects the sections that
+are parsed eagerly by the KkrParser:
+
+* `full`: everything (default, same as `masci_tools.io.parsers.kkrparser_functions.parse_kkr_outputfile`)
+* `scf`: everything that is needed in the kkr_scf workflow (convergence info, energies, moments, charges,
+  energy contour, core states, warnings)
+* `minimal`: only the convergence info and the total and Fermi energies
+
+Every section is parsed with the helper functions of `masci_tools.io.parsers.kkrparser_functions` in the
+same way as in `parse_kkr_outputfile`. Sections that were skipped can be parsed later on from the retrieved
+files with `LazyKkrOutput`.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+from builtins import object
+from collections import OrderedDict
+from masci_tools.io.common_functions import get_version_info, get_Ry2eV, convert_to_pystd
+from masci_tools.io.parsers.kkrparser_functions import (get_nspin, get_natom, use_newsosol, find_warnings,
+                                                        extract_timings, get_econt_info, get_alatinfo,
+                                                        get_kmeshinfo, get_symmetries, get_ewald,
+                                                        get_lattice_vectors, get_core_states, get_rms, get_neutr,
+                                                        get_magtot, get_spinmom_per_atom, get_orbmom, get_noco_rms,
+                                                        get_EF, get_DOS_EF, get_Etot, get_single_particle_energies,
+                                                        get_charges_per_atom, get_scfinfo)
+
+__copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
+                 "IAS-1/PGI-1, Germany. All rights reserved.")
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.3"
+__contributors__ = u"Philipp Rüßmann"
+
+
+# names of the output files (same as the arguments of parse_kkr_outputfile)
+_FILE_KEYS = ['outfile', 'outfile_0init', 'outfile_000', 'timing_file', 'potfile_out', 'nonco_out_file', 'outfile_2']
+
+# prefix of the error messages of parse_kkr_outputfile
+_MSG_PREFIX = 'Error parsing output of KKR: '
+
+
+### parser steps of the sections (same output as the corresponding parts of parse_kkr_outputfile) ###
+
+
+def _is_doscalc(out_dict):
+    """True if the output is from a DOS calculation (energy contour with NPOL=0)"""
+    return out_dict.get('energy_contour_group', {}).get('npol', -1) == 0
+
+
+def _parse_version_info(out_dict, files):
+    code_version, compile_options, serial_number = get_version_info(files['outfile'])
+    out_dict['code_info_group'] = {'code_version': code_version, 'compile_options': compile_options,
+                                   'calculation_serial_number': serial_number}
+
+
+def _parse_nspin_natom(out_dict, files):
+    out_dict['nspin'] = get_nspin(files['outfile_0init'])
+    out_dict['number_of_atoms_in_unit_cell'] = get_natom(files['outfile_0init'])
+    out_dict['use_newsosol'] = use_newsosol(files['outfile_0init'])
+
+
+def _parse_warnings(out_dict, files):
+    result = find_warnings(files['outfile'])
+    out_dict['warnings_group'] = {'number_of_warnings': len(result), 'warnings_list': result}
+
+
+def _parse_timings(out_dict, files):
+    out_dict['timings_group'] = extract_timings(files['timing_file'])
+    out_dict['timings_unit'] = 'seconds'
+
+
+def _parse_energy_contour(out_dict, files):
+    emin, tempr, Nepts, Npol, N1, N2, N3 = get_econt_info(files['outfile_0init'])
+    out_dict['energy_contour_group'] = {'emin': emin, 'emin_unit': 'Rydberg', 'number_of_energy_points': Nepts,
+                                        'temperature': tempr, 'temperature_unit': 'Kelvin', 'npol': Npol,
+                                        'n1': N1, 'n2': N2, 'n3': N3}
+
+
+def _parse_alat(out_dict, files):
+    alat, twopioveralat = get_alatinfo(files['outfile_0init'])
+    out_dict['alat_internal'] = alat
+    out_dict['two_pi_over_alat_internal'] = twopioveralat
+    out_dict['alat_internal_unit'] = 'a_Bohr'
+    out_dict['two_pi_over_alat_internal_unit'] = '1/a_Bohr'
+
+
+def _parse_lattice_vectors(out_dict, files):
+    bv, recbv = get_lattice_vectors(files['outfile_0init'])
+    out_dict['direct_bravais_matrix'] = bv
+    out_dict['reciprocal_bravais_matrix'] = recbv
+    out_dict['direct_bravais_matrix_unit'] = 'alat'
+    out_dict['reciprocal_bravais_matrix_unit'] = '2*pi / alat'
+
+
+def _parse_kmesh(out_dict, files):
+    nkmesh, kmesh_ie = get_kmeshinfo(files['outfile_0init'], files['outfile_000'])
+    out_dict['kmesh_group'] = {'number_different_kmeshes': nkmesh[0], 'number_kpoints_per_kmesh': nkmesh[1],
+                               'kmesh_energypoint': kmesh_ie}
+
+
+def _parse_symmetries(out_dict, files):
+    nsym, nsym_used, desc = get_symmetries(files['outfile_0init'])
+    out_dict['symmetries_group'] = {'number_of_lattice_symmetries': nsym, 'number_of_used_symmetries': nsym_used,
+                                    'symmetry_description': desc}
+
+
+def _parse_ewald(out_dict, files):
+    # in case of a DOS calculation no ewald summation is done
+    if _is_doscalc(out_dict):
+        return
+    rsum, gsum, info = get_ewald(files['outfile_0init'])
+    out_dict['ewald_sum_group'] = {'ewald_summation_mode': info, 'rsum_cutoff': rsum[0],
+                                   'rsum_number_of_vectors': rsum[1], 'rsum_number_of_shells': rsum[2],
+                                   'rsum_cutoff_unit': 'a_Bohr', 'gsum_cutoff': gsum[0],
+                                   'gsum_number_of_vectors': gsum[1], 'gsum_number_of_shells': gsum[2],
+                                   'gsum_cutoff_unit': '1/a_Bohr'}
+
+
+def _parse_core_states(out_dict, files):
+    ncore, emax, lmax, descr_max = get_core_states(files['potfile_out'])
+    out_dict['core_states_group'] = {'number_of_core_states_per_atom': ncore,
+                                     'energy_highest_lying_core_state_per_atom': emax,
+                                     'energy_highest_lying_core_state_per_atom_unit': 'Rydberg',
+                                     'descr_highest_lying_core_state_per_atom': descr_max}
+
+
+def _parse_rms(out_dict, files):
+    rms_charge, rms_spin, rms_per_atom, rms_spin_per_atom = get_rms(files['outfile'], files['outfile_000'])
+    conv = out_dict['convergence_group']
+    conv['rms'] = rms_charge[-1]
+    conv['rms_all_iterations'] = rms_charge
+    conv['rms_per_atom'] = rms_per_atom
+    conv['rms_spin'] = rms_spin[-1] if len(rms_spin) > 0 else None
+    conv['rms_spin_all_iterations'] = rms_spin
+    conv['rms_spin_per_atom'] = rms_spin_per_atom
+    conv['rms_unit'] = 'unitless'
+
+
+def _parse_neutrality(out_dict, files):
+    result = get_neutr(files['outfile'])
+    conv = out_dict['convergence_group']
+    conv['charge_neutrality'] = result[-1]
+    conv['charge_neutrality_all_iterations'] = result
+    conv['charge_neutrality_unit'] = 'electrons'
+
+
+def _parse_scfinfo(out_dict, files):
+    try:
+        niter, nitermax, converged, nmax_reached, mixinfo = get_scfinfo(files['outfile_0init'], files['outfile_000'],
+                                                                        files['outfile'])
+    except IndexError:
+        niter, nitermax, converged, nmax_reached, mixinfo = get_scfinfo(files['outfile_0init'], files['outfile_2'],
+                                                                        files['outfile'])
+    conv = out_dict['convergence_group']
+    conv['number_of_iterations'] = niter
+    conv['number_of_iterations_max'] = nitermax
+    conv['calculation_converged'] = converged
+    conv['nsteps_exhausted'] = nmax_reached
+    for key, val in zip(['imix', 'strmix', 'qbound', 'fcm', 'idtbry', 'brymix'], mixinfo):
+        conv[key] = val
+
+
+def _parse_magtot(out_dict, files):
+    result = get_magtot(files['outfile'])
+    if len(result) > 0:
+        mag = out_dict.setdefault('magnetism_group', {})
+        mag['total_spin_moment'] = result[-1]
+        mag['total_spin_moment_unit'] = 'mu_Bohr'
+        out_dict['convergence_group']['total_spin_moment_all_iterations'] = result
+
+
+def _parse_spinmom_per_atom(out_dict, files):
+    if out_dict['nspin'] > 1:
+        newsosol = out_dict['use_newsosol']
+        # the nonco angles file is only read for the new solver
+        nonco_out_file = files['nonco_out_file'] if newsosol else None
+        result, vec, angles = get_spinmom_per_atom(files['outfile'], out_dict['number_of_atoms_in_unit_cell'],
+                                                   nonco_out_file)
+        if len(result) > 0:
+            mag = out_dict.setdefault('magnetism_group', {})
+            mag['spin_moment_per_atom'] = result[-1, :]
+            if newsosol:
+                mag['spin_moment_vector_per_atom'] = vec[:]
+                mag['spin_moment_angles_per_atom'] = angles[:]
+                mag['spin_moment_angles_per_atom_unit'] = 'degree'
+            mag['spin_moment_unit'] = 'mu_Bohr'
+            out_dict['convergence_group']['spin_moment_per_atom_all_iterations'] = result[:, :]
+
+
+def _parse_orbmom(out_dict, files):
+    if out_dict['nspin'] > 1 and out_dict['use_newsosol']:
+        # only the component of the orbital moment parallel to the spin moment is written by the KKR code
+        result = get_orbmom(files['outfile'], out_dict['number_of_atoms_in_unit_cell'])
+        if len(result) > 0:
+            mag = out_dict.setdefault('magnetism_group', {})
+            mag['total_orbital_moment'] = sum(result[-1, :])
+            mag['orbital_moment_per_atom'] = result[-1, :]
+            mag['orbital_moment_unit'] = 'mu_Bohr'
+            out_dict['convergence_group']['orbital_moment_per_atom_all_iterations'] = result[:, :]
+
+
+def _parse_noco_rms(out_dict, files):
+    if out_dict['nspin'] > 1 and out_dict['use_newsosol']:
+        result = get_noco_rms(files['outfile'])
+        if len(result) > 0:
+            out_dict['convergence_group']['noco_angles_rms_all_iterations'] = result[:]
+            out_dict['convergence_group']['noco_angles_rms_all_iterations_unit'] = 'degrees'
+
+
+def _parse_EF(out_dict, files):
+    result = get_EF(files['outfile'])
+    out_dict['fermi_energy'] = result[-1]
+    out_dict['fermi_energy_units'] = 'Ry'
+    out_dict['convergence_group']['fermi_energy_all_iterations'] = result
+    out_dict['convergence_group']['fermi_energy_all_iterations_units'] = 'Ry'
+
+
+def _parse_DOS_EF(out_dict, files):
+    result = get_DOS_EF(files['outfile'])
+    out_dict['dos_at_fermi_energy'] = result[-1]
+    out_dict['convergence_group']['dos_at_fermi_energy_all_iterations'] = result
+
+
+def _parse_Etot(out_dict, files):
+    result = get_Etot(files['outfile'])
+    out_dict['energy'] = result[-1] * get_Ry2eV()
+    out_dict['energy_unit'] = 'eV'
+    out_dict['total_energy_Ry'] = result[-1]
+    out_dict['total_energy_Ry_unit'] = 'Rydberg'
+    out_dict['convergence_group']['total_energy_Ry_all_iterations'] = result
+
+
+def _parse_single_particle_energies(out_dict, files):
+    try:
+        result = get_single_particle_energies(files['outfile_000'])
+    except Exception:
+        # not an error for a DOS calculation
+        if _is_doscalc(out_dict):
+            return
+        raise
+    out_dict['single_particle_energies'] = result * get_Ry2eV()
+    out_dict['single_particle_energies_unit'] = 'eV'
+
+
+def _parse_charges(out_dict, files):
+    try:
+        result_WS, result_tot, result_C = get_charges_per_atom(files['outfile_000'])
+        niter = len(out_dict['convergence_group']['rms_all_iterations'])
+        natyp = int(len(result_tot) // niter)
+    except Exception:
+        # not an error for a DOS calculation
+        if _is_doscalc(out_dict):
+            return
+        raise
+    out_dict['total_charge_per_atom'] = result_tot[-natyp:]
+    out_dict['charge_core_states_per_atom'] = result_C[-natyp:]
+    # this check deals with the DOS case where output is slightly different
+    if len(result_WS) == len(result_C):
+        out_dict['charge_valence_states_per_atom'] = result_WS[-natyp:] - result_C[-natyp:]
+    out_dict['total_charge_per_atom_unit'] = 'electron charge'
+    out_dict['charge_core_states_per_atom_unit'] = 'electron charge'
+    out_dict['charge_valence_states_per_atom_unit'] = 'electron charge'
+
+
+# sections of the KKR output: name -> (parser steps with the error messages of parse_kkr_outputfile,
+#                                      top-level keys of the output dict)
+_PARSER_SECTIONS = OrderedDict([
+    ('code_info', ([(_parse_version_info, 'Version Info')], ['code_info_group'])),
+    ('system', ([(_parse_nspin_natom, 'nspin/natom')], ['nspin', 'number_of_atoms_in_unit_cell', 'use_newsosol'])),
+    ('warnings', ([(_parse_warnings, 'search for warnings')], ['warnings_group'])),
+    ('timings', ([(_parse_timings, 'timings')], ['timings_group', 'timings_unit'])),
+    ('energy_contour', ([(_parse_energy_contour, 'energy contour')], ['energy_contour_group'])),
+    ('lattice', ([(_parse_alat, 'alat, 2*pi/alat'), (_parse_lattice_vectors, 'lattice vectors (direct/reciprocal)')],
+                 ['alat_internal', 'two_pi_over_alat_internal', 'alat_internal_unit', 'two_pi_over_alat_internal_unit',
+                  'direct_bravais_matrix', 'reciprocal_bravais_matrix', 'direct_bravais_matrix_unit',
+                  'reciprocal_bravais_matrix_unit'])),
+    ('kmesh', ([(_parse_kmesh, 'kmesh')], ['kmesh_group'])),
+    ('symmetries', ([(_parse_symmetries, 'symmetries')], ['symmetries_group'])),
+    ('ewald', ([(_parse_ewald, 'ewald summation for madelung poterntial')], ['ewald_sum_group'])),
+    ('core_states', ([(_parse_core_states, 'core_states')], ['core_states_group'])),
+    ('convergence', ([(_parse_rms, 'rms-error'), (_parse_neutrality, 'charge neutrality'), (_parse_scfinfo, 'scfinfo')],
+                     ['convergence_group'])),
+    ('magnetism', ([(_parse_magtot, 'total magnetic moment'), (_parse_spinmom_per_atom, 'spin moment per atom'),
+                    (_parse_orbmom, 'orbital moment'), (_parse_noco_rms, 'noco angles rms value')],
+                   ['magnetism_group'])),
+    ('energies', ([(_parse_EF, 'EF'), (_parse_DOS_EF, 'DOS@EF'), (_parse_Etot, 'total energy')],
+                  ['fermi_energy', 'fermi_energy_units', 'dos_at_fermi_energy', 'energy', 'energy_unit',
+                   'total_energy_Ry', 'total_energy_Ry_unit'])),
+    ('single_particle_energies', ([(_parse_single_particle_energies, 'single particle energies')],
+                                  ['single_particle_energies', 'single_particle_energies_unit'])),
+    ('charges', ([(_parse_charges, 'charges')],
+                 ['total_charge_per_atom', 'charge_core_states_per_atom', 'charge_valence_states_per_atom',
+                  'total_charge_per_atom_unit', 'charge_core_states_per_atom_unit',
+                  'charge_valence_states_per_atom_unit'])),
+    ])
+
+# sections that are only written in a scf run (skipped with skip_readin, e.g. in a qdos run)
+_READIN_SECTIONS = ['core_states', 'convergence', 'magnetism', 'energies', 'single_particle_energies', 'charges']
+
+# sections that use results of other sections inside parse_kkr_outputfile
+# (DOS calculation from the energy contour, nspin and natom, number of iterations from the rms)
+_SECTION_DEPENDENCIES = {'ewald': ['energy_contour'],
+                         'magnetism': ['system'],
+                         'single_particle_energies': ['energy_contour'],
+                         'charges': ['energy_contour', 'convergence']}
+
+# sections that are parsed eagerly in the different profiles
+_PARSER_PROFILES = {'minimal': ['code_info', 'system', 'convergence', 'energies'],
+                    'scf': ['code_info', 'system', 'warnings', 'energy_contour', 'core_states', 'convergence',
+                            'magnetism', 'energies', 'single_particle_energies', 'charges'],
+                    'full': list(_PARSER_SECTIONS.keys())}
+
+
+def get_parser_sections(profile):
+    """
+    Get the sections of the KKR output that are parsed in a parser profile
+
+    :param profile: name of the parser profile (`minimal`, `scf` or `full`)
+    :returns: list of section names
+    :raises ValueError: if the profile is unknown
+    """
+    if profile not in _PARSER_PROFILES:
+        raise ValueError('Unknown parser profile {}, valid profiles are {}'.format(profile, sorted(_PARSER_PROFILES.keys())))
+    return list(_PARSER_PROFILES[profile])
+
+
+def parse_kkr_output_sections(out_dict, files, sections, skip_readin=False):
+    """
+    Parse some sections of the KKR output (see `_PARSER_SECTIONS`). Every parser step is done separately
+    (as in `parse_kkr_outputfile`, errors of a step are collected in the message list), with all sections the
+    result is the same as the one of `parse_kkr_outputfile`.
+    Entries that are already in `out_dict` are kept (sections can be added to the output of an earlier call).
+
+    :param out_dict: dictionary that is filled with the parsed output
+    :param files: dictionary of the output files (keys: 'outfile', 'outfile_0init', 'outfile_000', 'timing_file',
+                  'potfile_out', 'nonco_out_file' and 'outfile_2'), missing files are None
+    :param sections: list of section names that are parsed
+    :param skip_readin: skip the sections that are not written in a qdos run (as in `parse_kkr_outputfile`)
+    :returns: success (bool), msg_list (list of error messages), out_dict (filled dict of parsed output)
+    """
+    sections = set(sections)
+    for name in list(sections):
+        sections.update(_SECTION_DEPENDENCIES.get(name, []))
+    if skip_readin:
+        sections.difference_update(_READIN_SECTIONS)
+    files = dict((key, files.get(key)) for key in _FILE_KEYS)
+
+    parsed, msg_list = {}, []
+    if len(sections.intersection(_READIN_SECTIONS))>0:
+        # collects the histories of all iterations
+        parsed['convergence_group'] = {}
+    for name, (steps, keys) in _PARSER_SECTIONS.items():
+        if name not in sections:
+            continue
+        for step, msg in steps:
+            try:
+                step(parsed, files)
+            except Exception:
+                msg_list.append(_MSG_PREFIX+msg)
+    parsed = convert_to_pystd(parsed)
+
+    # merge with the existing output, the convergence group is filled by several sections
+    for key, val in parsed.items():
+        if key == 'convergence_group' and key in out_dict:
+            for key2, val2 in val.items():
+                out_dict[key].setdefault(key2, val2)
+        else:
+            out_dict.setdefault(key, val)
+
+    return len(msg_list)==0, msg_list, out_dict
+
+
+class LazyKkrOutput(object):
+    """
+    Output of a KKR calculation where the sections that were skipped by the parser profile are parsed on first access
+    from the retrieved files of the calculation.
+
+    :param calc: finished KkrCalculation
+    :usage:
+        output = LazyKkrOutput(kkr_calc)
+        print(output['symmetries_group']) # parsed from the retrieved files if the calculation used the `scf` profile
+    """
+
+    def __init__(self, calc):
+        self.calc = calc
+        self._out_dict = calc.outputs.output_parameters.get_dict()
+        self._parsed = set(get_parser_sections(self._out_dict.get('parser_profile', 'full')))
+        self._histories_loaded = False
+
+
+    def __getitem__(self, key):
+        if key not in self._out_dict:
+            self.parse_sections(self._find_sections(key))
+        return self._out_dict[key]
+
+
+    def get(self, key, default=None):
+        """Get a value of the output, missing sections are parsed first"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def get_dict(self):
+        """Parse all remaining sections and return the complete output dictionary"""
+        self.parse_sections()
+        return self._out_dict
+
+
+    def _find_sections(self, key):
+        """find the sections that are not parsed yet and contain key (all sections if key is unknown)"""
+        sections = [name for name, (steps, keys) in _PARSER_SECTIONS.items() if key in keys]
+        if len(sections)==0:
+            sections = list(_PARSER_SECTIONS.keys())
+        return [name for name in sections if name not in self._parsed]
+
+
+    def parse_sections(self, sections=None):
+        """
+        Parse sections of the output from the retrieved files of the calculation
+
+        :param sections: list of section names, all remaining sections are parsed if not given
+        :returns: msg_list (list of error messages of the parser)
+        """
+        from aiida_kkr.tools.retrieved_folder import RetrievedFolderView
+        from aiida_kkr.tools.convergence_arrays import get_convergence_arrays
+        from aiida_kkr.calculations.kkr import KkrCalculation
+
+        if sections is None:
+            sections = list(_PARSER_SECTIONS.keys())
+        sections = [name for name in sections if name not in self._parsed]
+        if len(sections)==0:
+            return []
+
+        # the histories of the convergence group are needed in some sections (e.g. number of iterations for the charges)
+        if not self._histories_loaded and 'convergence_group' in self._out_dict:
+            for key, array in get_convergence_arrays(self.calc).items():
+                self._out_dict['convergence_group'].setdefault(key, array.tolist())
+            self._histories_loaded = True
+
+        filenames = {'outfile': KkrCalculation._DEFAULT_OUTPUT_FILE,
+                     'outfile_0init': KkrCalculation._OUTPUT_0_INIT,
+                     'outfile_000': KkrCalculation._OUTPUT_000,
+                     'timing_file': KkrCalculation._OUT_TIMING_000,
+                     'potfile_out': KkrCalculation._OUT_POTENTIAL,
+                     'nonco_out_file': KkrCalculation._NONCO_ANGLES_OUT,
+                     'outfile_2': KkrCalculation._OUTPUT_2}
+        with RetrievedFolderView(self.calc.outputs.retrieved) as folder:
+            files = {}
+            for key, fname in filenames.items():
+                files[key] = folder.open(fname) if fname in folder else None
+            # the KKRFLEX run writes only output.000.txt
+            if files['outfile_2'] is None:
+                files['outfile_2'] = files['outfile_000']
+            success, msg_list, self._out_dict = parse_kkr_output_sections(self._out_dict, files, sections,
+                                                                          skip_readin=('convergence_group' not in self._out_dict))
+        self._parsed.update(sections)
+
+        return msg_list
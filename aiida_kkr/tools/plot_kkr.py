@@ -297,8 +297,9 @@ class plot_kkr(object):
         view(ase_atoms, **kwargs)
 
     def dosplot(self, d, natoms, nofig, all_atoms, l_channels, sum_spins, switch_xy, switch_sign_spin2, **kwargs):
-        """plot dos from xydata node"""
+        """plot dos from xydata or KkrDosData node"""
         from numpy import array, sum, arange
+        from aiida_kkr.data.kkrdos import KkrDosData
         from matplotlib.pyplot import plot, xlabel, ylabel, gca, figure, legend, fill_between
         import matplotlib as mpl
         from cycler import cycler
@@ -320,7 +321,11 @@ class plot_kkr(object):
         if not nofig: figure()
 
         x_all = d.get_x()
-        y_all = d.get_y()
+        if isinstance(d, KkrDosData) and not l_channels:
+            # only the total DOS is plotted, no need to extract the other channels
+            y_all = d.get_y(channels=['tot'])
+        else:
+            y_all = d.get_y()
 
         # scale factor for x and/or y
         if 'xscale' in kwargs:
@@ -483,6 +488,8 @@ class plot_kkr(object):
         from aiida.engine import ProcessState
         from aiida.common.folders import SandboxFolder
         from masci_tools.io.common_functions import search_string
+        from aiida_kkr.tools.convergence_arrays import get_convergence_arrays
+        from aiida_kkr.tools.kkr_parser_profiles import LazyKkrOutput
 
         rms, neutr, etot, efermi = [], [], [], []
         ptitle = ''
@@ -490,11 +497,18 @@ class plot_kkr(object):
         if node.process_state == ProcessState.FINISHED:
             if node.is_finished_ok:
                 o = node.outputs.output_parameters.get_dict()
-                neutr = o['convergence_group'][u'charge_neutrality_all_iterations']
-                efermi = o['convergence_group'][u'fermi_energy_all_iterations']
-                etot = o['convergence_group'][u'total_energy_Ry_all_iterations']
-                rms = o['convergence_group'][u'rms_all_iterations']
-                ptitle = 'Time per iteration: ' + str(o['timings_group'].get('Time in Iteration')) + ' s'
+                histories = get_convergence_arrays(node, [u'charge_neutrality_all_iterations', u'fermi_energy_all_iterations',
+                                                          u'total_energy_Ry_all_iterations', u'rms_all_iterations'])
+                neutr = histories[u'charge_neutrality_all_iterations'].tolist()
+                efermi = histories[u'fermi_energy_all_iterations'].tolist()
+                etot = histories[u'total_energy_Ry_all_iterations'].tolist()
+                rms = histories[u'rms_all_iterations'].tolist()
+                # timings are parsed from the retrieved files if they were skipped by the parser profile
+                if 'timings_group' in o:
+                    timings = o['timings_group']
+                else:
+                    timings = LazyKkrOutput(node).get('timings_group', {})
+                ptitle = 'Time per iteration: ' + str(timings.get('Time in Iteration')) + ' s'
         elif node.process_state in [ProcessState.WAITING, ProcessState.FINISHED, ProcessState.RUNNING]:
             # extract info needed to open transport
             c = node.inputs.code
@@ -579,14 +593,13 @@ class plot_kkr(object):
                 # remove symmetry descriptions from resuts dict before writting output
                 if 'symmetries_group' in list(results_dict.keys()): results_dict['symmetries_group']['symmetry_description'] = '...'
                 if 'convergence_group' in list(results_dict.keys()):
-                    results_dict['convergence_group']['charge_neutrality_all_iterations'] = '...'
-                    results_dict['convergence_group']['dos_at_fermi_energy_all_iterations'] = '...'
-                    results_dict['convergence_group']['fermi_energy_all_iterations'] = '...'
-                    results_dict['convergence_group']['rms_all_iterations'] = '...'
-                    results_dict['convergence_group']['total_energy_Ry_all_iterations'] = '...'
-                    results_dict['convergence_group']['spin_moment_per_atom_all_iterations'] = '...'
-                    results_dict['convergence_group']['orbital_moment_per_atom_all_iterations'] = '...'
-                    results_dict['convergence_group']['total_spin_moment_all_iterations'] = '...'
+                    # histories are only in the Dict for older calculations (newer ones have the convergence_arrays output)
+                    for key in ['charge_neutrality_all_iterations', 'dos_at_fermi_energy_all_iterations',
+                                'fermi_energy_all_iterations', 'rms_all_iterations', 'total_energy_Ry_all_iterations',
+                                'spin_moment_per_atom_all_iterations', 'orbital_moment_per_atom_all_iterations',
+                                'total_spin_moment_all_iterations']:
+                        if key in results_dict['convergence_group']:
+                            results_dict['convergence_group'][key] = '...'
                 pprint(results_dict)
 
         # plot structure
@@ -684,19 +697,20 @@ class plot_kkr(object):
         """plot things from a kkrimp Calculation node"""
         from numpy import array, ndarray
         from numpy import sqrt, sum
+        from aiida_kkr.tools.convergence_arrays import get_convergence_arrays
 
         # read data from output node
         rms_goal, rms = None, []
         if node.is_finished_ok:
             out_para = node.outputs.output_parameters
             out_para_dict = out_para.get_dict()
-            out_para_dict['convergence_group']['rms_all_iterations']
-            rms = out_para_dict['convergence_group']['rms_all_iterations']
+            histories = get_convergence_arrays(node, ['rms_all_iterations', 'spin_moment_per_atom_all_iterations'])
+            rms = histories['rms_all_iterations'].tolist()
             rms_goal = out_para_dict['convergence_group']['qbound']
             # extract total magnetic moment
             nat = out_para_dict['number_of_atoms_in_unit_cell']
-            s = array(out_para_dict['convergence_group']['spin_moment_per_atom_all_iterations'], dtype=float)
-            ss = sqrt(sum(s**2, axis=1)).reshape(-1,nat)
+            s = histories['spin_moment_per_atom_all_iterations']
+            ss = sqrt(sum(s**2, axis=-1)).reshape(-1,nat)
             stot = sum(ss, axis=1)
 
         # now return values
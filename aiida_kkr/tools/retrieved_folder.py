@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Helper to access the retrieved folder of a calculation inside the parsers.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+from builtins import object
+import io
+
+__copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
+                 "IAS-1/PGI-1, Germany. All rights reserved.")
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.1"
+__contributors__ = u"Philipp Rüßmann"
+
+
+class _persistent_buffer(io.BytesIO):
+    """
+    In-memory buffer that is not closed by the `with f:` blocks of the masci-tools parser functions.
+    Closing only rewinds the buffer, such that the same in-memory copy of a file can be parsed many times.
+    """
+
+    def close(self):
+        self.seek(0)
+
+    def release(self):
+        """Free the memory of the buffer"""
+        io.BytesIO.close(self)
+
+
+def read_to_memory(filehandle):
+    """
+    Read a file once and return an in-memory copy of it.
+    The copy is a `io.TextIOWrapper` (which is understood by `masci_tools.io.common_functions.open_general`)
+    and can be read over and over again without accessing the repository.
+
+    :param filehandle: open file handle (text mode), e.g. from `retrieved.open(filename)`
+    :returns: in-memory copy of the file
+    """
+    with filehandle:
+        txt = filehandle.read()
+    return io.TextIOWrapper(_persistent_buffer(txt.encode('utf-8')), encoding='utf-8')
+
+
+class RetrievedFolderView(object):
+    """
+    View on the retrieved folder that is used during parsing. The content of the folder is listed only once and
+    the file handles are cached. All handles are closed when the view is closed (i.e. at the end of parsing).
+
+    :param folder: retrieved folder (FolderData) of the calculation
+    :param in_memory: if True the files are read once into in-memory copies (see `read_to_memory`)
+
+    :usage:
+        with RetrievedFolderView(self.retrieved) as folder:
+            if 'out_kkr' in folder:
+                outfile = folder.open('out_kkr')
+    """
+
+    def __init__(self, folder, in_memory=False):
+        self.folder = folder
+        self.in_memory = in_memory
+        self._object_names = None
+        self._handles = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __contains__(self, name):
+        return name in self.list_object_names()
+
+
+    def list_object_names(self):
+        """List the content of the folder (the repository is accessed only on the first call)"""
+        if self._object_names is None:
+            self._object_names = list(self.folder.list_object_names())
+        return self._object_names
+
+
+    def open(self, name):
+        """
+        Open a file of the folder for reading, the handle is cached and the same handle is returned on the next call.
+
+        :param name: name of the file
+        :returns: file handle (or in-memory copy of the file if `in_memory` is True)
+        """
+        if name not in self._handles:
+            handle = self.folder.open(name)
+            if self.in_memory:
+                handle = read_to_memory(handle)
+            self._handles[name] = handle
+        return self._handles[name]
+
+
+    def delete_object(self, name, force=False):
+        """
+        Close the cached handle of a file and delete it from the folder
+
+        :param name: name of the file
+        :param force: passed on to the `delete_object` method of the folder
+        """
+        self._close_handle(name)
+        self.folder.delete_object(name, force=force)
+        if self._object_names is not None and name in self._object_names:
+            self._object_names.remove(name)
+
+
+    def reset_listing(self):
+        """Forget the cached content of the folder (needed if files are added to the folder directly)"""
+        self._object_names = None
+
+
+    def _close_handle(self, name):
+        """Close the cached handle of file `name` (if it exists)"""
+        handle = self._handles.pop(name, None)
+        if handle is not None:
+            if isinstance(getattr(handle, 'buffer', None), _persistent_buffer):
+                handle.buffer.release()
+            else:
+                handle.close()
+
+
+    def close(self):
+        """Close all cached file handles"""
+        for name in list(self._handles.keys()):
+            self._close_handle(name)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache for the impurity cluster files (scoef and shapefun) that are
+written in the `prepare_for_submission` step of the KKRimp calculation.
+
+The files only depend on the host structure, the cluster settings in `impurity_info`
+and (for the shapefun) on the host shapefun, which is why repeated submissions of the
+same impurity cluster (e.g. in the kkr_imp_sub workflow) can reuse them.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import object
+import os
+import hashlib
+import json
+
+__copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
+                 "IAS-1/PGI-1, Germany. All rights reserved.")
+__license__ = "MIT license, see LICENSE.txt file"
+__version__ = "0.2"
+__contributors__ = u"Philipp Rüßmann"
+
+
+# default location and size limit (in bytes) of the cache, can be overwritten with environment variables
+_CACHE_DIR_ENV = 'AIIDA_KKR_CACHE_DIR'
+_CACHE_MAXSIZE_ENV = 'AIIDA_KKR_CACHE_MAXSIZE'
+_CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser('~'), '.aiida_kkr', 'scoef_cache')
+_CACHE_MAXSIZE_DEFAULT = 200*1024**2
+
+# all files of the cache start with this prefix, other files in the cache directory are never touched
+_CACHE_PREFIX = 'aiida_kkr_cache_'
+
+# version of the cache entries, increase this if the format of the cached files changes
+# (the version of the scoef and shapefun writers in tools_kkrimp is part of the cache key as well)
+_CACHE_FORMAT_VERSION = 1
+
+
+def _get_writer_version():
+    """version of the module that writes the scoef and shapefun files"""
+    from aiida_kkr.tools.tools_kkrimp import __version__ as writer_version
+    return writer_version
+
+
+def get_scoef_cache_key(structure, Rcut, hcut=-1., cylinder_orient=[0., 0., 1.], ilayer_center=0):
+    """
+    Create the cache key of a scoef file from the hash of the host structure and the cluster settings
+    (impurity_info keys Rcut, hcut, cylinder_orient and ilayer_center). The format version of the cache and the
+    version of the scoef writer are part of the key, i.e. entries of older versions are not reused.
+
+    :param structure: host structure (StructureData)
+    :param Rcut: cluster radius
+    :param hcut: height of the cylinder (-1 for spherical clusters)
+    :param cylinder_orient: orientation of the cylinder axis
+    :param ilayer_center: index of the layer in which the impurity sits (center of the cluster)
+
+    :return: hex string that is used as file name in the cache
+    """
+    settings = json.dumps([_CACHE_FORMAT_VERSION, _get_writer_version(), structure.get_hash(), Rcut, hcut,
+                           [float(i) for i in cylinder_orient], ilayer_center])
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+
+def get_shapefun_cache_key(scoef_key, shapefun_host, shapes):
+    """
+    Create the cache key of the impurity shapefun, which is constructed from the scoef file, the
+    host shapefun and the list of shapes.
+
+    :param scoef_key: cache key of the scoef file (see `get_scoef_cache_key`)
+    :param shapefun_host: content of the host shapefun file (string)
+    :param shapes: list of shape indices of the host atoms
+
+    :return: hex string that is used as file name in the cache
+    """
+    keyhash = hashlib.sha256(scoef_key.encode('utf-8'))
+    keyhash.update(shapefun_host.encode('utf-8'))
+    keyhash.update(json.dumps([int(i) for i in shapes]).encode('utf-8'))
+    return keyhash.hexdigest()
+
+
+class ScoefCache(object):
+    """
+    Least-recently-used file cache with a size limit. Every entry is stored as a single text file in `cache_dir`
+    (with the file name prefix `aiida_kkr_cache_`, other files in `cache_dir` are ignored), the modification time
+    of the file is used to track the last access. Whenever a new entry is added the oldest entries are removed
+    until the total size of the cache is below `max_size`.
+
+    :param cache_dir: directory of the cache, defaults to the environment variable AIIDA_KKR_CACHE_DIR
+                      or `~/.aiida_kkr/scoef_cache`
+    :param max_size: maximal size of the cache in bytes, defaults to the environment variable AIIDA_KKR_CACHE_MAXSIZE
+                     or 200 MB (a value of 0 disables the cache)
+    """
+
+    def __init__(self, cache_dir=None, max_size=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get(_CACHE_DIR_ENV, _CACHE_DIR_DEFAULT)
+        if max_size is None:
+            max_size = int(os.environ.get(_CACHE_MAXSIZE_ENV, _CACHE_MAXSIZE_DEFAULT))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+
+    @property
+    def enabled(self):
+        """True if the cache is used, i.e. if `max_size` is positive"""
+        return self.max_size>0
+
+
+    def _get_path(self, key, suffix):
+        """Return path of the cache entry"""
+        return os.path.join(self.cache_dir, '{}{}.{}'.format(_CACHE_PREFIX, key, suffix))
+
+
+    def _list_entries(self, include_tmp=False):
+        """Return paths of all files that belong to the cache"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [os.path.join(self.cache_dir, filename) for filename in os.listdir(self.cache_dir)
+                if filename.startswith(_CACHE_PREFIX) and (include_tmp or not filename.endswith('.tmp'))]
+
+
+    def get(self, key, suffix):
+        """
+        Read an entry from the cache.
+
+        :param key: cache key (see `get_scoef_cache_key` and `get_shapefun_cache_key`)
+        :param suffix: type of the entry (e.g. 'scoef' or 'shapefun')
+
+        :return: content of the cached file or None if the entry is not in the cache
+        """
+        if not self.enabled:
+            return None
+        path = self._get_path(key, suffix)
+        try:
+            with open(path, 'r') as cachefile:
+                content = cachefile.read()
+            # mark entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return content
+
+
+    def put(self, key, suffix, content):
+        """
+        Add an entry to the cache and remove the least recently used entries if the size limit is exceeded.
+        Errors during writing (e.g. missing permissions) are ignored since the cache is optional.
+
+        :param key: cache key (see `get_scoef_cache_key` and `get_shapefun_cache_key`)
+        :param suffix: type of the entry (e.g. 'scoef' or 'shapefun')
+        :param content: content of the file (string)
+        """
+        if not self.enabled or len(content)>self.max_size:
+            return
+        path = self._get_path(key, suffix)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # write to temporary file first and rename afterwards to make the entry appear atomically
+            tmppath = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmppath, 'w') as cachefile:
+                cachefile.write(content)
+            os.rename(tmppath, path)
+            self._evict()
+        except (IOError, OSError):
+            pass
+
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is smaller than `max_size`"""
+        entries = []
+        for path in self._list_entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum([entry[1] for entry in entries])
+        for mtime, size, path in sorted(entries):
+            if total_size<=self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+
+    def clear(self):
+        """Remove all entries from the cache (including leftover temporary files)"""
+        for path in self._list_entries(include_tmp=True):
+            os.remove(path)
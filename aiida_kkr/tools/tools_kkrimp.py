@@ -9,6 +9,8 @@ from __future__ import division
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from builtins import object, str
+from contextlib import contextmanager
+import six
 from six.moves import range
 from six.moves import input
 from masci_tools.io.common_functions import open_general
@@ -21,58 +23,110 @@ __version__ = "0.6.0"
 __contributors__ = u"Philipp Rüßmann"
 
 
-class modify_potential(object):
+@contextmanager
+def _open_binary(filename_or_handle, iomode='rb'):
     """
-    Class for old modify potential script, ported from modify_potential script, initially by D. Bauer
+    Open a file in binary mode for offset based reading (context manager). The file can be given as path or as file
+    handle. For reading, binary handles (e.g. `io.BytesIO` or files of python 2) and the binary buffer of text handles
+    are used directly: they are rewound, not closed, and their position is restored afterwards. Only text handles
+    without a buffer are reopened from their name (if it is a path on disk) or read into memory (e.g. `io.StringIO`).
+    For modifying the file in place (`iomode='r+b'`) handles are reopened from their name if it is a path on disk
+    (e.g. the read-only handles of the retrieved folder), otherwise the (binary) handle is used directly.
     """
+    import io
+    import os
+
+    if not hasattr(filename_or_handle, 'read'):
+        with open(filename_or_handle, iomode) as f:
+            yield f
+        return
+
+    handle = filename_or_handle
+    name = getattr(handle, 'name', None)
+    on_disk = isinstance(name, six.string_types) and os.path.isfile(name)
+    if isinstance(handle.read(0), bytes):
+        fbin = handle
+    else:
+        fbin = getattr(handle, 'buffer', None)
+
+    if on_disk and (fbin is None or iomode!='rb'):
+        with open(name, iomode) as f:
+            yield f
+    elif fbin is None:
+        if iomode!='rb':
+            raise ValueError('file handle {} cannot be modified in binary mode'.format(handle))
+        handle.seek(0)
+        yield io.BytesIO(handle.read().encode('utf-8'))
+    else:
+        position = fbin.tell()
+        fbin.seek(0)
+        try:
+            yield fbin
+        finally:
+            fbin.seek(position)
 
-    def _check_potstart(self, str1, mode='pot', shape_ver='new'):
-        if mode=='shape':
-            if shape_ver=='new':
-                check1='Shape number' in str1
-            else:
-                check1= (len(str1)==11)
+
+def get_potential_index(filename_or_handle, mode=None):
+    """
+    Find the atom blocks of a potential or shapefun file in a single streaming pass over the file. Each block starts
+    with the header line of the atom (containing 'exc:' for potentials and 'Shape number' for shapefuns, in old-style
+    shapefuns the header lines have exactly 10 characters) and ends before the header of the next atom. Lines in
+    front of the first block (e.g. the header of a shapefun file) do not belong to any block.
+
+    :param filename_or_handle: path or file handle of the potential or shapefun file
+    :param mode: 'pot' or 'shape', determined from the file name if not given ('shape' if 'shapefun' is in the name)
+
+    :return: list of (start, end) tuples with the byte offsets of the blocks in the file
+    """
+    if mode is None:
+        if hasattr(filename_or_handle, 'read'):
+            filepathname = str(getattr(filename_or_handle, 'name', ''))
         else:
-            check1='exc:' in str1
-        return check1
-
-    def _read_input(self, filepath):
-        with open_general(filepath) as f:
-            data = f.readlines()
-            filepathname = f.name
-        
+            filepathname = filename_or_handle
         if 'shapefun' in filepathname:
             mode = 'shape'
         else:
             mode = 'pot'
 
-        # read file
-        index1=[];index2=[]
-        for i in range(len(data)):
-          if self._check_potstart(data[i], mode=mode):
-            index1.append(i)
-            if len(index1)>1: index2.append(i-1)
-        index2.append(i)
-
-        # read shapefun if old style is used
-        if mode=='shape' and len(index1)<1:
-            index1=[];index2=[]
-            for i in range(len(data)):
-                if self._check_potstart(data[i], mode=mode, shape_ver='old'):
-                    index1.append(i)
-                if len(index1)>1: index2.append(i-1)
-                index2.append(i)
+    starts, starts_old = [], []
+    offset = 0
+    with _open_binary(filename_or_handle) as f:
+        for line in f:
+            if mode=='shape':
+                if b'Shape number' in line:
+                    starts.append(offset)
+                if len(line)==11:
+                    starts_old.append(offset)
+            elif b'exc:' in line:
+                starts.append(offset)
+            offset += len(line)
 
-        """
-        print(index1)
-        print(index2)
+    # fallback for old-style shapefun
+    if mode=='shape' and len(starts)<1:
+        starts = starts_old
+
+    return list(zip(starts, starts[1:]+[offset]))
 
-        print('Potential file read')
-        print('found %i potentials in file'%len(index1))
-        print('')
-        """
 
-        return index1, index2, data
+def read_potential_blocks(filename_or_handle, blocks):
+    """
+    Generator that reads blocks of a potential or shapefun file using their byte offsets.
+
+    :param filename_or_handle: path or file handle of the potential or shapefun file
+    :param blocks: list of (start, end) tuples of byte offsets (see `get_potential_index`)
+
+    :return: yields the text of the blocks in the order given in `blocks`
+    """
+    with _open_binary(filename_or_handle) as f:
+        for start, end in blocks:
+            f.seek(start)
+            yield f.read(end-start).decode('utf-8')
+
+
+class modify_potential(object):
+    """
+    Class for old modify potential script, ported from modify_potential script, initially by D. Bauer
+    """
 
     def shapefun_from_scoef(self, scoefpath, shapefun_path, atom2shapes, shapefun_new):
         """
@@ -83,9 +137,7 @@ class modify_potential(object):
         :param shapes: shapes array for mapping between atom index and shapefunction index
         :param shapefun_new: absolute path to output shapefun file to which the new shapefunction will be written
         """
-        index1, index2, data = self._read_input(shapefun_path)
-
-        order=list(range(len(index1)))
+        blocks = get_potential_index(shapefun_path, mode='shape')
 
         natomtemp = int(open_general(scoefpath).readlines()[0])
         filedata=open_general(scoefpath).readlines()[1:natomtemp+1]
@@ -95,10 +147,7 @@ class modify_potential(object):
                 listnew.append(atom2shapes[int(line.split()[3])-1]-1)
         order = listnew
 
-        datanew=[]
-        for i in range(len(order)):
-          for ii in range(index1[order[i]], index2[order[i]]+1  ):
-            datanew.append(data[ii])
+        datanew = list(read_potential_blocks(shapefun_path, [blocks[i] for i in order]))
 
         # add header to shapefun_new
         tmp = datanew
@@ -135,10 +184,10 @@ class modify_potential(object):
         """
         from numpy import array, shape
 
-        index1, index2, data = self._read_input(potfile_in)
+        blocks = get_potential_index(potfile_in)
 
         if potfile_2 is not None:
-            index12, index22, data2 = self._read_input(potfile_2)
+            blocks2 = get_potential_index(potfile_2)
             # check if also replace_from_pot2 is given correctly
             if replace_from_pot2 is None:
                 raise ValueError('replace_from_pot2 not given')
@@ -154,20 +203,486 @@ class modify_potential(object):
         # ensure that numbers are integers:
         order = [int(i) for i in neworder]
 
-        datanew=[]
-        for i in range(len(order)):
-            # check if new position is replaced with position from old pot
-            if replace_from_pot2 is not None and i in replace_from_pot2[:,0]:
-                    replace_index = replace_from_pot2[replace_from_pot2[:,0]==i][0][1]
-                    for ii in range(index12[replace_index], index22[replace_index]+1 ):
-                        datanew.append(data2[ii])
-            else: # otherwise take new potntial according to input list
-                    for ii in range(index1[order[i]], index2[order[i]]+1 ):
-                        datanew.append(data[ii])
-
-        # write out new potential
-        with open_general(potfile_out,'w') as f:
-            f.writelines(datanew)
+        # lookup table for positions that are replaced with potentials from pot2 (first entry wins)
+        replace_lookup = {}
+        if replace_from_pot2 is not None:
+            for inew, ipot2 in replace_from_pot2.tolist():
+                replace_lookup.setdefault(int(inew), int(ipot2))
+
+        # copy atom blocks directly from the input potential(s) to the output (only one block is kept in memory)
+        # fin2 is only read if potfile_2 is given
+        with _open_binary(potfile_in) as fin, _open_binary(potfile_2 if potfile_2 is not None else potfile_in) as fin2:
+            with open_general(potfile_out,'w') as f:
+                for i in range(len(order)):
+                    # check if new position is replaced with position from old pot
+                    if i in replace_lookup:
+                        src, (start, end) = fin2, blocks2[replace_lookup[i]]
+                    else: # otherwise take new potntial according to input list
+                        src, (start, end) = fin, blocks[order[i]]
+                    src.seek(start)
+                    f.write(src.read(end-start).decode('utf-8'))
+
+
+
+
+def _move_file_block(f, src, dst, length, bufsize):
+    """
+    Move `length` bytes of the binary file `f` from offset `src` to offset `dst` (the regions may overlap).
+    The data is copied in chunks of `bufsize` bytes, starting from the end of the block if it is moved backwards.
+    """
+    if dst<src:
+        order = range(0, length, bufsize)
+    else:
+        order = reversed(range(0, length, bufsize))
+    for ichunk in order:
+        nread = min(bufsize, length-ichunk)
+        f.seek(src+ichunk)
+        chunk = f.read(nread)
+        f.seek(dst+ichunk)
+        f.write(chunk)
+
+
+def trim_output_file(filename_or_handle, keyslist, bufsize=1024**2):
+    """
+    Remove unneeded output from a file: everything between the first and the last line containing one of the keys
+    in `keyslist` is replaced by a single comment line (e.g. to keep only the last iteration of the out_log file).
+    The file is streamed twice, the first pass locates the first and the last marker line and the second pass moves
+    the tail of the file in chunks of `bufsize` bytes. Thus the memory usage is independent of the file size.
+
+    :param filename_or_handle: path or file handle of the file that is trimmed (in place)
+    :param keyslist: list of strings that mark the lines (e.g. the start of an iteration)
+    :param bufsize: size of the buffer in bytes that is used to move the tail of the file
+
+    :returns: number of bytes that were removed
+    """
+    import re
+
+    keys = [key.encode('utf-8') for key in keyslist]
+    pattern = re.compile(b'|'.join([re.escape(key) for key in keys]))
+
+    # first pass: find offsets of first and last marker line
+    nfound, first, last, offset = 0, None, None, 0
+    with _open_binary(filename_or_handle) as f:
+        for line in f:
+            if pattern.search(line) is not None:
+                # count each key separately (as if all keys were searched one after the other)
+                nfound += len([key for key in keys if key in line])
+                if first is None:
+                    first = offset
+                last = offset
+            offset += len(line)
+    filesize = offset
+
+    # cut only if more than one iteration was found
+    if nfound<=1:
+        return 0
+
+    # second pass: write comment line after the head of the file and move the tail behind it
+    comment = b'# ... [removed output except for last iteration] ...\n'
+    newsize = first + len(comment) + filesize - last
+    with _open_binary(filename_or_handle, 'r+b') as f:
+        _move_file_block(f, last, first+len(comment), filesize-last, bufsize)
+        f.seek(first)
+        f.write(comment)
+        f.truncate(newsize)
+
+    return filesize-newsize
+
+
+# compression codecs that can be used for the output archive of a KKRimp calculation
+# (all of them can be read with `tarfile.open(path)` which detects the compression automatically)
+_archive_codecs = ['gz', 'gz_parallel', 'bz2', 'xz', 'zstd', 'none']
+
+
+def _get_archive_codec(compression):
+    """
+    Check if the compression codec is available, 'gz_parallel' needs the `pigz` executable and 'zstd' needs a
+    tarfile module that supports zstandard compression. Unavailable codecs fall back to 'gz'.
+
+    :param compression: name of the codec (see `_archive_codecs`)
+    :returns: name of the codec that is used
+    """
+    import tarfile
+    try:
+        from shutil import which
+    except ImportError: # python 2
+        from distutils.spawn import find_executable as which
+    if compression not in _archive_codecs:
+        raise ValueError('Unknown compression codec {}, use one of {}'.format(compression, _archive_codecs))
+    if compression=='gz_parallel' and which('pigz') is None:
+        compression = 'gz'
+    if compression=='zstd' and 'zst' not in getattr(tarfile.TarFile, 'OPEN_METH', {}):
+        compression = 'gz'
+    return compression
+
+
+def _get_tar_write_mode(compression, compresslevel):
+    """Get mode and keyword arguments of `tarfile.open` for writing an archive with a given compression codec"""
+    kwargs = {}
+    if compression=='none':
+        mode = 'w'
+    else:
+        mode = 'w:{}'.format(compression.replace('zstd', 'zst'))
+        if compresslevel is not None:
+            # xz uses the 'preset' keyword instead of 'compresslevel'
+            kwargs['preset' if compression=='xz' else 'compresslevel'] = compresslevel
+    return mode, kwargs
+
+
+def write_output_archive(filepath_tar, filelist, compression='gz', compresslevel=None, nthreads=None):
+    """
+    Pack files into a (compressed) tar archive.
+
+    :param filepath_tar: path of the archive that is created
+    :param filelist: list of paths of the files that are added to the archive (with their base name)
+    :param compression: compression codec, one of
+        * 'gz' (default), gzip compression
+        * 'gz_parallel', multi-threaded gzip compression with `pigz` (falls back to 'gz' if pigz is not installed)
+        * 'bz2' and 'xz'
+        * 'zstd', zstandard compression (only if supported by the tarfile module, falls back to 'gz' otherwise)
+        * 'none', store files without compression
+    :param compresslevel: compression level (1-9), defaults to the default of the codec (9 for gzip)
+    :param nthreads: number of threads used by 'gz_parallel' (defaults to the number of cores)
+
+    :returns: dictionary with the used codec, the sizes of the packed files and the achieved compression ratio.
+              For uncompressed archives (compression='none') it also contains the `member_index` with the offsets
+              and sizes of all members, which allows to read single members directly (see `copy_archive_member`).
+              The compressed codecs do not support seeking (everything in front of a member would be decompressed
+              anyway), so there is no index for them.
+    """
+    import os
+    import tarfile
+    import subprocess
+
+    compression = _get_archive_codec(compression)
+
+    file_sizes, member_index = {}, {}
+    def add_files(tf):
+        for ffull in filelist:
+            fname = os.path.basename(ffull)
+            tf.add(ffull, arcname=fname)
+            size = tf.members[-1].size
+            file_sizes[fname] = size
+            if compression=='none':
+                # data of the member ends at the current offset of the tar stream (padded to full blocks)
+                member_index[fname] = [tf.offset-((size+tarfile.BLOCKSIZE-1)//tarfile.BLOCKSIZE)*tarfile.BLOCKSIZE, size]
+
+    if compression=='gz_parallel':
+        # tar stream is piped into pigz which writes the compressed archive
+        cmd = ['pigz', '-c']
+        if compresslevel is not None:
+            cmd.append('-{}'.format(compresslevel))
+        if nthreads is not None:
+            cmd += ['-p', '{}'.format(nthreads)]
+        with open(filepath_tar, 'wb') as fout:
+            pigz = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=fout)
+            with tarfile.open(fileobj=pigz.stdin, mode='w|') as tf:
+                add_files(tf)
+            pigz.stdin.close()
+            if pigz.wait()!=0:
+                raise IOError('pigz failed to compress {}'.format(filepath_tar))
+    else:
+        mode, kwargs = _get_tar_write_mode(compression, compresslevel)
+        with tarfile.open(filepath_tar, mode, **kwargs) as tf:
+            add_files(tf)
+
+    size_uncompressed = sum(file_sizes.values())
+    size_archive = os.stat(filepath_tar).st_size
+    archive_info = {'compression': compression,
+                    'compresslevel': compresslevel,
+                    'file_sizes': file_sizes,
+                    'size_uncompressed': size_uncompressed,
+                    'size_archive': size_archive,
+                    'compression_ratio': float(size_uncompressed)/max(size_archive, 1),
+                    'size_unit': 'bytes'}
+    if compression=='none':
+        archive_info['member_index'] = member_index
+    return archive_info
+
+
+def _copy_stream(fsrc, fdst, size, bufsize):
+    """copy `size` bytes from fsrc to fdst in chunks of `bufsize` bytes"""
+    while size>0:
+        chunk = fsrc.read(min(bufsize, size))
+        if not chunk:
+            raise IOError('unexpected end of archive')
+        fdst.write(chunk)
+        size -= len(chunk)
+
+
+def _iter_archive_members(filepath_tar):
+    """Stream through a tar archive once and yield (tarinfo, file object) of all regular files"""
+    import tarfile
+    with tarfile.open(filepath_tar, 'r|*') as tf:
+        for tinfo in tf:
+            if tinfo.isfile():
+                yield tinfo, tf.extractfile(tinfo)
+
+
+def list_archive_members(filepath_tar):
+    """
+    Get the names of all files in a tar archive (streams through the archive once without extracting anything)
+
+    :param filepath_tar: path of the tar archive
+    :returns: list of names of the members
+    """
+    return [tinfo.name for tinfo, fsrc in _iter_archive_members(filepath_tar)]
+
+
+def copy_archive_member(filepath_tar, member, fdst, archive_info=None, bufsize=1024**2):
+    """
+    Stream a single member of a tar archive into an open (binary) file handle without extracting the archive.
+
+    For uncompressed archives that were written by `write_output_archive` the `archive_info` (see
+    `get_output_archive`) contains the offsets of all members. Then the data of the member is read directly from its
+    offset (after checking that the tar header in front of it belongs to the member). Otherwise the archive is
+    streamed until the member is found.
+
+    :param filepath_tar: path of the tar archive
+    :param member: name of the member
+    :param fdst: file handle (binary mode) into which the member is written
+    :param archive_info: dictionary returned by `write_output_archive` (optional)
+    :param bufsize: size of the chunks that are copied
+
+    :returns: size of the member in bytes
+    :raises KeyError: if the member is not in the archive
+    """
+    import sys
+    import tarfile
+
+    if archive_info is None:
+        archive_info = {}
+    # the index is only used for uncompressed archives (seeking in a compressed stream decompresses everything in front)
+    index = archive_info.get('member_index', {}) if archive_info.get('compression')=='none' else {}
+    if member in index:
+        offset, size = index[member]
+        with open(filepath_tar, 'rb') as fsrc:
+            fsrc.seek(offset-tarfile.BLOCKSIZE)
+            buf = fsrc.read(tarfile.BLOCKSIZE)
+            try:
+                if sys.version_info[0] < 3:
+                    header = tarfile.TarInfo.frombuf(buf)
+                else:
+                    header = tarfile.TarInfo.frombuf(buf, 'utf-8', 'surrogateescape')
+            except tarfile.TarError:
+                header = None
+            # the index may be outdated if the archive was rewritten (e.g. with `remove_out_pot_impcalcs`)
+            if header is not None and header.name==member and header.size==size:
+                _copy_stream(fsrc, fdst, size, bufsize)
+                return size
+
+    for tinfo, fsrc in _iter_archive_members(filepath_tar):
+        if tinfo.name==member:
+            _copy_stream(fsrc, fdst, tinfo.size, bufsize)
+            return tinfo.size
+
+    raise KeyError('{} not found in archive {}'.format(member, filepath_tar))
+
+
+def read_archive_member(filepath_tar, member, archive_info=None):
+    """
+    Read a single member of a tar archive into memory (see `copy_archive_member`).
+    The returned in-memory file has the base name of the member as `name` attribute, i.e. it can directly be
+    used to create a SinglefileData node (`SinglefileData(file=read_archive_member(path, 'out_potential'))`).
+
+    :param filepath_tar: path of the tar archive
+    :param member: name of the member
+    :param archive_info: dictionary returned by `write_output_archive` (optional)
+
+    :returns: io.BytesIO object with the content of the member
+    """
+    import io
+    import os
+    fmember = io.BytesIO()
+    copy_archive_member(filepath_tar, member, fmember, archive_info)
+    fmember.seek(0)
+    fmember.name = os.path.basename(member)
+    return fmember
+
+
+def read_archive_members(filepath_tar, select):
+    """
+    Read all members of a tar archive for which `select(name)` is True into memory in a single pass over the archive.
+
+    :param filepath_tar: path of the tar archive
+    :param select: function that takes the name of a member and returns True if the member should be read
+
+    :returns: dictionary of io.BytesIO objects with the content of the selected members
+    """
+    import io
+    members = {}
+    for tinfo, fsrc in _iter_archive_members(filepath_tar):
+        if select(tinfo.name):
+            fmember = io.BytesIO()
+            _copy_stream(fsrc, fmember, tinfo.size, 1024**2)
+            fmember.seek(0)
+            members[tinfo.name] = fmember
+    return members
+
+
+def remove_archive_members(filepath_tar, members, compression='gz', compresslevel=None):
+    """
+    Remove members from a tar archive. The archive is streamed once to check if any of the members is present and
+    (only then) a second time to write a new archive without these members which replaces the old one.
+    Nothing is extracted to disk. If writing the new archive fails the old archive is kept.
+
+    :param filepath_tar: path of the tar archive
+    :param members: list of names of the members that are removed
+    :param compression: compression codec of the new archive (see `write_output_archive`)
+    :param compresslevel: compression level of the new archive, should be the level of the old archive
+                          (`archive_info['compresslevel']`) since the default of the codec can give larger archives
+
+    :returns: number of bytes by which the size of the archive was reduced (0 if nothing was removed)
+    """
+    import os
+    import tarfile
+
+    if not any([name in members for name in list_archive_members(filepath_tar)]):
+        return 0
+
+    mode, kwargs = _get_tar_write_mode(_get_archive_codec(compression).replace('gz_parallel', 'gz'), compresslevel)
+    size_old = os.stat(filepath_tar).st_size
+    filepath_new = filepath_tar+'.tmp'
+    try:
+        with tarfile.open(filepath_new, mode, **kwargs) as tf:
+            for tinfo, fsrc in _iter_archive_members(filepath_tar):
+                if tinfo.name not in members:
+                    tf.addfile(tinfo, fsrc)
+        os.rename(filepath_new, filepath_tar)
+    finally:
+        # do not leave a partially written archive behind if something went wrong
+        if os.path.exists(filepath_new):
+            os.remove(filepath_new)
+
+    return size_old-os.stat(filepath_tar).st_size
+
+
+def remove_archive_members_batch(archives, members, nprocs=None):
+    """
+    Remove members from many tar archives (see `remove_archive_members`). The archives are processed in parallel by
+    a pool of worker threads (compression and decompression release the GIL).
+
+    :param archives: list of (filepath_tar, compression, compresslevel) tuples
+    :param members: list of names of the members that are removed from all archives
+    :param nprocs: number of worker threads (defaults to the number of cores)
+
+    :returns: list with the number of bytes that were reclaimed for each archive
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def remove_members(archive):
+        filepath_tar, compression, compresslevel = archive
+        return remove_archive_members(filepath_tar, members, compression=compression, compresslevel=compresslevel)
+
+    if len(archives)==0:
+        return []
+    pool = ThreadPool(min(nprocs, len(archives)) if nprocs is not None else None)
+    try:
+        reclaimed = pool.map(remove_members, archives)
+    finally:
+        pool.close()
+        pool.join()
+    return reclaimed
+
+
+def get_output_archive(retrieved):
+    """
+    Find the tarball of the output files in the retrieved folder of a KKRimp calculation.
+
+    :param retrieved: retrieved folder (FolderData) of the KKRimp calculation
+    :returns: filepath_tar (path to the tarball, None if the output is not packed),
+              archive_info (dict with the `archive_info` of the output parameters, empty if not written by the parser,
+              for uncompressed archives the `member_index` is taken from the `archive_index` output of the calculation)
+    """
+    import tarfile
+    from aiida_kkr.calculations.kkrimp import KkrimpCalculation
+
+    if KkrimpCalculation._FILENAME_TAR not in retrieved.list_object_names():
+        return None, {}
+    with retrieved.open(KkrimpCalculation._FILENAME_TAR) as tf:
+        filepath_tar = tf.name
+    try:
+        calc = retrieved.get_incoming().first().node
+        archive_info = calc.outputs.output_parameters.get_dict().get('archive_info', {})
+        if 'archive_index' in calc.outputs:
+            archive_info['member_index'] = calc.outputs.archive_index.get_dict().get('member_index', {})
+    except (IOError, tarfile.TarError, AttributeError):
+        # AttributeError: calculation without output parameters
+        archive_info = {}
+    return filepath_tar, archive_info
+
+
+class outfile_scanner(object):
+    """
+    Single-pass, event driven scanner for output files. Extractors are registered with a search key and all lines
+    that contain the key are dispatched to them while the file is streamed once.
+    Extractors of the same group compete for lines: a line is only given to the first extractor of the group (in
+    order of registration) that accepts it. This reproduces the result of consecutive `search_string` and `pop`
+    calls on the list of lines of the file.
+
+    :usage:
+        scanner = outfile_scanner()
+        scanner.register('natom', 'NATOM is', first_only=True)
+        matches = scanner.scan(path_to_file) # {'natom': [' NATOM is              13\n']}
+    """
+
+    def __init__(self):
+        self._extractors = []
+
+
+    def register(self, name, searchkey, first_only=False, group=None, nfollow=0):
+        """
+        Register an extractor.
+
+        :param name: name under which the matching lines are returned
+        :param searchkey: string that is searched for in every line
+        :param first_only: if True only the first matching line is taken
+        :param group: name of the group of extractors that compete for lines (defaults to `name`)
+        :param nfollow: number of lines following a matching line that are collected as well, can also be a function
+                        that takes the matches found so far and returns the number of lines
+        """
+        if group is None:
+            group = name
+        self._extractors.append((name, searchkey, first_only, group, nfollow))
+
+
+    def scan(self, file):
+        """
+        Stream the file once and dispatch all lines to the registered extractors.
+
+        :param file: path or file handle of the file that is scanned
+
+        :returns: dictionary with a list of matches for each registered name, a match is the matching line or (if
+                  nfollow is given) a list containing the matching line and the lines that follow it
+        """
+        matches = dict([(ext[0], []) for ext in self._extractors])
+        active = list(self._extractors)
+        following = [] # matches that still collect lines: [list of lines, number of missing lines]
+        with open_general(file) as f:
+            for line in f:
+                if len(following)>0:
+                    for capture in following:
+                        capture[0].append(line)
+                        capture[1] -= 1
+                    following = [capture for capture in following if capture[1]>0]
+                taken, finished = set(), []
+                for ext in active:
+                    name, searchkey, first_only, group, nfollow = ext
+                    if group in taken or searchkey not in line:
+                        continue
+                    taken.add(group)
+                    if first_only:
+                        finished.append(ext)
+                    if callable(nfollow):
+                        nfollow = nfollow(matches)
+                    if nfollow>0:
+                        matches[name].append([line])
+                        following.append([matches[name][-1], nfollow])
+                    else:
+                        matches[name].append(line)
+                for ext in finished:
+                    active.remove(ext)
+        return matches
 
 
 
@@ -181,6 +696,81 @@ class kkrimp_parser_functions(object):
 
     ### some helper functions ###
 
+    def _scan_out_log(self, out_log):
+        """
+        Stream the out_log file once and collect all lines that are needed by the helper functions below.
+        The result is kept for the last scanned file, i.e. repeated calls with the same file do not read it again.
+        :param out_log: out_log.000.txt file of the KKRimp calculation
+        :returns: matches (dict), lines found by the `outfile_scanner`
+        """
+        cached = getattr(self, '_out_log_matches', None)
+        if cached is not None and cached[0] is out_log:
+            return cached[1]
+
+        scanner = outfile_scanner()
+        # scf info, these keys compete for the same lines (see _get_scfinfo)
+        scanner.register('rms', 'average rms-error', group='scfinfo')
+        for name, searchkey in [('scfsteps', 'SCFSTEPS'), ('qbound', 'QBOUND'), ('imix', 'IMIX'),
+                                ('mixfac', 'MIXFAC'), ('fcm', 'FCM')]:
+            scanner.register(name, searchkey, first_only=True, group='scfinfo')
+        scanner.register('natom', 'NATOM is', first_only=True)
+        scanner.register('nspin', 'NSPIN', first_only=True)
+        scanner.register('newsosol', 'Spin orbit coupling used?', first_only=True)
+        scanner.register('spinmom', 'spin magnetic moment =')
+        scanner.register('etot', 'TOTAL ENERGY')
+        scanner.register('rms_atom', 'rms-error for atom')
+        # charges per atom (nuclear and core charge are found in the same line)
+        scanner.register('charge_ws', 'charge in wigner seitz')
+        scanner.register('charge_nuc', 'nuclear charge')
+        scanner.register('charge_core', 'core charge')
+        # energy contour: number of points and the table of energies and weights that follows after 3 more lines
+        scanner.register('nepts', '[read_energy] number of energy points', first_only=True)
+        scanner.register('epts', 'energies and weights are:', first_only=True,
+                         nfollow=lambda matches: 3+int(matches['nepts'][0].split()[-1]) if len(matches['nepts'])>0 else 0)
+        matches = scanner.scan(out_log)
+
+        self._out_log_matches = (out_log, matches)
+        return matches
+
+
+    def _get_rms(self, outfile, out_log):
+        """
+        Extract rms error of all iterations and the rms error per atom of the last iteration
+        :param outfile: std_out of the KKRimp calculation
+        :param out_log: out_log.000.txt file of the KKRimp calculation
+        :returns: rms (array), average rms error of all iterations
+                  rms_atoms_last (array), rms error of all atoms in the last iteration
+        """
+        from numpy import array
+        scanner = outfile_scanner()
+        scanner.register('rms', 'average rms-error')
+        rms = array([float(line.replace('D', 'E').split('=')[1].split()[0])
+                     for line in scanner.scan(outfile)['rms']])
+        matches = self._scan_out_log(out_log)
+        rms_atoms = array([float(line.replace('D', 'E').split('=')[1].split()[0])
+                           for line in matches['rms_atom']])
+        natoms = int(len(rms_atoms)//len(rms)) # take only atom resolved rms of last iteration
+        return rms, rms_atoms[-natoms:]
+
+
+    def _get_charges_per_atom(self, out_log):
+        """
+        Extract charges in the Wigner-Seitz cell, nuclear charges and core charges for all atoms and iterations
+        :param out_log: out_log.000.txt file of the KKRimp calculation
+        :returns: charge_ws (array), charge_nuc (array), charge_core (array)
+        """
+        from numpy import array
+        matches = self._scan_out_log(out_log)
+        charge_ws = array([float(line.split('=')[1]) for line in matches['charge_ws']])
+        # these two are not in output of DOS calculation (and are then ignored)
+        charge_nuc = array([float(line.split('nuclear charge')[1].split()[0]) for line in matches['charge_nuc']])
+        try:
+            charge_core = array([float(line.split('=')[1]) for line in matches['charge_core']])
+        except IndexError:
+            charge_core = array([float(line.split(':')[1]) for line in matches['charge_core']])
+        return charge_ws, charge_nuc, charge_core
+
+
     def _get_econt_info(self, out_log):
         """
         extract energy contour information from out_log file
@@ -192,19 +782,16 @@ class kkrimp_parser_functions(object):
             * 'epts', list of complex valued energy points
             * 'weights', list of complex valued weights for energy integration
         """
-        from masci_tools.io.common_functions import search_string
         from numpy import array
-        f = open_general(out_log)
-        tmptxt = f.readlines()
-        f.close()
+        matches = self._scan_out_log(out_log)
         econt = {}
-        itmp = search_string('[read_energy] number of energy points', tmptxt)
-        if itmp>=0: econt['Nepts'] = int(tmptxt.pop(itmp).split()[-1])
-        itmp = search_string('energies and weights are:', tmptxt)
-        if itmp>=0:
+        if len(matches['nepts'])>0: econt['Nepts'] = int(matches['nepts'][0].split()[-1])
+        if len(matches['epts'])>0:
+            # energy points start 4 lines after the 'energies and weights are:' line
+            tmptxt = matches['epts'][0]
             tmp = []
             for ie in range(econt['Nepts']):
-                tmpline = tmptxt[itmp+4+ie].split()[1:]
+                tmpline = tmptxt[4+ie].split()[1:]
                 tmp.append([float(tmpline[0]), float(tmpline[1]), float(tmpline[2]), float(tmpline[3])])
             tmp = array(tmp)
             econt['epts'] = tmp[:,:2]
@@ -220,38 +807,23 @@ class kkrimp_parser_functions(object):
         :returns: niter (int), nitermax (int), converged (bool), nmax_reached (bool), mixinfo (dict)
         :note: mixinfo contains information on mixing scheme and mixing factor used in the calculation
         """
-        from masci_tools.io.common_functions import search_string
-        f = open_general(file)
-        tmptxt = f.readlines()
-        f.close()
-        # get rms and number of iterations
-        itmp, niter, rms = 0, -1, -1
-        while itmp >= 0:
-            itmp = search_string('average rms-error', tmptxt)
-            if itmp >= 0:
-                tmp = tmptxt.pop(itmp).replace('D', 'E').split()
-                niter = int(tmp[1])
-                rms = float(tmp[-1])
+        matches = self._scan_out_log(file)
+        # get rms and number of iterations (from last iteration)
+        niter, rms = -1, -1
+        if len(matches['rms'])>0:
+            tmp = matches['rms'][-1].replace('D', 'E').split()
+            niter = int(tmp[1])
+            rms = float(tmp[-1])
         # get max number of scf steps
-        itmp = search_string('SCFSTEPS', tmptxt)
-        if itmp >= 0:
-            nitermax = int(tmptxt.pop(itmp).split()[-1])
+        nitermax = int(matches['scfsteps'][0].split()[-1])
         # get qbound
-        itmp = search_string('QBOUND', tmptxt)
-        if itmp >= 0:
-            qbound = float(tmptxt.pop(itmp).split()[-1])
+        qbound = float(matches['qbound'][0].split()[-1])
         # get imix
-        itmp = search_string('IMIX', tmptxt)
-        if itmp >= 0:
-            imix = int(tmptxt.pop(itmp).split()[-1])
+        imix = int(matches['imix'][0].split()[-1])
         # get mixfac
-        itmp = search_string('MIXFAC', tmptxt)
-        if itmp >= 0:
-            mixfac = float(tmptxt.pop(itmp).split()[-1])
+        mixfac = float(matches['mixfac'][0].split()[-1])
         # get fcm
-        itmp = search_string('FCM', tmptxt)
-        if itmp >= 0:
-            fcm = float(tmptxt.pop(itmp).split()[-1])
+        fcm = float(matches['fcm'][0].split()[-1])
         # set mixinfo
         mixinfo = [imix, mixfac, qbound, fcm]
         # set converged and nmax_reached logicals
@@ -268,12 +840,8 @@ class kkrimp_parser_functions(object):
         :param file: absolute path to out_log.000.txt of KKRimp calculation
         :returns: True(False) if SOC solver is (not) used
         """
-        from masci_tools.io.common_functions import search_string
-        f = open_general(file)
-        tmptxt = f.readlines()
-        f.close()
-        itmp = search_string('Spin orbit coupling used?', tmptxt)
-        itmp = int(tmptxt.pop(itmp).split()[-1])
+        matches = self._scan_out_log(file)
+        itmp = int(matches['newsosol'][0].split()[-1])
         if itmp==1:
             newsosol = True
         else:
@@ -287,12 +855,8 @@ class kkrimp_parser_functions(object):
         :param file: file that is parsed to find number of atoms
         :returns: natom (int), number of atoms in impurity cluster
         """
-        from masci_tools.io.common_functions import search_string
-        f = open_general(file)
-        tmptxt = f.readlines()
-        f.close()
-        itmp = search_string('NATOM is', tmptxt)
-        natom = int(tmptxt.pop(itmp).split()[-1])
+        matches = self._scan_out_log(file)
+        natom = int(matches['natom'][0].split()[-1])
         return natom
 
 
@@ -304,31 +868,21 @@ class kkrimp_parser_functions(object):
         :param file: file that is parsed to find magnetic moments
         :param natom: number of atoms in the cluster
         :returns: magn. moment for all atoms in the cluster for the last iteration (saved in z-comp. of 3d vector)
-                  magn. moment for all atoms in the cluster for all iterations (saved in z-comp. of 3d vector)
+                  magn. moment for all atoms in the cluster for all iterations (saved in z-comp. of 3d vector),
+                  shape (iterations, atoms, 3)
                   total magnetic moments of all atoms for last iteration
         """
-        from masci_tools.io.common_functions import search_string
         import numpy as np
 
-        f = open_general(file)
-        tmptxt = f.readlines()
-        f.close()
-        itmp = 0
-        spinmom_all = []
-        while itmp >= 0:
-           itmp = search_string('spin magnetic moment =', tmptxt)
-           if itmp >= 0:
-               spinmom_all.append(float(tmptxt.pop(itmp).split()[-1]))
-        # if no spin
-        spinmom = spinmom_all[len(spinmom_all)-natom:]
-        print (spinmom_all, natom, spinmom)
-        spinmom_vec = np.array([[0, 0, spinmom[0]]])
-        spinmom_vec_all = np.array([[0, 0, spinmom_all[0]]])
-        for i in range(1, natom):
-            spinmom_vec = np.append(spinmom_vec, [[0, 0, spinmom[i]]], axis=0)
-        for i in range(1, len(spinmom_all)):
-            spinmom_vec_all = np.append(spinmom_vec_all, [[0, 0, spinmom_all[i]]], axis=0)
-        magtot = sum(spinmom)
+        matches = self._scan_out_log(file)
+        spinmom_all = np.array([float(line.split()[-1]) for line in matches['spinmom']])
+        # drop incomplete iterations at the beginning
+        spinmom_all = spinmom_all[len(spinmom_all)%natom:]
+        spinmom_vec_all = np.zeros((len(spinmom_all), 3))
+        spinmom_vec_all[:,2] = spinmom_all
+        spinmom_vec_all = spinmom_vec_all.reshape(-1, natom, 3)
+        spinmom_vec = spinmom_vec_all[-1]
+        magtot = spinmom_vec[:,2].sum()
 
         return spinmom_vec, spinmom_vec_all, magtot
 
@@ -339,10 +893,6 @@ class kkrimp_parser_functions(object):
         :param outfile: timing file of the KKRimp run
         :returns: res (dict) timings in seconds, averaged over iterations
         """
-        from masci_tools.io.common_functions import search_string
-        f = open_general(outfile)
-        tmptxt = f.readlines()
-        f.close()
         search_keys = ['time until scf starts',
                        'vpot->tmat',
                        'gref->gmat',
@@ -351,14 +901,14 @@ class kkrimp_parser_functions(object):
                        'Iteration number',
                        'Total running time']
 
+        scanner = outfile_scanner()
+        for isearch in search_keys:
+            scanner.register(isearch, isearch, group='timings')
+        matches = scanner.scan(outfile)
+
         res = {}
         for isearch in search_keys:
-            tmpval = []
-            itmp = 0
-            while itmp>=0:
-                itmp = search_string(isearch, tmptxt)
-                if itmp>=0:
-                    tmpval.append(float(tmptxt.pop(itmp).split()[-1]))
+            tmpval = [float(line.split()[-1]) for line in matches[isearch]]
             if len(tmpval)>0:
                 res[isearch] = tmpval
         # average over iterations
@@ -379,39 +929,43 @@ class kkrimp_parser_functions(object):
         :param file: file that is parsed
         :returns: 1 if calculation is paramagnetic, 2 otherwise
         """
-        from masci_tools.io.common_functions import search_string
-        f = open_general(file)
-        tmptxt = f.readlines()
-        f.close()
-        itmp = search_string('NSPIN', tmptxt)
-        nspin = int(tmptxt.pop(itmp).split()[-1])
+        matches = self._scan_out_log(file)
+        nspin = int(matches['nspin'][0].split()[-1])
         return nspin
 
 
+    def _read_moments_file(self, file, natom):
+        """
+        Read the moments of all atoms and iterations from the out_magneticmoments or out_orbitalmoments file at once
+        :param file: file that is parsed
+        :param natom: number of atoms in impurity cluster
+        :returns: moments (float array of shape (iterations, atoms, components))
+        """
+        import numpy as np
+
+        f = open_general(file)
+        with f:
+            # first line is a header
+            moments = np.loadtxt(f, skiprows=1, ndmin=2)
+        # drop incomplete iterations at the beginning
+        moments = moments[len(moments)%natom:]
+        return moments.reshape(-1, natom, moments.shape[-1])
+
+
     def _get_spinmom_per_atom(self, file, natom):
         """
         Extract spin moment for all atoms
         :param file: file that is parsed
         :param natom: number of atoms in impurity cluster
         :returns: spinmom_at (array of spin moments for all atoms and the last iteration),
-                  spinmom_at_all (array of spin moments for all atoms and iterations),
+                  spinmom_at_all (array of spin moments for all atoms and iterations, shape (iterations, atoms, components)),
                   spinmom_at_tot (total spinmoment for the last iteration)
         """
         import numpy as np
-        from math import sqrt
 
-        f = open_general(file)
-        lines = f.readlines()
-        startline = len(lines) - natom
-        spinmom_at = np.array([lines[startline].split()])
-        spinmom_at_all = np.array([lines[1].split()])
-        for i in range(1, natom):
-            spinmom_at = np.append(spinmom_at, [lines[startline+i].split()], axis=0)
-        for j in range(2, len(lines)):
-            spinmom_at_all = np.append(spinmom_at_all, [lines[j].split()], axis=0)
-        spinmom_at_tot = 0
-        for i in range(0, natom):
-            spinmom_at_tot += sqrt(float(spinmom_at[i][0])**2+float(spinmom_at[i][1])**2+float(spinmom_at[i][2])**2)
+        spinmom_at_all = self._read_moments_file(file, natom)
+        spinmom_at = spinmom_at_all[-1]
+        spinmom_at_tot = np.sqrt((spinmom_at[:,:3]**2).sum(axis=1)).sum()
 
         return spinmom_at, spinmom_at_all, spinmom_at_tot
 
@@ -424,19 +978,11 @@ class kkrimp_parser_functions(object):
         third -> y-component real part, ... sixth -> z-component imaginary part.
         :param file: file that is parsed
         :param natom: number of atoms in impurity cluster
-        :returns: orbmom_at (list), orbital moments for all atoms
+        :returns: orbmom_at (array), orbital moments for all atoms,
+                  orbmom_at_all (array of shape (iterations, atoms, components))
         """
-        import numpy as np
-
-        f = open_general(file)
-        lines = f.readlines()
-        startline = len(lines) - natom
-        orbmom_at = np.array([lines[startline].split()])
-        orbmom_at_all = np.array([lines[1].split()])
-        for i in range(1, natom):
-            orbmom_at = np.append(orbmom_at, [lines[startline+i].split()], axis=0)
-        for j in range(2, len(lines)):
-            orbmom_at_all = np.append(orbmom_at_all, [lines[j].split()], axis=0)
+        orbmom_at_all = self._read_moments_file(file, natom)
+        orbmom_at = orbmom_at_all[-1]
 
         return orbmom_at, orbmom_at_all
 
@@ -460,16 +1006,8 @@ class kkrimp_parser_functions(object):
         :param file: file that is parsed
         :returns: Etot (list), values of the total energy in Ry for all iterations
         """
-        from masci_tools.io.common_functions import search_string
-        f = open_general(file)
-        tmptxt = f.readlines()
-        f.close()
-        itmp = 0
-        Etot = []
-        while itmp >= 0:
-            itmp = search_string('TOTAL ENERGY', tmptxt)
-            if itmp >= 0:
-                Etot.append(float(tmptxt.pop(itmp).split()[-1]))
+        matches = self._scan_out_log(file)
+        Etot = [float(line.split()[-1]) for line in matches['etot']]
         return Etot
 
 
@@ -491,11 +1029,14 @@ class kkrimp_parser_functions(object):
     ### end helper functions ###
 
 
-    def parse_kkrimp_outputfile(self, out_dict, file_dict):
+    def parse_kkrimp_outputfile(self, out_dict, file_dict, out_arrays=None):
         """
         Main parser function for kkrimp, read information from files in file_dict and fills out_dict
         :param out_dict: dictionary that is filled with parsed output of the KKRimp calculation
         :param file_dict: dictionary of files that are parsed
+        :param out_arrays: optional dictionary that is filled with the per-iteration histories of the spin and
+                           orbital moments (float arrays of shape (iterations, atoms, components)),
+                           if not given the arrays are stored in the convergence group of out_dict
         :returns: success (bool), msg_list(list of error/warning messages of parser), out_dict (filled dict of parsed output)
         :note: file_dict should contain the following keys
             * 'outfile', the std_out of the KKRimp calculation
@@ -509,13 +1050,16 @@ class kkrimp_parser_functions(object):
             * 'out_spinmoms', the output spin moments file
             * 'out_orbmoms', the output orbital moments file
         """
-        from masci_tools.io.parsers.kkrparser_functions import get_rms, find_warnings, get_charges_per_atom, get_core_states
+        from masci_tools.io.parsers.kkrparser_functions import find_warnings, get_core_states
         from masci_tools.io.common_functions import get_version_info, get_Ry2eV
 
         Ry2eV = get_Ry2eV()
         msg_list = []
         files = file_dict
 
+        # out_log is streamed only once (on first use in the helper functions)
+        self._out_log_matches = None
+
         try:
             code_version, compile_options, serial_number = get_version_info(files['out_log'])
             tmp_dict = {}
@@ -531,7 +1075,7 @@ class kkrimp_parser_functions(object):
         # also initialize convegence_group where all info stored for all iterations is kept
         out_dict['convergence_group'] = tmp_dict
         try:
-            result, result_atoms_last = get_rms(files['outfile'], files['out_log'])
+            result, result_atoms_last = self._get_rms(files['outfile'], files['out_log'])
             tmp_dict['rms'] = result[-1]
             tmp_dict['rms_all_iterations'] = result
             tmp_dict['rms_per_atom'] = result_atoms_last
@@ -552,20 +1096,24 @@ class kkrimp_parser_functions(object):
             msg = "Error parsing output of KKRimp: nspin/natom"
             msg_list.append(msg)
 
+        # per-iteration histories are kept as numeric arrays, either in out_arrays or in the convergence group
+        if out_arrays is None:
+            out_arrays = out_dict['convergence_group']
+
         tmp_dict = {} # used to group magnetism info (spin and orbital moments)
         try:
             if nspin>1 and newsosol:
                 spinmom_vec, spinmom_vec_all, magtot = self._get_spinmom_per_atom(files['out_spinmoms'], natom)
-                tmp_dict['total_spin_moment'] = magtot
-                out_dict['convergence_group']['spin_moment_per_atom'] = spinmom_vec
-                out_dict['convergence_group']['spin_moment_per_atom_all_iterations'] = spinmom_vec_all
+                tmp_dict['total_spin_moment'] = float(magtot)
+                out_dict['convergence_group']['spin_moment_per_atom'] = spinmom_vec.tolist()
+                out_arrays['spin_moment_per_atom_all_iterations'] = spinmom_vec_all
                 tmp_dict['total_spin_moment_unit'] = 'mu_Bohr'
                 out_dict['magnetism_group'] = tmp_dict
             elif nspin>1:
                 spinmom_vec, spinmom_vec_all, magtot = self._get_magtot(files['out_log'], natom)
-                tmp_dict['total_spin_moment'] = magtot
-                out_dict['convergence_group']['spin_moment_per_atom'] = spinmom_vec
-                out_dict['convergence_group']['spin_moment_per_atom_all_iterations'] = spinmom_vec_all
+                tmp_dict['total_spin_moment'] = float(magtot)
+                out_dict['convergence_group']['spin_moment_per_atom'] = spinmom_vec.tolist()
+                out_arrays['spin_moment_per_atom_all_iterations'] = spinmom_vec_all
                 tmp_dict['total_spin_moment_unit'] = 'mu_Bohr'
                 out_dict['magnetism_group'] = tmp_dict
         except:
@@ -576,8 +1124,8 @@ class kkrimp_parser_functions(object):
         try:
             if nspin>1 and newsosol and files['out_orbmoms'] is not None:
                 orbmom_atom, orbmom_atom_all = self._get_orbmom_per_atom(files['out_orbmoms'], natom)
-                tmp_dict['orbital_moment_per_atom'] = orbmom_atom
-                out_dict['convergence_group']['orbital_moment_per_atom_all_iterations'] = orbmom_atom_all
+                tmp_dict['orbital_moment_per_atom'] = orbmom_atom.tolist()
+                out_arrays['orbital_moment_per_atom_all_iterations'] = orbmom_atom_all
                 tmp_dict['orbital_moment_unit'] = 'mu_Bohr'
                 out_dict['magnetism_group'] = tmp_dict
         except:
@@ -632,7 +1180,7 @@ class kkrimp_parser_functions(object):
             msg_list.append(msg)
 
         try:
-            result_WS, result_tot, result_C = get_charges_per_atom(files['out_log'])
+            result_WS, result_tot, result_C = self._get_charges_per_atom(files['out_log'])
             niter = len(out_dict['convergence_group']['rms_all_iterations'])
             natyp = int(len(result_tot)/niter)
             out_dict['total_charge_per_atom'] = result_WS[-natyp:]
@@ -728,36 +1276,20 @@ def get_structure_data(structure):
     """
 
     #import packages
-    from aiida.common.constants import elements as PeriodicTableElements
+    from aiida_kkr.tools.common_workfunctions import get_structure_arrays
     import numpy as np
 
-    #get the connection between coordination number and element symbol
-    _atomic_numbers = {data['symbol']:num for num,
-                data in PeriodicTableElements.items()}
+    #convert the structure to arrays (positions, atomic numbers, ...)
+    struc_arrays = get_structure_arrays(structure)
+    nsites = len(struc_arrays['positions'])
 
     #initialize the array that will be returned later (it will be a (# of atoms in the cell) x 6-matrix)
-    a = np.zeros((len(structure.sites),6))
-    k = 0 #running index for filling up the array with data correctly
-    charges = [] #will be needed to return the charge number for the different atoms later
-
-    #loop to fill up the a-array with positions, index, charge and a 0. for every atom in the cell
-    sites = structure.sites
-    n = len(structure.sites) + 1 #needed to do the indexing of atoms
-    m = len(structure.sites) #needed to do the indexing of atoms
-    for site in sites:
-        for j in range(3):
-            a[k][j] = site.position[j]
-        sitekind = structure.get_kind(site.kind_name)
-        naez = n - m
-        m = m - 1
-        #convert the element symbol from StructureData to the charge number
-        for ikind in range(len(sitekind.symbols)):
-            site_symbol = sitekind.symbols[ikind]
-            charges.append(_atomic_numbers[site_symbol])
-        i = len(charges) - 1
-        a[k][3] = int(naez)
-        a[k][4] = float(charges[i])
-        k = k + 1
+    #and fill it with positions, index, charge and a 0. for every atom in the cell
+    a = np.zeros((nsites,6))
+    a[:,:3] = struc_arrays['positions']
+    a[:,3] = np.arange(1, nsites+1)
+    #charge number of the last symbol of every site (relevant for CPA sites)
+    a[:,4] = struc_arrays['zatom'][np.cumsum(struc_arrays['ncomponents'])-1]
 
     return a
 
@@ -821,6 +1353,49 @@ def get_distance(structure_array, i, j):
     #return absolute value of the distance of atom i and j
     return math.sqrt(del_x*del_x + del_y*del_y + del_z*del_z)
 
+# cache of rotation matrices used in get_rotation_matrix_onto_z
+_rotation_matrix_cache = {}
+
+def get_rotation_matrix_onto_z(vector):
+    """
+    Returns the rotation matrix that maps the orientation vector onto the z-axis (rotation around the z-axis
+    with angle -phi followed by a rotation around the y-axis with angle -theta).
+
+    :param vector: reference vector that has to be mapped onto the z-axis.
+
+    :return: 3x3 rotation matrix
+
+    :note: the rotation matrices are cached (keyed on the orientation vector) since the same orientation
+           is typically used many times (e.g. for all impurity calculations of a slab).
+    """
+
+    from masci_tools.io.common_functions import vec_to_angles
+    import math
+    import numpy as np
+
+    key = tuple(float(ivec) for ivec in vector)
+    if key not in _rotation_matrix_cache:
+        #get angles, from vector
+        angles = vec_to_angles(list(key))
+        theta = angles[1]
+        phi = angles[2]
+
+        #define rotation matrices
+        #========================
+        #rotation around z-axis with angle phi
+        R_z = np.array([[math.cos(-phi), -math.sin(-phi), 0.],
+                        [math.sin(-phi), math.cos(-phi), 0.],
+                        [0., 0., 1]])
+        #rotation around y-axis with angle theta
+        R_y = np.array([[math.cos(-theta), 0, math.sin(-theta)],
+                        [0., 1., 0.],
+                        [-math.sin(-theta), 0., math.cos(-theta)]])
+
+        #first rotate around z-axis, then around y-axis
+        _rotation_matrix_cache[key] = np.dot(R_y, R_z)
+
+    return _rotation_matrix_cache[key].copy()
+
 def rotate_onto_z(structure, structure_array, vector):
     """
     Rotates all positions of a structure array of orientation 'orient' onto the z-axis. Needed to implement the
@@ -833,37 +1408,13 @@ def rotate_onto_z(structure, structure_array, vector):
     :return: rotated system, now the 'orient'-axis is aligned with the z-axis
     """
 
-    from masci_tools.io.common_functions import vec_to_angles
-    import math
     import numpy as np
 
-    #get angles, from vector
-    angles = vec_to_angles(vector)
-    theta = angles[1]
-    phi = angles[2]
-
-    #initialize needed arrays
-    x_res = np.delete(structure_array, np.s_[3:6], 1)
-    x_temp_1 = np.delete(structure_array, np.s_[3:6], 1)
-    x_temp_2 = np.delete(structure_array, np.s_[3:6], 1)
-
-    #define rotation matrices
-    #========================
-    #rotation around z-axis with angle phi
-    R_z = np.array([[math.cos(-phi), -math.sin(-phi), 0.],
-                    [math.sin(-phi), math.cos(-phi), 0.],
-                    [0., 0., 1]])
-    #rotation around y-axis with angle theta
-    R_y = np.array([[math.cos(-theta), 0, math.sin(-theta)],
-                    [0., 1., 0.],
-                    [-math.sin(-theta), 0., math.cos(-theta)]])
-
-    #first rotate around z-axis
-    for i in range(len(structure_array)):
-        x_temp_1[i] = np.dot(R_z, x_res[i])
-        x_temp_2[i] = np.dot(R_y, x_temp_1[i])
-
-    return x_temp_2
+    #get rotation matrix (cached for each orientation vector)
+    rotmat = get_rotation_matrix_onto_z(vector)
+
+    #rotate all positions at once
+    return np.dot(np.array(structure_array)[:,:3], rotmat.T)
 
 def find_neighbors(structure, structure_array, i, radius, clust_shape='spherical', h=0., vector=[0., 0., 1.]):
     """
@@ -886,13 +1437,17 @@ def find_neighbors(structure, structure_array, i, radius, clust_shape='spherical
 
     :return: array with all the atoms within the cutoff (x_res)
 
-    :ToDo: - dynamical box construction (r_cut determines which values n1, n2, n3 have)
-           - different cluster forms (spherical, cylinder, ...), add default parameters, better solution for 'orient'
+    :note: The periodic images are generated with `get_periodic_images` in a single vectorized step,
+           i.e. all lattice translations are constructed as one integer grid that is broadcasted against
+           the positions of the unit cell. The cutoff is then applied as a boolean mask on the distances.
+           The size of the supercell box is chosen for each direction separately from the heights of the
+           unit cell (see `get_translation_bounds`).
+
+    :ToDo: - better solution for 'orient'
     """
 
     #import packages
     import numpy as np
-    import math
 
     # make sure we take the correct cell length for 2D structures
     if not structure.pbc[2]:
@@ -904,14 +1459,13 @@ def find_neighbors(structure, structure_array, i, radius, clust_shape='spherical
     else:
         sl3 = structure.cell_lengths[2]
         c3 = structure.cell[2]
-    
 
-    #obtain cutoff distance from radius and h
-    dist_cut = max(radius, h)
 
     #initialize arrays and reference the system
     x = select_reference(structure_array, i)
-    x_temp = np.array([x[i]])
+
+    if clust_shape not in _cluster_shape_masks:
+        raise ValueError('Unknown cluster shape "{}". Possible values are: {}'.format(clust_shape, list(_cluster_shape_masks.keys())))
 
     #calculate needed amount of boxes in all three directions
     #========================================================
@@ -932,52 +1486,161 @@ def find_neighbors(structure, structure_array, i, radius, clust_shape='spherical
     box = max(box_1, box_2, box_3)
     cell = np.array(structure.cell)
     cell[2] = c3
-    for j in range(len(x)):
-        for n in range(-box, box + 1):
-            for m in range(-box, box + 1):
-                for l in range(-box, box + 1):
-                    x_temp = np.append(x_temp, [[x[j][0] + (n*cell[0][0] + m*cell[1][0] + l*cell[2][0]),
-                                                 x[j][1] + (n*cell[0][1] + m*cell[1][1] + l*cell[2][1]),
-                                                 x[j][2] + (n*cell[0][2] + m*cell[1][2] + l*cell[2][2]),
-                                                 x[j][3], x[j][4], 0.]], axis = 0)
-
-    #x_temp now contains all the atoms and their positions regardless if they are bigger or smaller than the cutoff
-    x_new = x_temp
-
-    #calculate the distances between all the atoms and the center atom i
-    for j in range(len(x_temp)):
-        x_new[j][5] = get_distance(x_temp, 0, j)
-
-    #initialize result array
-    x_res = np.array([x[i]])
-
-    #only take atoms into account whose distance to atom i is smaller than the cutoff radius
-    #dist_cut = dist_cut
-    if clust_shape == 'spherical':
-        for j in range(len(x_temp)):
-            if x_new[j][5] <= dist_cut and x_new[j][5] > 0.:
-                x_res = np.append(x_res, [[x_temp[j][0],
-                                             x_temp[j][1],
-                                             x_temp[j][2],
-                                             x_temp[j][3], x_temp[j][4], x_new[j][5]]], axis=0)
-    elif clust_shape == 'cylindrical':
-        for j in range(len(x_temp)):
-            #rotate system into help system that is aligned with the z-axis
-            x_help = rotate_onto_z(structure, x_temp, vector)
-
-            #calculate in plane distance and vertical distance
-            vert_dist = np.absolute(x_help[j][2])
-            inplane_dist = math.sqrt(x_help[j][0]**2 + x_help[j][1]**2)
-            #print(vert_dist, inplane_dist)
-            if vert_dist <= h/2. and inplane_dist <= radius and x_new[j][5] > 0.:
-                x_res = np.append(x_res, [[x_temp[j][0],
-                                             x_temp[j][1],
-                                             x_temp[j][2],
-                                             x_temp[j][3], x_temp[j][4], x_new[j][5]]], axis=0)
+    #only use translations (per direction) that can give images inside the cluster (never more than box)
+    extents = _cluster_shape_extents[clust_shape](cell, radius, h, vector)
+    bounds = get_translation_bounds(cell, x[:,:3], extents, nbox_max=box)
+    x_temp = get_periodic_images(x, cell, bounds)
+
+    #calculate the distances between all the atoms and the center atom i (which sits at the origin)
+    x_temp[:,5] = np.sqrt(x_temp[:,0]*x_temp[:,0] + x_temp[:,1]*x_temp[:,1] + x_temp[:,2]*x_temp[:,2])
+
+    #only take atoms into account that lie within the cluster shape (the center atom is excluded here)
+    mask = _cluster_shape_masks[clust_shape](structure, x_temp, radius, h, vector) & (x_temp[:,5] > 0.)
 
     #return an unordered array of all the atoms which are within the cutoff distance with respect to atom i
+    #(the center atom i is always the first entry)
+    x_res = np.append(np.array([x[i]]), x_temp[mask], axis=0)
+
     return x_res
 
+
+def get_translation_grid(bounds):
+    """
+    Generate the integer grid of all lattice translations (n1, n2, n3) with nmin_k <= n_k <= nmax_k.
+
+    :param bounds: list of three tuples (nmin, nmax) for the three Bravais vectors
+
+    :return: integer array of shape ((# of translations), 3), the third direction runs fastest
+    """
+    import numpy as np
+
+    n1, n2, n3 = [np.arange(nmin, nmax+1) for nmin, nmax in bounds]
+    return np.array(np.meshgrid(n1, n2, n3, indexing='ij')).reshape(3, -1).T
+
+
+def get_translation_bounds(cell, positions, extents, nbox_max=None):
+    """
+    Find the lattice-aware bounds of the supercell box along the three Bravais vectors. Only translations for which
+    images of atoms at `positions` can lie within a cluster that extends up to `extents[k]` away from the origin
+    along the normal of the k-th lattice plane (i.e. along the k-th reciprocal lattice vector) are taken into account.
+    The bounds follow from the heights of the unit cell (distance between lattice planes) which are given by
+    the lengths of the reciprocal lattice vectors.
+
+    :param cell: array of the three Bravais vectors
+    :param positions: positions of the atoms (relative to the cluster center)
+    :param extents: extent of the cluster along the three reciprocal lattice directions
+    :param nbox_max: optional, maximal number of boxes in each direction (bounds are clipped to [-nbox_max, nbox_max])
+
+    :return: list of three tuples (nmin, nmax)
+    """
+    import numpy as np
+
+    cell = np.array(cell, dtype=float)
+    # reciprocal lattice vectors (without 2*pi factor) and heights of the unit cell
+    recvecs = np.linalg.inv(cell).T
+    heights = 1./np.sqrt(np.sum(recvecs**2, axis=1))
+    # fractional coordinates of the atoms
+    frac = np.dot(np.array(positions, dtype=float).reshape(-1, 3), recvecs.T)
+
+    # small safety margin to include atoms that lie exactly on the surface of the cluster
+    eps = 10**-6
+    nmin = np.floor(-np.array(extents)/heights - frac.max(axis=0) - eps).astype(int)
+    nmax = np.ceil(np.array(extents)/heights - frac.min(axis=0) + eps).astype(int)
+    if nbox_max is not None:
+        nmin = np.maximum(nmin, -nbox_max)
+        nmax = np.minimum(nmax, nbox_max)
+
+    return [(int(nmin[k]), int(nmax[k])) for k in range(3)]
+
+
+def get_periodic_images(x, cell, bounds):
+    """
+    Construct all periodic images of the atoms in `x` in a supercell box. All lattice translations are generated
+    as one integer grid (see `get_translation_grid`) and broadcasted against the site array.
+
+    :param x: structure array ((# of atoms) x 6-matrix, see `get_structure_data` and `select_reference`)
+    :param cell: array of the three Bravais vectors
+    :param bounds: list of three tuples (nmin, nmax) giving the range of translations along each Bravais vector
+
+    :return: array of shape ((# of atoms)*(# of translations), 6) with the positions of all images, the index and
+             charge of the atom and 0 in the last column (the distance is not computed here). The images are ordered
+             with the atom index running slowest, followed by the translations along the first, second and third
+             Bravais vector.
+    """
+    import numpy as np
+
+    cell = np.array(cell, dtype=float)
+    nml = get_translation_grid(bounds)
+    translations = (nml[:,0:1]*cell[0] + nml[:,1:2]*cell[1]) + nml[:,2:3]*cell[2]
+
+    # broadcast translations against all sites
+    x = np.array(x)
+    x_images = np.zeros((len(x), len(translations), 6))
+    x_images[:,:,:3] = x[:,np.newaxis,:3] + translations[np.newaxis,:,:]
+    x_images[:,:,3:5] = x[:,np.newaxis,3:5]
+
+    return x_images.reshape(-1, 6)
+
+
+def _mask_spherical(structure, x_images, radius, h, vector):
+    """
+    Boolean mask of all atoms in x_images (distances to the center in the last column) that lie within a sphere
+    of radius `radius` (or `h` if it is larger) around the center atom.
+    """
+    dist_cut = max(radius, h)
+    return x_images[:,5] <= dist_cut
+
+def _mask_cylindrical(structure, x_images, radius, h, vector):
+    """
+    Boolean mask of all atoms in x_images that lie within a cylinder of radius `radius` and height `h` which is
+    centered around the center atom and oriented along `vector`.
+    """
+    import numpy as np
+
+    #rotate system into help system that is aligned with the z-axis (single rotation of all atoms)
+    x_help = rotate_onto_z(structure, x_images, vector)
+
+    #calculate in plane distance and vertical distance
+    vert_dist = np.absolute(x_help[:,2])
+    inplane_dist = np.sqrt(x_help[:,0]**2 + x_help[:,1]**2)
+
+    return (vert_dist <= h/2.) & (inplane_dist <= radius)
+
+def _extent_spherical(cell, radius, h, vector):
+    """
+    Extent of the spherical cluster along the normals of the lattice planes of `cell`.
+    """
+    dist_cut = max(radius, h)
+    return [dist_cut, dist_cut, dist_cut]
+
+def _extent_cylindrical(cell, radius, h, vector):
+    """
+    Extent of the cylindrical cluster along the normals of the lattice planes of `cell`.
+    """
+    import numpy as np
+
+    # unit vectors along the normals of the lattice planes (i.e. the reciprocal lattice vectors)
+    normals = np.linalg.inv(np.array(cell, dtype=float)).T
+    normals = normals / np.sqrt(np.sum(normals**2, axis=1))[:,np.newaxis]
+    # cylinder axis
+    axis = np.array(vector, dtype=float)
+    axis = axis / np.sqrt(np.sum(axis**2))
+    # projection of the cylinder onto the normals
+    cosangle = np.absolute(np.dot(normals, axis))
+    return h/2.*cosangle + radius*np.sqrt(np.maximum(1.-cosangle**2, 0.))
+
+# mapping of the cluster shapes to the functions that select the atoms within the cluster
+# and that give the extent of the cluster used to determine the size of the supercell box
+# (additional cluster shapes can be added here)
+_cluster_shape_masks = {'spherical': _mask_spherical,
+                        'cylindrical': _mask_cylindrical}
+_cluster_shape_extents = {'spherical': _extent_spherical,
+                          'cylindrical': _extent_cylindrical}
+
+# format of one line in the scoef file: position (x, y, z), index, charge and distance to the center
+_scoef_line_format = "{0:26.19e} {1:26.19e} {2:26.19e} {3:4d} {4:4.1f} {5:26.19e}\n"
+
+
 def write_scoef(x_res, path):
     """
     Sorts the data from find_neighbors with respect to the distance to the selected atom and writes the data
@@ -994,23 +1657,10 @@ def write_scoef(x_res, path):
     m = x_res[:,-1].argsort()
     x_res = x_res[m]
 
-    #write data of x_res into the 'scoef'-file
+    #render all lines into one buffer and write data of x_res into the 'scoef'-file with a single call
+    lines = [_scoef_line_format.format(xi[0], xi[1], xi[2], int(xi[3]), xi[4], xi[5]) for xi in x_res.tolist()]
     with open_general(path, 'w') as file:
-        file.write(str("{0:4d}".format(len(x_res))))
-        file.write("\n")
-        for i in range(len(x_res)):
-            file.write(str("{0:26.19e}".format(x_res[i][0])))
-            file.write(" ")
-            file.write(str("{0:26.19e}".format(x_res[i][1])))
-            file.write(" ")
-            file.write(str("{0:26.19e}".format(x_res[i][2])))
-            file.write(" ")
-            file.write(str("{0:4d}".format(int(x_res[i][3]))))
-            file.write(" ")
-            file.write(str("{0:4.1f}".format(x_res[i][4])))
-            file.write(" ")
-            file.write(str("{0:26.19e}".format(x_res[i][5])))
-            file.write("\n")
+        file.write(str("{0:4d}\n".format(len(x_res))) + "".join(lines))
 
 def make_scoef(structure, radius, path, h=-1., vector=[0., 0., 1.], i=0, alat_input=None):
     """
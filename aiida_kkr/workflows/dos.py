@@ -16,6 +16,7 @@ from masci_tools.io.kkr_params import kkrparams
 from aiida_kkr.tools.common_workfunctions import test_and_get_codenode, get_parent_paranode, update_params_wf, get_inputs_kkr
 from aiida_kkr.calculations.kkr import KkrCalculation
 from aiida_kkr.calculations.voro import VoronoiCalculation
+from aiida_kkr.data.kkrdos import KkrDosData
 from aiida.engine import CalcJob
 from aiida.orm import CalcJobNode
 from aiida.orm import WorkChainNode
@@ -25,7 +26,7 @@ from aiida.common.exceptions import InputValidationError
 __copyright__ = (u"Copyright (c), 2017, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.6.2"
+__version__ = "0.7.0"
 __contributors__ = u"Philipp Rüßmann"
 
 
@@ -90,8 +91,8 @@ class kkr_dos_wc(WorkChain):
 
         # define outputs
         spec.output("results_wf", valid_type=Dict, required=True)
-        spec.output("dos_data", valid_type=XyData, required=False)
-        spec.output("dos_data_interpol", valid_type=XyData, required=False)
+        spec.output("dos_data", valid_type=(XyData, KkrDosData), required=False)
+        spec.output("dos_data_interpol", valid_type=(XyData, KkrDosData), required=False)
 
         # Here the structure of the workflow is defined
         spec.outline(
@@ -366,11 +367,11 @@ class kkr_dos_wc(WorkChain):
 
         outdict = {}
         outdict['results_wf'] = outputnode
-        # interpol dos file and store to XyData nodes
+        # interpol dos file and store to KkrDosData nodes
         if has_dosrun:
             dos_retrieved = self.ctx.dosrun.outputs.retrieved
             if 'complex.dos' in dos_retrieved.list_object_names():
-                dosXyDatas = parse_dosfiles(dos_retrieved.open('complex.dos'))
+                dosXyDatas = parse_dosfiles(dos_retrieved.open('complex.dos'), nspin=self.ctx.dosrun.res.nspin)
                 dos_extracted = True
             else:
                 dos_extracted = False
@@ -385,9 +386,14 @@ class kkr_dos_wc(WorkChain):
         self.report("INFO: done with DOS workflow!\n")
 
 
-def parse_dosfiles(dosfolder):
+def parse_dosfiles(dosfolder, nspin=1):
     """
-    parse dos files to XyData nodes
+    parse dos files to KkrDosData nodes
+
+    :param dosfolder: path of the 'complex.dos' file or file handle to it
+    :param nspin: number of spin channels (the DOS of the potentials in the file is stored with shape (atom, spin, ...))
+
+    :returns: dos node, interpolated dos node (KkrDosData)
     """
     from masci_tools.io.common_functions import interpolate_dos
     from masci_tools.io.common_functions import get_Ry2eV
@@ -403,29 +409,17 @@ def parse_dosfiles(dosfolder):
     dos_int[:,:,1:] = dos_int[:,:,1:]/eVscale
 
     # create output nodes
-    dosnode = XyData()
-    dosnode.set_x(dos[:,:,0], 'E-EF', 'eV')
     name = ['tot', 's', 'p', 'd', 'f', 'g']
     name = name[:len(dos[0,0,1:])-1]+['ns']
-    ylists = [[],[],[]]
-    for l in range(len(name)):
-        ylists[0].append(dos[:,:,1+l])
-        ylists[1].append('dos '+name[l])
-        ylists[2].append('states/eV')
-    dosnode.set_y(ylists[0], ylists[1], ylists[2])
+    dosnode = KkrDosData()
+    dosnode.set_from_rows(dos, nspin, name, fermi_energy=ef)
     dosnode.label = 'dos_data'
-    dosnode.description = 'Array data containing uniterpolated DOS (i.e. dos at finite imaginary part of energy). 3D array with (atoms, energy point, l-channel) dimensions.'
-
-    # now create XyData node for interpolated data
-    dosnode2 = XyData()
-    dosnode2.set_x(dos_int[:,:,0], 'E-EF', 'eV')
-    ylists = [[],[],[]]
-    for l in range(len(name)):
-        ylists[0].append(dos_int[:,:,1+l])
-        ylists[1].append('interpolated dos '+name[l])
-        ylists[2].append('states/eV')
-    dosnode2.set_y(ylists[0], ylists[1], ylists[2])
+    dosnode.description = 'Array data containing uniterpolated DOS (i.e. dos at finite imaginary part of energy). 4D array with (atom, spin, l-channel, energy point) dimensions.'
+
+    # now create node for interpolated data
+    dosnode2 = KkrDosData()
+    dosnode2.set_from_rows(dos_int, nspin, name, fermi_energy=ef, dos_name='interpolated dos')
     dosnode2.label = 'dos_interpol_data'
-    dosnode2.description = 'Array data containing interpolated DOS (i.e. dos at real axis). 3D array with (atoms, energy point, l-channel) dimensions.'
+    dosnode2.description = 'Array data containing interpolated DOS (i.e. dos at real axis). 4D array with (atom, spin, l-channel, energy point) dimensions.'
 
     return dosnode, dosnode2
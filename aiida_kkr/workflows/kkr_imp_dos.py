@@ -14,13 +14,14 @@ from aiida_kkr.workflows.gf_writeout import kkr_flex_wc
 from aiida_kkr.workflows.kkr_imp_sub import kkr_imp_sub_wc
 from aiida_kkr.workflows.dos import kkr_dos_wc
 from aiida_kkr.calculations import KkrimpCalculation
-import tarfile
+from aiida_kkr.data.kkrdos import KkrDosData
+from aiida_kkr.tools.tools_kkrimp import get_output_archive, list_archive_members, read_archive_members
 import os
 
 __copyright__ = (u"Copyright (c), 2019, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.5.7"
+__version__ = "0.6.1"
 __contributors__ = (u"Fabian Bertoldo", u"Philipp Ruessmann")
 
 #TODO: improve workflow output node structure
@@ -31,6 +32,7 @@ Dict = DataFactory('dict')
 RemoteData = DataFactory('remote')
 SinglefileData = DataFactory('singlefile')
 XyData = DataFactory('array.xy')
+ArrayData = DataFactory('array')
 
 
 class kkr_imp_dos_wc(WorkChain):
@@ -63,6 +65,10 @@ class kkr_imp_dos_wc(WorkChain):
 
     _wf_default = {'ef_shift': 0. ,                               # set custom absolute E_F (in eV)
                    'clean_impcalc_retrieved': True,               # remove output of KKRimp calculation after successful parsing of DOS files
+                   'parse_lmdos': True,                           # parse lm-resolved DOS files (`out_lmdos*`) if they are there
+                   'lmdos_params': {'dtype': 'float64',           # data type of the lm-DOS arrays ('float32' halves the size)
+                                    'emin': None,                 # energy window (in eV relative to EF) of the lm-DOS arrays (None: no limit)
+                                    'emax': None},
                   }
 
     # add defaults of dos_params since they are passed onto that workflow
@@ -118,8 +124,12 @@ class kkr_imp_dos_wc(WorkChain):
         spec.output('workflow_info', valid_type=Dict)
         spec.output('last_calc_output_parameters', valid_type=Dict)
         spec.output('last_calc_info', valid_type=Dict)
-        spec.output('dos_data', valid_type=XyData)
-        spec.output('dos_data_interpol', valid_type=XyData)
+        spec.output('dos_data', valid_type=(XyData, KkrDosData))
+        spec.output('dos_data_interpol', valid_type=(XyData, KkrDosData))
+        spec.output('lmdos_data', valid_type=ArrayData, required=False,
+                    help="lm-resolved DOS with shape (atom, spin, energy, lm) and energy axis (in eV relative to EF).")
+        spec.output('lmdos_data_interpol', valid_type=ArrayData, required=False,
+                    help="interpolated lm-resolved DOS with shape (atom, spin, energy, lm) and energy axis (in eV relative to EF).")
         spec.output('gf_dos_remote', valid_type=XyData, required=False,
                     help="RemoteData node of the computed host GF.")
 
@@ -187,6 +197,8 @@ class kkr_imp_dos_wc(WorkChain):
         self.ctx.ef_shift = wf_dict.get('ef_shift', self._wf_default['ef_shift'])
         self.ctx.dos_params_dict = wf_dict.get('dos_params', self._wf_default['dos_params'])
         self.ctx.cleanup_impcalc_output = wf_dict.get('clean_impcalc_retrieved', self._wf_default['clean_impcalc_retrieved'])
+        self.ctx.parse_lmdos = wf_dict.get('parse_lmdos', self._wf_default['parse_lmdos'])
+        self.ctx.lmdos_params = wf_dict.get('lmdos_params', self._wf_default['lmdos_params'])
 
         # set workflow parameters for the KKR impurity calculation
         self.ctx.nsteps = 1 # always only one step for DOS calculation
@@ -436,13 +448,16 @@ class kkr_imp_dos_wc(WorkChain):
             outputnode_t.description = 'Contains information for workflow'
             outputnode_t.store()
             
-            # interpol dos file and store to XyData nodes
+            # interpol dos file and store to KkrDosData nodes
             dos_extracted, dosXyDatas = self.extract_dos_data(last_calc)
             self.report('INFO: extracted DOS data? {}'.format(dos_extracted))
 
             if dos_extracted:
                 self.out('dos_data', dosXyDatas['dos_data'])
                 self.out('dos_data_interpol', dosXyDatas['dos_data_interpol'])
+                for key in ['lmdos_data', 'lmdos_data_interpol']:
+                    if key in dosXyDatas:
+                        self.out(key, dosXyDatas[key])
                 # maybe cleanup retrieved folder of DOS calculation
                 if self.ctx.cleanup_impcalc_output:
                     self.report('INFO: cleanup after storing of DOS data')
@@ -465,7 +480,8 @@ class kkr_imp_dos_wc(WorkChain):
     def extract_dos_data(self, last_calc):
         """
         Extract DOS data from retrieved folder of KKRimp calculation.
-        If output is compressed in tarfile take care of extracting this before parsing `out_ldos*` files.
+        If output is compressed in tarfile the `out_ldos*` files are read directly from the tarball
+        (nothing is extracted to disk).
 
         The extraction of the DOS data is done in `self.extract_dos_data_from_folder()` calls.
 
@@ -477,30 +493,14 @@ class kkr_imp_dos_wc(WorkChain):
         # here we look for the dos files or the tarball containing the dos files:
         dos_retrieved = last_calc.outputs.retrieved
 
-        if KkrimpCalculation._FILENAME_TAR in dos_retrieved.list_object_names():
-            # deal with packed output files (overwrites dos_retrieved with sandbox into which files are extracted
-            # this way the unpacked files are deleted after parsing and only the tarball is kept in the retrieved directory
-
-            # for this we create a Sandbox folder
-            with SandboxFolder() as tempfolder:
-                # get abs paths of tempfolder and tarfile (needed by extract method of tarfile)
-
-                # get abs path of tempfolder
-                with tempfolder.open('.dummy','w') as tmpfile:
-                    tempfolder_path = os.path.dirname(tmpfile.name)
-                # get path of tarfile
-                with dos_retrieved.open(KkrimpCalculation._FILENAME_TAR) as tf:
-                    tfpath = tf.name
-
-                # extract file from tarfile of retrieved to tempfolder
-                with tarfile.open(tfpath) as tf:
-                    tar_filenames = [ifile.name for ifile in tf.getmembers()]
-                    for filename in tar_filenames:
-                        if 'dos' in filename: # should extract all out_ldos*, out_lmdos* files
-                            tf.extract(filename, tempfolder_path) # extract to tempfolder
-
-                # now files are in tempfolder from where we can extract the dos data
-                dos_extracted, dosXyDatas = self.extract_dos_data_from_folder(tempfolder, last_calc)
+        tfpath, archive_info = get_output_archive(dos_retrieved)
+        if tfpath is not None:
+            # deal with packed output files: the dos files are parsed from the tarball directly
+            # the list of files is taken from the archive info of the tarball (scan tarball for older calculations)
+            filelist = list(archive_info.get('file_sizes', {}).keys())
+            if len(filelist)==0:
+                filelist = list_archive_members(tfpath)
+            dos_extracted, dosXyDatas = self.parse_dos_files(filelist, tfpath, last_calc)
         else:
             # extract directly from retrieved (no tarball there)
             dos_extracted, dosXyDatas = self.extract_dos_data_from_folder(dos_retrieved, last_calc)
@@ -513,9 +513,6 @@ class kkr_imp_dos_wc(WorkChain):
         Get DOS data and parse files.
         """
 
-        # initialize in case dos data is not extracted
-        dosXyDatas = None
-
         # get list of files in directory (needed since SandboxFolder does not have `list_object_names` method)
         # also extract absolute path of folder (needed by parse_impdosfiles since calcfunction does not work with SandboxFolder as input)
         if isinstance(folder, SandboxFolder):
@@ -526,6 +523,21 @@ class kkr_imp_dos_wc(WorkChain):
             with folder.open(filelist[0]) as tmpfile:
                 folder_abspath = tmpfile.name.replace(filelist[0], '')
 
+        return self.parse_dos_files(filelist, folder_abspath, last_calc)
+
+
+    def parse_dos_files(self, filelist, dos_abspath, last_calc):
+        """
+        Parse the `out_ldos*` (and `out_lmdos*`) files if they are in `filelist`.
+
+        :param filelist: list of output files of the KKRimp calculation
+        :param dos_abspath: absolute path of the folder or of the tarball containing the dos files
+        :param last_calc: KKRimp calculation
+        """
+
+        # initialize in case dos data is not extracted
+        dosXyDatas = None
+
         # check if out_ldos* files are there and parse dos files
         if 'out_ldos.interpol.atom=01_spin1.dat' in filelist:
             # extract EF and number of atoms from kkrflex_writeout calculation
@@ -535,8 +547,13 @@ class kkr_imp_dos_wc(WorkChain):
             last_calc_output_params = last_calc.outputs.output_parameters
             natom = last_calc_output_params.get_dict().get('number_of_atoms_in_unit_cell')
             # parse dosfiles using nspin, EF and Natom inputs
-            dosXyDatas = parse_impdosfiles(Str(folder_abspath), Int(natom), Int(self.ctx.nspin), Float(ef))
+            dosXyDatas = parse_impdosfiles(Str(dos_abspath), Int(natom), Int(self.ctx.nspin), Float(ef))
             dos_extracted = True
+            # lm-resolved DOS (only there if the 'lmdos' option was set in the KKRimp calculation)
+            if self.ctx.parse_lmdos and 'out_lmdos.interpol.atom=01_spin1.dat' in filelist:
+                dosXyDatas = dict(dosXyDatas)
+                dosXyDatas.update(parse_implmdosfiles(Str(dos_abspath), Int(natom), Int(self.ctx.nspin), Float(ef),
+                                                      Dict(dict=self.ctx.lmdos_params)))
         else:
             dos_extracted = False
             dosXyDatas = None
@@ -544,13 +561,30 @@ class kkr_imp_dos_wc(WorkChain):
         return dos_extracted, dosXyDatas
 
 
+def _get_dosfile_opener(abspath, prefix):
+    """
+    Return function that opens the DOS files (names starting with `prefix`) in the folder or tarball `abspath`.
+    All DOS files are read from the tarball in a single pass.
+    """
+    if os.path.isfile(abspath):
+        # read all dos files from the tarball in a single pass
+        dosfiles = read_archive_members(abspath, lambda name: name.startswith(prefix))
+        open_dosfile = lambda fname: dosfiles[fname]
+    else:
+        # add '/' if missing from path
+        if abspath[-1] != '/': abspath += '/'
+        open_dosfile = lambda fname: open(abspath+fname)
+    return open_dosfile
+
+
 @calcfunction
 def parse_impdosfiles(dos_abspath, natom, nspin, ef):
     """
-    Read `out_ldos*` files and create XyData node with l-resolved DOS (+node for interpolated DOS if files are found)
+    Read `out_ldos*` files and create KkrDosData node with l-resolved DOS (+node for interpolated DOS if files are found)
 
     Inputs:
-    :param dos_abspath: absolute path to folder where `out_ldos*` files reside (AiiDA Str object)
+    :param dos_abspath: absolute path to folder where `out_ldos*` files reside or to the tarball of the
+                        KKRimp output which contains the `out_ldos*` files (AiiDA Str object)
     :param natom: number of atoms (AiiDA Int object)
     :param nspin: number of spin channels (AiiDA Int object)
     :param ef: Fermi energy in Ry units (AiiDA Float object)
@@ -558,26 +592,17 @@ def parse_impdosfiles(dos_abspath, natom, nspin, ef):
     Returns:
     output dictionary containing
       output = {'dos_data': dosnode, 'dos_data_interpol': dosnode2}
-    where `dosnode` and `dosnode2` are AiiDA XyData objects
+    where `dosnode` and `dosnode2` are KkrDosData objects
     """
     from masci_tools.io.common_functions import get_Ry2eV, get_ef_from_potfile
-    from numpy import loadtxt, array
-
-    # add '/' if missing from path
-    abspath = dos_abspath.value
-    if abspath[-1] != '/': abspath += '/'
-
-    # read dos files
-    dos, dos_int = [], []
-    for iatom in range(1, natom.value+1):
-        for ispin in range(1, nspin.value+1):
-            with open(abspath+'out_ldos.atom=%0.2i_spin%i.dat'%(iatom, ispin)) as dosfile:
-                tmp = loadtxt(dosfile)
-                dos.append(tmp)
-            with open(abspath+'out_ldos.interpol.atom=%0.2i_spin%i.dat'%(iatom, ispin)) as dosfile:
-                tmp = loadtxt(dosfile)
-                dos_int.append(tmp)
-    dos, dos_int = array(dos), array(dos_int)
+    from aiida_kkr.tools.dos_files import read_dos_files
+
+    open_dosfile = _get_dosfile_opener(dos_abspath.value, 'out_ldos')
+
+    # read dos files (all atoms and spins into one array with shape (natom*nspin, nE, ncol))
+    atom_spin = [(iatom, ispin) for iatom in range(1, natom.value+1) for ispin in range(1, nspin.value+1)]
+    dos = read_dos_files(open_dosfile, ['out_ldos.atom=%0.2i_spin%i.dat'%(iatom, ispin) for iatom, ispin in atom_spin])
+    dos_int = read_dos_files(open_dosfile, ['out_ldos.interpol.atom=%0.2i_spin%i.dat'%(iatom, ispin) for iatom, ispin in atom_spin])
 
     # convert to eV units
     eVscale = get_Ry2eV()
@@ -587,38 +612,74 @@ def parse_impdosfiles(dos_abspath, natom, nspin, ef):
     dos_int[:,:,1:] = dos_int[:,:,1:]/eVscale
 
     # create output nodes
-    dosnode = XyData()
-    dosnode.label = 'dos_data'
-    dosnode.description = 'Array data containing uniterpolated DOS (i.e. dos at finite imaginary part of energy). 3D array with (atoms, energy point, l-channel) dimensions.'
-    dosnode.set_x(dos[:,:,0], 'E-EF', 'eV')
-
     name = ['tot', 's', 'p', 'd', 'f', 'g']
     name = name[:len(dos[0,0,1:])-1]+['ns']
 
-    ylists = [[],[],[]]
-    for l in range(len(name)):
-        ylists[0].append(dos[:,:,1+l])
-        ylists[1].append('dos '+name[l])
-        ylists[2].append('states/eV')
-    dosnode.set_y(ylists[0], ylists[1], ylists[2])
+    dosnode = KkrDosData()
+    dosnode.label = 'dos_data'
+    dosnode.description = 'Array data containing uniterpolated DOS (i.e. dos at finite imaginary part of energy). 4D array with (atom, spin, l-channel, energy point) dimensions.'
+    dosnode.set_from_rows(dos, nspin.value, name, fermi_energy=ef.value)
 
     # node for interpolated DOS
-    dosnode2 = XyData()
+    dosnode2 = KkrDosData()
     dosnode2.label = 'dos_interpol_data'
-    dosnode2.description = 'Array data containing iterpolated DOS (i.e. dos at finite imaginary part of energy). 3D array with (atoms, energy point, l-channel) dimensions.'
-    dosnode2.set_x(dos_int[:,:,0], 'E-EF', 'eV')
-    ylists = [[],[],[]]
-    for l in range(len(name)):
-        ylists[0].append(dos_int[:,:,1+l])
-        ylists[1].append('interpolated dos '+name[l])
-        ylists[2].append('states/eV')
-    dosnode2.set_y(ylists[0], ylists[1], ylists[2])
+    dosnode2.description = 'Array data containing iterpolated DOS (i.e. dos at finite imaginary part of energy). 4D array with (atom, spin, l-channel, energy point) dimensions.'
+    dosnode2.set_from_rows(dos_int, nspin.value, name, fermi_energy=ef.value, dos_name='interpolated dos')
 
     output = {'dos_data': dosnode, 'dos_data_interpol': dosnode2}
 
     return output
 
 
+@calcfunction
+def parse_implmdosfiles(dos_abspath, natom, nspin, ef, lmdos_params):
+    """
+    Read `out_lmdos*` files and create ArrayData nodes with the lm-resolved DOS (and the interpolated lm-resolved DOS)
+
+    Inputs:
+    :param dos_abspath: absolute path to folder where `out_lmdos*` files reside or to the tarball of the
+                        KKRimp output which contains the `out_lmdos*` files (AiiDA Str object)
+    :param natom: number of atoms (AiiDA Int object)
+    :param nspin: number of spin channels (AiiDA Int object)
+    :param ef: Fermi energy in Ry units (AiiDA Float object)
+    :param lmdos_params: settings of the lm-DOS arrays (AiiDA Dict object) with the keys
+                         'dtype' (e.g. 'float32', default 'float64') and 'emin', 'emax' (energy window in eV relative to EF)
+
+    Returns:
+    output dictionary containing
+      output = {'lmdos_data': lmdosnode, 'lmdos_data_interpol': lmdosnode2}
+    where `lmdosnode` and `lmdosnode2` are AiiDA ArrayData objects with the arrays
+    'energies' (in eV relative to EF) and 'lmdos' (shape (atom, spin, energy, lm), in states/eV)
+    """
+    from aiida_kkr.tools.dos_files import read_dos_files, get_lmdos_arrays
+    import numpy as np
+
+    params = lmdos_params.get_dict()
+    open_dosfile = _get_dosfile_opener(dos_abspath.value, 'out_lmdos')
+
+    output = {}
+    for key, filename_base, label in [('lmdos_data', KkrimpCalculation._OUT_LMDOS_BASE, 'lmdos_data'),
+                                      ('lmdos_data_interpol', KkrimpCalculation._OUT_LMDOS_INTERPOL_BASE, 'lmdos_interpol_data')]:
+        filenames = [(filename_base%(iatom, ispin)).replace(' ', '0') for iatom in range(1, natom.value+1)
+                     for ispin in range(1, nspin.value+1)]
+        data = read_dos_files(open_dosfile, filenames)
+        data = data.reshape((natom.value, nspin.value)+data.shape[1:])
+        energies, lmdos = get_lmdos_arrays(data, ef.value, emin=params.get('emin'), emax=params.get('emax'),
+                                           dtype=np.dtype(params.get('dtype', 'float64')))
+
+        lmdosnode = ArrayData()
+        lmdosnode.label = label
+        lmdosnode.description = 'Array data containing the lm-resolved DOS. 4D array `lmdos` with (atom, spin, energy point, lm) dimensions and energy axis `energies`.'
+        lmdosnode.set_array('energies', energies)
+        lmdosnode.set_array('lmdos', lmdos)
+        lmdosnode.set_attribute('energy_units', 'eV (E-EF)')
+        lmdosnode.set_attribute('dos_units', 'states/eV')
+        lmdosnode.set_attribute('fermi_energy_Ry', ef.value)
+        output[key] = lmdosnode
+
+    return output
+
+
 def cleanup_kkrimp_retrieved(pk_impcalc):
     """
     remove output_all.tar.gz from retrieved of impurity calculation identified by pk_impcalc
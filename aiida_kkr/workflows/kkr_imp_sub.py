@@ -12,6 +12,8 @@ from aiida.engine import WorkChain, ToContext, while_, if_
 from masci_tools.io.kkr_params import kkrparams
 from aiida_kkr.tools.common_workfunctions import test_and_get_codenode, get_inputs_kkrimp, kick_out_corestates_wf
 from aiida_kkr.calculations.kkrimp import KkrimpCalculation
+from aiida_kkr.tools.tools_kkrimp import get_output_archive, read_archive_member
+from aiida_kkr.tools.convergence_arrays import get_convergence_arrays
 from numpy import array
 from six.moves import range
 import tarfile, os
@@ -738,18 +740,11 @@ class kkr_imp_sub_wc(WorkChain):
         # get potential from last calculation
         try:
             retrieved_folder = self.ctx.kkr.outputs.retrieved
-            if KkrimpCalculation._FILENAME_TAR in retrieved_folder.list_object_names():
-                # take potfile after extracting tar file
-                # get full filename
-                with retrieved_folder.open(KkrimpCalculation._FILENAME_TAR) as tar_file:
-                    tarfilename = tar_file.name
-                # open tarfile and extract potfile
-                with tarfile.open(tarfilename) as tar_file:
-                    tar_file.extract(KkrimpCalculation._OUT_POTENTIAL, os.path.dirname(tarfilename))
-                    with retrieved_folder.open(KkrimpCalculation._OUT_POTENTIAL, 'rb') as pot_file:
-                        self.ctx.last_pot = SinglefileData(file=pot_file)
-                    # delete extracted potfile again
-                    retrieved_folder.delete_object(KkrimpCalculation._OUT_POTENTIAL, force=True)
+            tarfilename, archive_info = get_output_archive(retrieved_folder)
+            if tarfilename is not None:
+                # take potfile from tar file (read directly into memory, uncompressed tarballs use their member index)
+                pot_file = read_archive_member(tarfilename, KkrimpCalculation._OUT_POTENTIAL, archive_info)
+                self.ctx.last_pot = SinglefileData(file=pot_file)
             else:
                 # take potfile directly from output
                 with retrieved_folder.open(KkrimpCalculation._OUT_POTENTIAL, 'rb') as pot_file:
@@ -782,7 +777,7 @@ class kkr_imp_sub_wc(WorkChain):
             self.ctx.kkr_converged = last_calc_output['convergence_group']['calculation_converged']
             # check rms
             self.ctx.rms.append(last_calc_output['convergence_group']['rms'])
-            rms_all_iter_last_calc = list(last_calc_output['convergence_group']['rms_all_iterations'])
+            rms_all_iter_last_calc = get_convergence_arrays(self.ctx.last_calc, ['rms_all_iterations'])['rms_all_iterations'].tolist()
 
             # add lists of last iterations
             self.ctx.last_rms_all = rms_all_iter_last_calc
@@ -1016,7 +1011,8 @@ class kkr_imp_sub_wc(WorkChain):
      
         if self.ctx.successful:
             self.report("INFO: clean output of calcs")
-            remove_out_pot_impcalcs(self.ctx.successful, all_pks)
+            bytes_reclaimed = remove_out_pot_impcalcs(self.ctx.successful, all_pks)
+            self.report("INFO: reclaimed {:.2f} MB by removing out_potential files".format(bytes_reclaimed/1024.**2))
             self.report("INFO: clean up raw_input folders")
             clean_raw_input(self.ctx.successful, all_pks)
 
@@ -1044,34 +1040,36 @@ class kkr_imp_sub_wc(WorkChain):
             clean_sfd(sfd_to_clean)
 
 
-def remove_out_pot_impcalcs(successful, pks_all_calcs, dry_run=False):
+def remove_out_pot_impcalcs(successful, pks_all_calcs, dry_run=False, nprocs=None):
     """
     Remove out_potential file from all but the last KKRimp calculation if workflow was successful
+    The tarballs of all calculations are rewritten without out_potential by a pool of worker threads (the tarballs
+    are streamed member by member, nothing is extracted to disk).
     Usage:
         imp_wf = load_node(266885) # maybe start with outer workflow
         pk_imp_scf = imp_wf.outputs.workflow_info['used_subworkflows'].get('kkr_imp_sub')
         imp_scf_wf = load_node(pk_imp_scf) # this is now the imp scf sub workflow
         successful = imp_scf_wf.outputs.workflow_info['successful']
         pks_all_calcs = imp_scf_wf.outputs.workflow_info['pks_all_calcs']
+    :param nprocs: number of worker threads (defaults to the number of cores)
+    :returns: number of bytes that were reclaimed
     """
-    import tarfile, os
     from aiida.orm import load_node
-    from aiida.common.folders import SandboxFolder
     from aiida_kkr.calculations import KkrimpCalculation
+    from aiida_kkr.tools.tools_kkrimp import get_output_archive, remove_archive_members_batch, list_archive_members
     
     if dry_run:
         print('test', successful, len(pks_all_calcs))
 
-    # name of tarfile
-    tfname = KkrimpCalculation._FILENAME_TAR
-    
     # cleanup only if calculation was successful
+    bytes_reclaimed = 0
     if successful and len(pks_all_calcs)>1:
         # remove out_potential for calculations
         # note that also last calc can be cleaned since output potential is stored in single file data
         pks_for_cleanup = pks_all_calcs[:]
 
-        # loop over all calculations
+        # loop over all calculations and collect tarballs (database access is done here, not in the worker threads)
+        archives = []
         for pk in pks_for_cleanup:
             if dry_run:
                 print('pk_for_cleanup:', pk)
@@ -1080,39 +1078,20 @@ def remove_out_pot_impcalcs(successful, pks_all_calcs, dry_run=False):
             ret = calc.outputs.retrieved
 
             # open tarfile if present
-            if tfname in ret.list_object_names():
-                delete_and_retar = False
-                with ret.open(tfname) as tf:
-                    tf_abspath = tf.name
-
-                # create Sandbox folder which is used to temporarily extract output_all.tar.gz
-                tmpfolder = SandboxFolder()
-                tmpfolder_path = tmpfolder.abspath
-                with tarfile.open(tf_abspath) as tf:
-                    tar_filenames = [ifile.name for ifile in tf.getmembers()]
-                    # check if out_potential is in tarfile
-                    if KkrimpCalculation._OUT_POTENTIAL in tar_filenames:
-                        tf.extractall(tmpfolder_path)
-                        delete_and_retar = True
-
-                if delete_and_retar and not dry_run:
-                    # delete out_potential
-                    os.remove(os.path.join(tmpfolder_path, KkrimpCalculation._OUT_POTENTIAL))
-                    with tarfile.open(tf_abspath, 'w:gz') as tf:
-                        # remove out_potential from list of files
-                        tar_filenames = [i for i in tar_filenames if i!=KkrimpCalculation._OUT_POTENTIAL]
-                        for f in tar_filenames:
-                            # create new tarfile without out_potential file
-                            fabs = os.path.join(tmpfolder_path, f)
-                            tf.add(fabs, arcname=os.path.basename(fabs))
-                elif dry_run:
+            tf_abspath, archive_info = get_output_archive(ret)
+            if tf_abspath is not None:
+                archives.append((tf_abspath, archive_info.get('compression', 'gz'), archive_info.get('compresslevel')))
+                if dry_run:
+                    delete_and_retar = KkrimpCalculation._OUT_POTENTIAL in list_archive_members(tf_abspath)
                     print('dry run:')
                     print('delete and retar?', delete_and_retar)
-                    print('tmpfolder_path', tmpfolder_path)
+                    print('tf_abspath', tf_abspath)
+
+        # stream tarfiles into new tarfiles without out_potential
+        if not dry_run:
+            bytes_reclaimed = sum(remove_archive_members_batch(archives, [KkrimpCalculation._OUT_POTENTIAL], nprocs))
 
-                # clean up temporary Sandbox folder
-                if not dry_run:
-                    tmpfolder.erase()
+    return bytes_reclaimed
 
 def clean_raw_input(successful, pks_calcs, dry_run=False):
     """
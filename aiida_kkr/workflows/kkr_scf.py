@@ -20,6 +20,9 @@ from aiida_kkr.tools.common_workfunctions import (test_and_get_codenode, get_inp
                                                   get_parent_paranode, update_params_wf)
 from aiida_kkr.workflows.voro_start import kkr_startpot_wc
 from aiida_kkr.workflows.dos import kkr_dos_wc
+from aiida_kkr.data.kkrdos import KkrDosData
+from aiida_kkr.tools.convergence_arrays import get_convergence_arrays
+from aiida_kkr.tools.dos_checks import check_dos
 from masci_tools.io.common_functions import get_Ry2eV, get_ef_from_potfile
 from numpy import array, where, ones
 from six.moves import range
@@ -27,7 +30,7 @@ from six.moves import range
 __copyright__ = (u"Copyright (c), 2017, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.9.11"
+__version__ = "0.9.14"
 __contributors__ = (u"Jens Broeder", u"Philipp Rüßmann")
 
 #TODO: magnetism (init and converge magnetic state)
@@ -112,6 +115,7 @@ class kkr_scf_wc(WorkChain):
                    'hfield' : 0.02, # Ry                      # external magnetic field used in initialization step
                    'init_pos' : None,                         # position in unit cell where magnetic field is applied [default (None) means apply to all]
                    'retreive_dos_data_scf_run' : False,       # add DOS to testopts and retrieve dos.atom files in each scf run
+                   'parser_profile' : 'full',                 # sections of the output that are parsed in the KKR steps (minimal, scf or full), use scf to skip lattice, k-mesh, symmetry, ewald and timing info
                    }
     _options_default = {'queue_name' : '',                         # Queue name to submit jobs too
                         'resources': {"num_machines": 1},          # resources to allowcate for the job
@@ -160,8 +164,8 @@ class kkr_scf_wc(WorkChain):
         spec.output("last_RemoteData", valid_type=RemoteData, required=False)
         spec.output("last_InputParameters", valid_type=Dict, required=False)
         spec.output("results_vorostart", valid_type=Dict, required=False)
-        spec.output("starting_dosdata_interpol", valid_type=XyData, required=False)
-        spec.output("final_dosdata_interpol", valid_type=XyData, required=False)
+        spec.output("starting_dosdata_interpol", valid_type=(XyData, KkrDosData), required=False)
+        spec.output("final_dosdata_interpol", valid_type=(XyData, KkrDosData), required=False)
 
 
         # Here the structure of the workflow is defined
@@ -314,6 +318,7 @@ class kkr_scf_wc(WorkChain):
 
         # retreive dos data in each scf run
         self.ctx.scf_dosdata = wf_dict.get('retreive_dos_data_scf_run', self._wf_default['retreive_dos_data_scf_run'])
+        self.ctx.parser_profile = wf_dict.get('parser_profile', self._wf_default['parser_profile'])
 
         self.report('INFO: use the following parameter:\n'
                     '\nGeneral settings\n'
@@ -866,6 +871,8 @@ class kkr_scf_wc(WorkChain):
                    "queue_name" : self.ctx.queue}
         if self.ctx.custom_scheduler_commands:
             options["custom_scheduler_commands"] = self.ctx.custom_scheduler_commands
+        # the skipped sections of the output can be parsed later with LazyKkrOutput
+        options["parser_profile"] = self.ctx.parser_profile
         inputs = get_inputs_kkr(code, remote, options, label, description, parameters=params, serial=(not self.ctx.use_mpi))
 
         # run the KKR calculation
@@ -914,10 +921,12 @@ class kkr_scf_wc(WorkChain):
             self.ctx.kkr_converged = last_calc_output['convergence_group']['calculation_converged']
             # check rms
             self.ctx.rms.append(last_calc_output['convergence_group']['rms'])
-            rms_all_iter_last_calc = list(last_calc_output['convergence_group']['rms_all_iterations'])
+            # the histories of rms and charge neutrality are read from the convergence_arrays output
+            histories = get_convergence_arrays(self.ctx.last_calc, ['rms_all_iterations', 'charge_neutrality_all_iterations'])
+            rms_all_iter_last_calc = histories['rms_all_iterations'].tolist()
             #check charge neutrality
             self.ctx.neutr.append(last_calc_output['convergence_group']['charge_neutrality'])
-            neutr_all_iter_last_calc = list(last_calc_output['convergence_group']['charge_neutrality_all_iterations'])
+            neutr_all_iter_last_calc = histories['charge_neutrality_all_iterations'].tolist()
 
             # add lists of last iterations
             self.ctx.last_rms_all = rms_all_iter_last_calc
@@ -948,7 +957,7 @@ class kkr_scf_wc(WorkChain):
         tmplist.append(self.ctx.kkr_step_success)
         self.ctx.KKR_steps_stats['success'] = tmplist
         try:
-            isteps = self.ctx.last_calc.outputs.output_parameters.get_dict()['convergence_group']['number_of_iterations']
+            isteps = last_calc_output['convergence_group']['number_of_iterations']
         except:
             self.ctx.warnings.append('cound not set isteps in KKR_steps_stats dict')
             isteps = -1
@@ -1352,46 +1361,27 @@ class kkr_scf_wc(WorkChain):
             self.ctx.dos_ok = False
             return self.exit_codes.ERROR_DOS_RUN_UNSUCCESFUL
 
-        # check for negative DOS
+        # check for negative DOS and DOS at EMIN
         try:
             dosdata = doscal.outputs.dos_data
+            dosdata_interpol = doscal.outputs.dos_data_interpol
             natom = self.ctx.last_calc.outputs.output_parameters.get_dict()['number_of_atoms_in_unit_cell']
             nspin = dos_outdict['nspin']
+            emin = (self.ctx.dos_params_dict['emin']-self.ctx.efermi)*get_Ry2eV()
 
-            ener = dosdata.get_x()[1] # shape= natom*nspin, nept
-            totdos = dosdata.get_y()[0][1] # shape= natom*nspin, nept
+            report = check_dos(dosdata, dosdata_interpol, natom, nspin, emin, self.ctx.threshold_dos_zero)
 
-            if len(ener) != nspin*natom:
-                self.report("ERROR: DOS output shape does not fit nspin, natom information: len(energies)={}, natom={}, nspin={}".format(len(ener), natom, nspin))
+            if not report['shape_ok']:
+                self.report("ERROR: DOS output shape does not fit nspin, natom information: shape(energies)={}, natom={}, nspin={}".format(report['shape'], natom, nspin))
                 self.ctx.doscheck_ok = False
                 return self.exit_codes.ERROR_DOS_RUN_UNSUCCESFUL
 
-            # deal with snpin==1 or 2 cases and check negtive DOS
-            for iatom in range(natom//nspin):
-                for ispin in range(nspin):
-                    x, y = ener[iatom*nspin+ispin], totdos[iatom*nspin+ispin]
-                    if nspin == 2 and ispin == 0:
-                        y = -y
-                    if y.min() < 0:
-                        self.report("INFO: negative DOS value found in (atom, spin)=({},{}) at iteration {}: {}".format(iatom, ispin, self.ctx.loop_count, y.min()))
-                        self.ctx.dos_ok = False
-
-            # check starting EMIN
-            dosdata_interpol = doscal.outputs.dos_data_interpol
-
-            ener = dosdata_interpol.get_x()[1] # shape= natom*nspin, nept
-            totdos = dosdata_interpol.get_y()[0][1] # shape= natom*nspin, nept
-            Ry2eV = get_Ry2eV()
-
-            for iatom in range(natom//nspin):
-                for ispin in range(nspin):
-                    x, y = ener[iatom*nspin+ispin], totdos[iatom*nspin+ispin]
-                    xrel = abs(x-(self.ctx.dos_params_dict['emin']-self.ctx.efermi)*Ry2eV)
-                    mask_emin = where(xrel==xrel.min())
-                    ymin = abs(y[mask_emin])
-                    if ymin > self.ctx.threshold_dos_zero:
-                        self.report("INFO: DOS at emin not zero! {}>{}".format(ymin,self.ctx.threshold_dos_zero))
-                        self.ctx.dos_ok = False
+            for iatom, ispin, dosmin in report['negative_dos']:
+                self.report("INFO: negative DOS value found in (atom, spin)=({},{}) at iteration {}: {}".format(iatom, ispin, self.ctx.loop_count, dosmin))
+            for iatom, ispin, dos_emin in report['dos_at_emin']:
+                self.report("INFO: DOS at emin not zero! {}>{} in (atom, spin)=({},{})".format(dos_emin, self.ctx.threshold_dos_zero, iatom, ispin))
+            if not report['dos_ok']:
+                self.ctx.dos_ok = False
         except AttributeError:
             self.ctx.dos_ok = False
 
@@ -16,6 +16,8 @@ from aiida.engine import WorkChain, while_, if_, ToContext, submit, calcfunction
 from aiida_kkr.calculations.kkr import KkrCalculation
 from aiida_kkr.calculations.voro import VoronoiCalculation
 from aiida_kkr.workflows.dos import kkr_dos_wc
+from aiida_kkr.data.kkrdos import KkrDosData
+from aiida_kkr.tools.dos_checks import check_dos
 from aiida_kkr.tools import find_cluster_radius
 from aiida_kkr.tools.common_workfunctions import (test_and_get_codenode, update_params,
                                                   update_params_wf, get_inputs_voronoi)
@@ -24,7 +26,7 @@ from aiida_kkr.tools.common_workfunctions import (test_and_get_codenode, update_
 __copyright__ = (u"Copyright (c), 2017-2018, Forschungszentrum Jülich GmbH, "
                  "IAS-1/PGI-1, Germany. All rights reserved.")
 __license__ = "MIT license, see LICENSE.txt file"
-__version__ = "0.10.6"
+__version__ = "0.10.8"
 __contributors__ = u"Philipp Rüßmann"
 
 StructureData = DataFactory('structure')
@@ -109,8 +111,8 @@ class kkr_startpot_wc(WorkChain):
         spec.output('last_voronoi_results', valid_type=Dict, required=False, help='')
         spec.output('last_voronoi_remote', valid_type=RemoteData, required=False, help='')
         spec.output('last_params_voronoi', valid_type=Dict, required=False, help='')
-        spec.output('last_doscal_dosdata', valid_type=XyData, required=False, help='')
-        spec.output('last_doscal_dosdata_interpol', valid_type=XyData, required=False, help='')
+        spec.output('last_doscal_dosdata', valid_type=(XyData, KkrDosData), required=False, help='')
+        spec.output('last_doscal_dosdata_interpol', valid_type=(XyData, KkrDosData), required=False, help='')
         # definition of exit codes if the workflow needs to be terminated
         spec.exit_code(201, 'ERROR_INVALID_KKRCODE',
           message='The code you provided for kkr does not use the plugin kkr.kkr')
@@ -203,8 +205,9 @@ class kkr_startpot_wc(WorkChain):
         self.ctx.fac_clsincrease = wf_dict.get('fac_cls_increase', self._wf_default['fac_cls_increase'])
         self.ctx.efermi = None
 
-        # find starting cluster radius
-        self.ctx.r_cls = find_cluster_radius(self.inputs.structure, self.ctx.nclsmin/1.15, nbins=100)[1] # find cluster radius (in alat units)
+        # find starting cluster radius (with the same margin of 1.15 on the number of atoms as before,
+        # the exact k-th neighbor radius only replaces the histogram of the radii)
+        self.ctx.r_cls = find_cluster_radius(self.inputs.structure, self.ctx.nclsmin/1.15, exact=True)[1] # find cluster radius (in alat units)
 
         # difference in eV to emin (e_fermi) if emin (emax) are larger (smaller) than emin (e_fermi)
         self.ctx.delta_e = wf_dict.get('delta_e_min', self._wf_default['delta_e_min'])
@@ -583,48 +586,32 @@ class kkr_startpot_wc(WorkChain):
             # needed for checks
             emin = self.ctx.voro_calc.res.emin
 
-            # check for negative DOS
+            # check for negative DOS and DOS at EMIN
             try:
                 dosdata = doscal.outputs.dos_data
+                dosdata_interpol = doscal.outputs.dos_data_interpol
                 natom = len(self.ctx.voro_calc.res.shapes)
                 nspin = dos_outdict['nspin']
 
-                ener = dosdata.get_x()[1] # shape= natom*nspin, nept
-                totdos = dosdata.get_y()[0][1] # shape= natom*nspin, nept
+                report = check_dos(dosdata, dosdata_interpol, natom, nspin, (emin-self.ctx.efermi)*get_Ry2eV(),
+                                   self.ctx.threshold_dos_zero)
 
-                if len(ener) != nspin*natom:
-                    self.report("ERROR: DOS output shape does not fit nspin, natom information: len(energies)={}, natom={}, nspin={}".format(len(ener), natom, nspin))
+                if not report['shape_ok']:
+                    self.report("ERROR: DOS output shape does not fit nspin, natom information: shape(energies)={}, natom={}, nspin={}".format(report['shape'], natom, nspin))
                     self.ctx.doscheck_ok = False
                     return self.exit_codes.ERROR_DOSRUN_FAILED
 
-                # deal with snpin==1 or 2 cases and check negtive DOS
-                for iatom in range(natom//nspin):
-                    for ispin in range(nspin):
-                        x, y = ener[iatom*nspin+ispin], totdos[iatom*nspin+ispin]
-                        if nspin == 2 and ispin == 0:
-                            y = -y
-                        if y.min() < 0:
-                            self.report("INFO: negative DOS value found in (atom, spin)=({},{}) at iteration {}".format(iatom, ispin, self.ctx.iter))
-                            dos_ok = False
-                            self.ctx.dos_check_fail_reason = 'DOS negative'
-
-                # check starting EMIN
-                dosdata_interpol = doscal.outputs.dos_data_interpol
+                for iatom, ispin, dosmin in report['negative_dos']:
+                    self.report("INFO: negative DOS value found in (atom, spin)=({},{}) at iteration {}".format(iatom, ispin, self.ctx.iter))
+                if report['negative_dos'] != []:
+                    dos_ok = False
+                    self.ctx.dos_check_fail_reason = 'DOS negative'
 
-                ener = dosdata_interpol.get_x()[1] # shape= natom*nspin, nept
-                totdos = dosdata_interpol.get_y()[0][1] # shape= natom*nspin, nept [0] for total DOS
-                Ry2eV = get_Ry2eV()
-
-                for iatom in range(natom//nspin):
-                    for ispin in range(nspin):
-                        x, y = ener[iatom*nspin+ispin], totdos[iatom*nspin+ispin]
-                        xrel = abs(x-(emin-self.ctx.efermi)*Ry2eV)
-                        mask_emin = where(xrel==xrel.min())
-                        ymin = abs(y[mask_emin])
-                        if ymin > self.ctx.threshold_dos_zero:
-                            self.report("INFO: DOS at emin not zero! {}>{}".format(ymin,self.ctx.threshold_dos_zero))
-                            dos_ok = False
-                            self.ctx.dos_check_fail_reason = 'EMIN too high'
+                for iatom, ispin, dos_emin in report['dos_at_emin']:
+                    self.report("INFO: DOS at emin not zero! {}>{} in (atom, spin)=({},{})".format(dos_emin, self.ctx.threshold_dos_zero, iatom, ispin))
+                if report['dos_at_emin'] != []:
+                    dos_ok = False
+                    self.ctx.dos_check_fail_reason = 'EMIN too high'
             except AttributeError:
                 dos_ok = False
 